@@ -1,4 +1,4 @@
-﻿from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, Response
+﻿from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context
 from functools import wraps
 from urllib.parse import urlparse
 from models import (
@@ -19,10 +19,13 @@ from datetime import datetime, timedelta
 import csv
 import json
 import io
+import os
 import threading
 from collections import OrderedDict
 from sqlalchemy import func, case, or_
 from retention_service import cleanup_expired_data
+from pagination import paginate_keyset
+from responses import iter_json_array
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -119,6 +122,11 @@ DATA_EXPORT_MODELS = [
     ('lottery_draws', LotteryDraw),
 ]
 
+# 导出时每张表按主键分批读取的行数
+DATA_EXPORT_BATCH_SIZE = 500
+# 2 起流式导出，counts 写在文件末尾且导入时必须存在
+DATA_EXPORT_VERSION = 2
+
 DATA_EXPORT_LABELS = {
     'users': '用户',
     'activation_codes': '激活码',
@@ -396,22 +404,48 @@ def _deserialize_model_row(model, row):
     return model(**values)
 
 
-def _build_data_export_payload():
-    exported_at = datetime.now().isoformat()
-    data = {}
+def _load_data_export_batch(model, last_id=None):
+    query = model.query.order_by(model.id.asc())
+    if last_id is not None:
+        query = query.filter(model.id > last_id)
+    batch = [_serialize_model_row(row) for row in query.limit(DATA_EXPORT_BATCH_SIZE).all()]
+    # 每批读完就结束读事务，客户端下载慢时不会一直占着数据库的读锁
+    db.session.rollback()
+    return batch
+
+
+def _load_data_export_first_batches():
+    """在发出响应头之前把每张表的第一批读出来，表结构或连接有问题时还能按原来的方式提示失败。"""
+    return {key: _load_data_export_batch(model) for key, model in DATA_EXPORT_MODELS}
+
+
+def _iter_data_export_rows(model, counts, key, batch):
+    while True:
+        for item in batch:
+            counts[key] += 1
+            yield item
+        if len(batch) < DATA_EXPORT_BATCH_SIZE:
+            return
+        batch = _load_data_export_batch(model, batch[-1]['id'])
+
+
+def _iter_data_export_chunks(exported_at, first_batches):
+    """按表分批写出备份 JSON，不在内存里拼整份文档。
+
+    counts 放在最后，和实际写出的行数一致；导入时按它核对每张表的行数，
+    中途出错被截断的文件会被拒绝。
+    """
     counts = {}
-    for key, model in DATA_EXPORT_MODELS:
-        rows = model.query.order_by(model.id.asc()).all()
-        data[key] = [_serialize_model_row(row) for row in rows]
-        counts[key] = len(data[key])
-    return {
-        "meta": {
-            "exported_at": exported_at,
-            "version": 1,
-        },
-        "counts": counts,
-        "data": data,
-    }
+    try:
+        yield '{"meta": ' + json.dumps({"exported_at": exported_at, "version": DATA_EXPORT_VERSION}) + ',\n"data": {'
+        for index, (key, model) in enumerate(DATA_EXPORT_MODELS):
+            counts[key] = 0
+            yield ('' if index == 0 else ',') + '\n' + json.dumps(key) + ': '
+            yield from iter_json_array(_iter_data_export_rows(model, counts, key, first_batches[key]), separator=',\n')
+        yield '\n},\n"counts": ' + json.dumps(counts) + '}\n'
+    except Exception as e:
+        print(f"导出全部数据失败: {e}")
+        raise
 
 
 def _validate_import_payload(payload):
@@ -421,6 +455,23 @@ def _validate_import_payload(payload):
     if not isinstance(data, dict):
         raise ValueError("导入文件缺少 data 节点")
 
+    meta = payload.get("meta") if isinstance(payload.get("meta"), dict) else {}
+    counts = payload.get("counts")
+    try:
+        version = int(meta.get("version") or 1)
+    except (TypeError, ValueError):
+        version = 1
+    if counts is None and version >= 2:
+        raise ValueError("导入文件缺少 counts 校验信息，可能是导出中断的不完整文件")
+    if counts is not None:
+        if not isinstance(counts, dict):
+            raise ValueError("导入文件的 counts 节点格式不正确")
+        for key, expected in counts.items():
+            actual = len(data.get(key) or [])
+            if actual != expected:
+                label = DATA_EXPORT_LABELS.get(key, key)
+                raise ValueError(f"{label}行数与 counts 不一致（{actual}/{expected}），文件可能不完整")
+
     users = data.get("users") or []
     if not any(bool(item.get("is_admin")) for item in users):
         raise ValueError("导入数据里至少需要保留一个管理员账号")
@@ -461,9 +512,30 @@ def _import_data_payload(payload, mode):
 
     db.session.commit()
     ZodiacSetting._macau_year_match_cache.clear()
+    ZodiacSetting.bump_settings_generation()
+    _invalidate_zodiac_dependent_responses()
+    _invalidate_prediction_settlements()
     return imported_counts
 
 
+def _invalidate_prediction_settlements(region=None):
+    try:
+        from app import invalidate_prediction_settlement_state
+        invalidate_prediction_settlement_state(region)
+    except Exception as e:
+        print(f"刷新预测结算计数失败: {e}")
+
+
+def _invalidate_zodiac_dependent_responses():
+    try:
+        from app import _clear_latest_draw_marker_cache, _clear_markov_state_cache, refresh_hk_draw_displays
+        refresh_hk_draw_displays()
+        _clear_latest_draw_marker_cache()
+        _clear_markov_state_cache()
+    except Exception as e:
+        print(f"刷新开奖接口缓存标记失败: {e}")
+
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -775,22 +847,226 @@ def clear_system_logs_view():
     })
 
 
+def _ai_metric_tables(samples):
+    hosts = {}
+    modes = {}
+    chat = {'active': 0, 'max_active': 0}
+    for sample in samples:
+        name, labels, value = sample['name'], sample['labels'], sample['value']
+        if name.startswith('ai_http_'):
+            hosts.setdefault(labels.get('host', ''), {})[name[len('ai_http_'):]] = value
+        elif name.startswith('ai_chat_') and 'mode' in labels:
+            modes.setdefault(labels['mode'], {})[name[len('ai_chat_'):]] = value
+        elif name in ('ai_chat_active', 'ai_chat_max_active'):
+            chat[name[len('ai_chat_'):]] = value
+
+    host_rows = []
+    for host, item in sorted(hosts.items()):
+        requests_count = item.get('requests_total', 0)
+        reused = item.get('reused_connections_total', 0)
+        connected = reused + item.get('new_connections_total', 0)
+        host_rows.append({
+            'host': host,
+            'requests': requests_count,
+            'errors': item.get('errors_total', 0),
+            'retries': item.get('retries_total', 0),
+            'reuse_rate': round(reused / connected * 100, 1) if connected else 0.0,
+            'avg_ms': round(item.get('seconds_total', 0) * 1000 / requests_count, 1) if requests_count else 0.0,
+            'max_ms': round(item.get('seconds_max', 0) * 1000, 1),
+        })
+    mode_rows = []
+    for mode, item in sorted(modes.items()):
+        requests_count = item.get('requests_total', 0)
+        mode_rows.append({
+            'mode': mode,
+            'requests': requests_count,
+            'errors': item.get('errors_total', 0),
+            'disconnects': item.get('disconnects_total', 0),
+            'avg_ttfb_ms': round(item.get('ttfb_seconds_total', 0) * 1000 / requests_count, 1) if requests_count else 0.0,
+            'max_ttfb_ms': round(item.get('ttfb_seconds_max', 0) * 1000, 1),
+            'avg_occupancy_ms': round(item.get('occupancy_seconds_total', 0) * 1000 / requests_count, 1) if requests_count else 0.0,
+        })
+    return host_rows, mode_rows, chat
+
+
+@admin_bp.route('/metrics')
+@admin_required
+def metrics():
+    from app import request_metrics
+
+    merged = request_metrics.merged_snapshot()
+    rows = request_metrics.endpoint_rows(merged)
+    ai_hosts, ai_chat_modes, ai_chat = _ai_metric_tables(merged['samples'])
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'success': True,
+            'workers': merged['workers'],
+            'endpoints': rows,
+            'ai_hosts': ai_hosts,
+            'ai_chat_modes': ai_chat_modes,
+            'ai_chat': ai_chat,
+        })
+    return render_template(
+        'admin/metrics.html',
+        rows=rows,
+        workers=merged['workers'],
+        ai_hosts=ai_hosts,
+        ai_chat_modes=ai_chat_modes,
+        ai_chat=ai_chat,
+        slow_ms=request_metrics.slow_ms,
+    )
+
+
+def _prediction_stage_rows(samples, window_rows):
+    totals = {}
+    for sample in samples:
+        name = sample['name']
+        if name.startswith('prediction_stage_'):
+            totals.setdefault(sample['labels'].get('stage', ''), {})[name[len('prediction_stage_'):]] = sample['value']
+    windows = {row['stage']: row for row in window_rows}
+
+    rows = []
+    for stage in sorted(set(totals) | set(windows), key=lambda item: item.split('/')):
+        item = totals.get(stage, {})
+        window = windows.get(stage) or {}
+        calls = item.get('calls_total', 0)
+        seconds = item.get('seconds_total', 0)
+        parent = stage.rpartition('/')[0]
+        parent_seconds = totals.get(parent, {}).get('seconds_total', 0) if parent else 0
+        rows.append({
+            'stage': stage,
+            'name': stage.rpartition('/')[2],
+            'depth': stage.count('/'),
+            'calls': calls,
+            'avg_ms': round(seconds * 1000 / calls, 1) if calls else 0.0,
+            'max_ms': round(item.get('seconds_max', 0) * 1000, 1),
+            'share_of_parent': round(seconds / parent_seconds * 100, 1) if parent_seconds else None,
+            'window': window.get('window', 0),
+            'p50_ms': window.get('p50_ms'),
+            'p95_ms': window.get('p95_ms'),
+            'last_ms': window.get('last_ms'),
+            'last_at': datetime.fromtimestamp(window['last_at']).strftime('%Y-%m-%d %H:%M:%S') if window.get('last_at') else '',
+        })
+    return rows
+
+
+@admin_bp.route('/prediction_stages')
+@admin_required
+def prediction_stages():
+    from app import request_metrics
+    from tracing import stage_stats
+
+    merged = request_metrics.merged_snapshot()
+    rows = _prediction_stage_rows(merged['samples'], stage_stats.rows())
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'success': True,
+            'workers': merged['workers'],
+            'window_size': stage_stats.window,
+            'stages': rows,
+        })
+    return render_template(
+        'admin/prediction_stages.html',
+        rows=rows,
+        workers=merged['workers'],
+        window_size=stage_stats.window,
+    )
+
+
+def _cache_rows(samples, local_rows):
+    totals = {}
+    for sample in samples:
+        name = sample['name']
+        if name.startswith('cache_'):
+            totals.setdefault(sample['labels'].get('cache', ''), {})[name[len('cache_'):]] = sample['value']
+
+    rows = []
+    for row in local_rows:
+        item = totals.get(row['name'], {})
+        hits = item.get('hits_total', row['hits'])
+        misses = item.get('misses_total', row['misses'])
+        rows.append(dict(
+            row,
+            all_hits=hits,
+            all_misses=misses,
+            all_hit_rate=round(hits / (hits + misses) * 100, 1) if hits + misses else None,
+            all_evictions=item.get('evictions_total', row['evictions']),
+            all_entries=item.get('entries', row['entries']),
+            last_flush_at=datetime.fromtimestamp(row['last_flush_at']).strftime('%Y-%m-%d %H:%M:%S') if row['last_flush_at'] else '',
+        ))
+    return rows
+
+
+@admin_bp.route('/caches')
+@admin_required
+def caches():
+    from app import request_metrics
+    from cache_registry import cache_registry
+
+    merged = request_metrics.merged_snapshot()
+    rows = _cache_rows(merged['samples'], cache_registry.rows())
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'success': True,
+            'pid': os.getpid(),
+            'workers': merged['workers'],
+            'caches': rows,
+        })
+    return render_template(
+        'admin/caches.html',
+        rows=rows,
+        pid=os.getpid(),
+        workers=merged['workers'],
+        total_bytes=sum(row['approx_bytes'] for row in rows),
+    )
+
+
+@admin_bp.route('/caches/flush', methods=['POST'])
+@admin_required
+def flush_caches():
+    from app import flush_caches_everywhere
+
+    payload = request.get_json(silent=True) or request.form
+    name = str(payload.get('cache') or '').strip() or None
+    region = str(payload.get('region') or '').strip().lower() or None
+    if region and region not in ('hk', 'macau'):
+        return jsonify({'success': False, 'message': '无效的地区参数'}), 400
+    try:
+        removed = flush_caches_everywhere(name, region)
+    except KeyError:
+        return jsonify({'success': False, 'message': f'未知的缓存：{name}'}), 400
+    except ValueError:
+        return jsonify({'success': False, 'message': f'缓存 {name} 不分地区，不能按地区清空'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'清空缓存失败：{e}'}), 500
+    target = name or '全部缓存'
+    if region:
+        target += f'（{region}）'
+    return jsonify({
+        'success': True,
+        'message': f'已清空{target}，本进程移除 {sum(removed.values())} 条，其他 worker 会在几秒内同步',
+        'removed': removed,
+    })
+
+
 @admin_bp.route('/data_transfer/export')
 @admin_required
 def export_all_data():
+    exported_at = datetime.now()
     try:
-        payload = _build_data_export_payload()
-        exported_at = datetime.now().strftime('%Y%m%d_%H%M%S')
-        return Response(
-            json.dumps(payload, ensure_ascii=False, indent=2),
-            mimetype='application/json',
-            headers={
-                'Content-Disposition': f'attachment; filename=mark_six_backup_{exported_at}.json'
-            }
-        )
+        first_batches = _load_data_export_first_batches()
     except Exception as e:
+        db.session.rollback()
         flash(f'导出全部数据失败: {str(e)}', 'error')
         return redirect(url_for('admin.data_transfer'))
+    return Response(
+        stream_with_context(_iter_data_export_chunks(exported_at.isoformat(), first_batches)),
+        mimetype='application/json',
+        headers={
+            'Content-Disposition': f'attachment; filename=mark_six_backup_{exported_at.strftime("%Y%m%d_%H%M%S")}.json'
+        }
+    )
 
 
 @admin_bp.route('/data_transfer/import', methods=['POST'])
@@ -1068,6 +1344,8 @@ def delete_user(user_id):
         }
         db.session.delete(user)
         db.session.commit()
+        if deleted_counts['predictions']:
+            _invalidate_prediction_settlements()
         return jsonify({
             'success': True,
             'message': '用户删除成功',
@@ -1759,9 +2037,13 @@ def bets():
 
         stats = stats_row.one()
 
-        bets = query.order_by(ManualBetRecord.created_at.desc()).paginate(
-            page=page, per_page=20, error_out=False
-        )
+        # “下一页”带上一页末条的游标，全量下注记录翻到很深也只是一次索引定位
+        cursor = request.args.get('cursor', '').strip()
+        keyset_columns = (ManualBetRecord.created_at, ManualBetRecord.id)
+        try:
+            bets = paginate_keyset(query, keyset_columns, page, 20, stats[0] or 0, cursor=cursor)
+        except ValueError:
+            bets = paginate_keyset(query, keyset_columns, page, 20, stats[0] or 0)
 
         user_ids = {record.user_id for record in bets.items}
         user_map = {}
@@ -1804,6 +2086,7 @@ def bets():
                 self.has_next = False
                 self.prev_num = None
                 self.next_num = None
+                self.next_cursor = None
 
         empty_bets = EmptyPagination()
         return render_template(
@@ -1860,6 +2143,7 @@ def delete_prediction(prediction_id):
             db.session.delete(item)
             deleted_count += 1
         db.session.commit()
+        _invalidate_prediction_settlements(prediction.region)
         flash('预测记录删除成功', 'success')
     except Exception as e:
         db.session.rollback()
@@ -1902,6 +2186,8 @@ def delete_predictions_batch():
                 deleted_count += 1
         
         db.session.commit()
+        for region in {item[0] for item in signature_filters}:
+            _invalidate_prediction_settlements(region)
         flash(f'成功删除 {deleted_count} 条预测记录', 'success')
     except Exception as e:
         db.session.rollback()
@@ -1916,6 +2202,7 @@ def clear_all_predictions():
         count = PredictionRecord.query.count()
         PredictionRecord.query.delete()
         db.session.commit()
+        _invalidate_prediction_settlements()
         flash(f'成功清空所有预测记录，共删除 {count} 条记录', 'success')
     except Exception as e:
         db.session.rollback()
@@ -2215,6 +2502,7 @@ def save_zodiac_settings():
         success, message = ZodiacSetting.batch_update_settings(year, settings)
         
         if success:
+            _invalidate_zodiac_dependent_responses()
             return jsonify({'success': True, 'message': message})
         else:
             return jsonify({'success': False, 'message': message})
@@ -2243,6 +2531,9 @@ def reset_zodiac_settings():
         # 删除该年份的所有自定义设置，系统将自动使用默认规则
         ZodiacSetting.query.filter_by(year=year).delete()
         db.session.commit()
+        ZodiacSetting._macau_year_match_cache.clear()
+        ZodiacSetting.bump_settings_generation()
+        _invalidate_zodiac_dependent_responses()
         
         return jsonify({'success': True, 'message': '生肖设置已重置为默认值'})
         
@@ -1,7 +1,6 @@
 from datetime import datetime, timedelta
 import json
 import math
-import time
 from collections import OrderedDict
 import secrets
 from urllib.parse import urlencode
@@ -31,15 +30,17 @@ from auth import (
     send_reset_email,
     send_activation_request_notification,
 )
+from pagination import decode_cursor, keyset_before, row_cursor
+from rate_limiter import get_rate_limiter
 
 
 mobile_api_bp = Blueprint("mobile_api", __name__, url_prefix="/api/mobile")
 
 STRATEGY_KEYS = ["hot", "cold", "trend", "hybrid", "balanced", "markov", "ml", "ai"]
 LOCAL_STRATEGIES = ["hot", "cold", "trend", "hybrid", "balanced", "markov", "ml"]
+_PREDICTION_KEYSET_COLUMNS = (PredictionRecord.created_at, PredictionRecord.id)
 _RED_BALLS = {1, 2, 7, 8, 12, 13, 18, 19, 23, 24, 29, 30, 34, 35, 40, 45, 46}
 _BLUE_BALLS = {3, 4, 9, 10, 14, 15, 20, 25, 26, 31, 36, 37, 41, 42, 47, 48}
-_RATE_LIMITS = {}
 _MOBILE_CSRF_EXEMPT_ENDPOINTS = {
     "mobile_api.api_auth_config",
     "mobile_api.api_github_auth_url",
@@ -309,22 +310,7 @@ def _client_ip():
 
 
 def _rate_limited(key, limit, window_seconds):
-    now = time.time()
-    cutoff = now - window_seconds
-    attempts = [item for item in _RATE_LIMITS.get(key, []) if item >= cutoff]
-    if len(attempts) >= limit:
-        _RATE_LIMITS[key] = attempts
-        return True
-    attempts.append(now)
-    _RATE_LIMITS[key] = attempts
-    if len(_RATE_LIMITS) > 5000:
-        for existing_key in list(_RATE_LIMITS.keys())[:1000]:
-            _RATE_LIMITS[existing_key] = [
-                item for item in _RATE_LIMITS[existing_key] if item >= cutoff
-            ]
-            if not _RATE_LIMITS[existing_key]:
-                _RATE_LIMITS.pop(existing_key, None)
-    return False
+    return get_rate_limiter().hit(f"mobile:{key}", limit, window_seconds)
 
 
 def _get_mobile_csrf_token():
@@ -1943,6 +1929,11 @@ def api_predictions():
     include_details = request.args.get("include_details", "1").strip() != "0"
     include_total = request.args.get("include_total", "1").strip() != "0"
     year_param = request.args.get("year", "").strip()
+    cursor = request.args.get("cursor", "").strip()
+    try:
+        cursor_values = decode_cursor(cursor, len(_PREDICTION_KEYSET_COLUMNS)) if cursor else None
+    except ValueError as e:
+        return _json_error(str(e))
 
     query = PredictionRecord.query.filter_by(user_id=user.id)
     if region:
@@ -1997,12 +1988,13 @@ def api_predictions():
             )
         )
 
-    records = (
-        query.order_by(PredictionRecord.created_at.desc())
-        .offset((page - 1) * page_size)
-        .limit(page_size)
-        .all()
-    )
+    query = query.order_by(*[column.desc() for column in _PREDICTION_KEYSET_COLUMNS])
+    if cursor_values is not None:
+        query = query.filter(keyset_before(_PREDICTION_KEYSET_COLUMNS, cursor_values))
+    else:
+        query = query.offset((page - 1) * page_size)
+    records = query.limit(page_size).all()
+    next_cursor = row_cursor(records[-1], _PREDICTION_KEYSET_COLUMNS) if len(records) == page_size else None
 
     zodiac_map_cache = {}
     draw_cache = {}
@@ -2102,6 +2094,7 @@ def api_predictions():
             "page": page,
             "page_size": page_size,
             "total": total,
+            "next_cursor": next_cursor,
             "items": items,
             "region_summaries": (
                 _build_region_summaries(user.id, region) if include_summaries else []
@@ -1,18 +1,25 @@
 ﻿from flask import Flask, jsonify, render_template, request, session, redirect, url_for, flash
 from flask import Response, stream_with_context
 from flask_login import LoginManager, current_user
+import array
+import base64
 import json
 import hashlib
 import math
 import os
 import copy
+import random
 import sys
 import requests
 import secrets
 import threading
 import hmac
+import weakref
 from contextlib import contextmanager
-from collections import Counter
+from functools import wraps
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from collections import Counter, deque
+from itertools import chain
 import re
 from urllib.parse import quote_plus, urlparse
 from datetime import datetime, timedelta
@@ -20,13 +27,20 @@ import time
 from markupsafe import escape
 from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_MISSED
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 # 导入用户系统模块
-from models import db, User, PredictionRecord, SystemConfig, InviteCode, LotteryDraw, ManualBetRecord, BacktestRun
+from cache_registry import cache_registry
+from models import db, User, PredictionRecord, SystemConfig, InviteCode, LotteryDraw, ManualBetRecord, BacktestRun, PeriodPrediction, MarkovState, AIPredictionCache
+from pagination import decode_cursor, encode_cursor, keyset_before
+from rate_limiter import get_rate_limiter
+from request_metrics import RequestMetrics
+from responses import compress_response, iter_json_array
 from retention_service import cleanup_expired_data
+from tracing import current_span, span, stage_stats, traced
 from auth import auth_bp
 from admin import admin_bp
 from user import user_bp
@@ -50,9 +64,41 @@ def _env_float(name, default):
 _ML_PREDICTION_CACHE_TTL_SECONDS = 900
 _ML_PREDICTION_CACHE_MAX_ITEMS = 24
 _AI_PREDICTION_CACHE_TTL_SECONDS = 300
+# 跟随请求按领跑请求最长可能的耗时（预算 + 保底首个采样多等的一次读超时）等待，
+# 再多等这么久，仍无结果才自己重新请求。
+_AI_PREDICTION_FLIGHT_GRACE_SECONDS = 5
+# JSON/HTML 响应超过这个字节数且客户端支持时用 gzip 压缩；前面已有反向代理压缩时可以关掉。
+_RESPONSE_GZIP_ENABLED = os.environ.get("RESPONSE_GZIP_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+_RESPONSE_GZIP_MIN_BYTES = max(0, int(_env_float("RESPONSE_GZIP_MIN_BYTES", 1024)))
+_RESPONSE_GZIP_LEVEL = min(9, max(1, int(_env_float("RESPONSE_GZIP_LEVEL", 6))))
+# Prometheus 抓取 /metrics 用的令牌；不设置时只有管理员登录态能访问。
+_METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "").strip()
+# 打开后预测结果的 model_meta 会带上各阶段耗时（stage_timings_ms），调试模式下默认打开。
+_PREDICTION_TRACE_IN_META = os.environ.get("PREDICTION_TRACE_META", "").lower() in ("1", "true", "yes", "on")
 _AI_HTTP_CONNECT_TIMEOUT_SECONDS = _env_float("AI_HTTP_CONNECT_TIMEOUT_SECONDS", 10)
 _AI_HTTP_READ_TIMEOUT_SECONDS = _env_float("AI_HTTP_READ_TIMEOUT_SECONDS", 90)
+_AI_SAMPLE_MAX_WORKERS = max(1, int(_env_float("AI_SAMPLE_MAX_WORKERS", 4)))
+# 每个 AI 接口地址一个长连接池，容量按并发采样数再留出聊天/流式请求的余量。
+_AI_HTTP_POOL_MAXSIZE = max(2, int(_env_float("AI_HTTP_POOL_MAXSIZE", _AI_SAMPLE_MAX_WORKERS + 2)))
+_AI_HTTP_MAX_RETRIES = max(0, int(_env_float("AI_HTTP_MAX_RETRIES", 2)))
+_AI_HTTP_RETRY_BACKOFF_SECONDS = _env_float("AI_HTTP_RETRY_BACKOFF_SECONDS", 0.6)
+_AI_HTTP_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# 没有采样预算的 AI 调用（聊天、流式输出）从发起到读完的总时限，重试和 Retry-After 等待都算在内。
+_AI_REQUEST_DEADLINE_SECONDS = max(1.0, _env_float("AI_REQUEST_DEADLINE_SECONDS", 90))
+# AI 补全录制/回放：record 把上游返回按请求指纹落盘，replay 只读盘不访问上游，
+# 用于离线跑 AI 回测和压测 AI 后处理。
+_AI_CASSETTE_MODE = str(os.environ.get("AI_CASSETTE_MODE") or "off").strip().lower()
+_AI_CASSETTE_DIR = os.environ.get("AI_CASSETTE_DIR") or os.path.join(data_dir, "ai_cassettes")
+_AI_CASSETTE_REPLAY_LATENCY_MS = max(0.0, _env_float("AI_CASSETTE_REPLAY_LATENCY_MS", 0))
+# 录制目录最多保留的文件数，超出后按修改时间删掉最旧的，避免 record 模式长期运行时无限增长。
+_AI_CASSETTE_MAX_FILES = max(1, int(_env_float("AI_CASSETTE_MAX_FILES", 2000)))
+_AI_CASSETTE_PRUNE_EVERY = 50
+_AI_CASSETTE_STREAM_CHUNK_CHARS = 16
+# record 模式下的 AI 回测会逐期请求真实上游，必须再显式打开这个开关。
+_AI_CASSETTE_RECORD_BACKTEST = str(os.environ.get("AI_CASSETTE_RECORD_BACKTEST") or "").strip().lower() in {"1", "true", "yes", "on"}
 _RUNTIME_ANALYSIS_CACHE_MAX_ITEMS = 256
+_AI_PROMPT_CONTEXT_CACHE_MAX_ITEMS = 16
+_MARKOV_STATE_CACHE_MAX_ITEMS = 8
 # All strategy-selection and tuning layers optimize the special number first.
 # Normal-number coverage and zodiac agreement remain tie-break signals only.
 SPECIAL_PRIORITY_TOP6_WEIGHT = 0.12
@@ -60,12 +106,72 @@ SPECIAL_PRIORITY_ZODIAC_WEIGHT = 0.04
 _ml_prediction_cache = {}
 _ml_prediction_cache_lock = threading.Lock()
 _ml_prediction_build_events = {}
+_ml_prediction_cache_stats = cache_registry.register(
+    "ml_prediction",
+    "机器学习预测产物",
+    items=lambda: _ml_prediction_cache.items(),
+    clear=lambda region: _clear_ml_prediction_cache(region),
+    group_of=lambda key, item: item.get("region"),
+    regional=True,
+)
 _ai_prediction_cache = {}
 _ai_prediction_cache_lock = threading.Lock()
+# 命中本进程缓存或共享表都算命中；清空时连共享表一起清。
+_ai_prediction_cache_stats = cache_registry.register(
+    "ai_prediction",
+    "AI 预测结果",
+    items=lambda: _ai_prediction_cache.items(),
+    clear=lambda region: _clear_ai_prediction_cache(region),
+    group_of=lambda key, item: item.get("region"),
+    regional=True,
+)
+_ai_prediction_store_pruned_periods = {}
+_ai_prediction_flights = {}
+_ai_stream_broadcasts = {}
+_ai_prompt_context_cache = {}
+_ai_prompt_context_build_events = {}
+_ai_prompt_context_cache_lock = threading.Lock()
+_ai_prompt_context_cache_stats = cache_registry.register(
+    "ai_prompt_context",
+    "AI 提示词与候选上下文",
+    items=lambda: _ai_prompt_context_cache.items(),
+    clear=lambda region: _clear_ai_prompt_context_cache(region),
+    group_of=lambda key, item: item.get("region"),
+    regional=True,
+)
+_ai_stream_broadcasts_lock = threading.Lock()
+_ai_sample_executor = None
+_ai_sample_executor_lock = threading.Lock()
+_ai_http_sessions = {}
+_ai_cassette_writes = 0
+_ai_cassette_prune_lock = threading.Lock()
+_ai_http_sessions_lock = threading.Lock()
+_ai_http_metrics = {}
+_ai_http_recent_calls = deque(maxlen=100)
+_ai_http_metrics_lock = threading.Lock()
+_ai_chat_metrics = {}
+_ai_chat_recent_calls = deque(maxlen=50)
+_ai_chat_metrics_lock = threading.Lock()
+_markov_state_cache = {}
+_markov_state_cache_lock = threading.Lock()
+# region -> 已清理过其它指纹旧状态的 config_hash
+_markov_state_pruned_hashes = {}
+# 清空时连持久化的 markov_state 表一起清。
+_markov_state_cache_stats = cache_registry.register(
+    "markov_state",
+    "马尔可夫增量状态",
+    items=lambda: _markov_state_cache.items(),
+    clear=lambda region: _clear_markov_state_cache(region),
+)
 _runtime_analysis_cache_local = threading.local()
+_runtime_analysis_cache_generation = 0
+_runtime_analysis_cache_generation_lock = threading.Lock()
+# 线程 -> (代数, 该线程的缓存桶)，只用于后台统计；线程退出后条目自动消失。
+_runtime_analysis_cache_tables = weakref.WeakKeyDictionary()
 _strategy_config_override_local = threading.local()
 _backtest_cutoff_period_local = threading.local()
 _backtest_strict_strategy_local = threading.local()
+_shared_analysis_scope_local = threading.local()
 _SYSTEM_LOG_FILE_PATH = os.path.join(data_dir, "system.log")
 _SYSTEM_LOG_RETENTION_DAYS = 30
 _SYSTEM_LOG_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
@@ -79,6 +185,19 @@ def _ai_http_timeout():
     return (_AI_HTTP_CONNECT_TIMEOUT_SECONDS, _AI_HTTP_READ_TIMEOUT_SECONDS)
 
 
+def _ai_http_timeout_until(deadline=None):
+    """按截止时间收紧读超时，预算耗尽后仍在等待的调用会随之超时退出。"""
+    if deadline is None:
+        return _ai_http_timeout()
+    remaining = float(deadline) - time.perf_counter()
+    if remaining <= 0:
+        raise TimeoutError("AI 采样预算已耗尽")
+    return (
+        min(_AI_HTTP_CONNECT_TIMEOUT_SECONDS, max(0.5, remaining)),
+        min(_AI_HTTP_READ_TIMEOUT_SECONDS, max(0.5, remaining)),
+    )
+
+
 def _current_system_log_timestamp():
     return datetime.now().strftime(_SYSTEM_LOG_TIMESTAMP_FORMAT)
 
@@ -333,11 +452,20 @@ def clear_system_logs():
 _install_system_log_tee()
 
 
+def _track_runtime_cache_table(caches, generation):
+    with _runtime_analysis_cache_generation_lock:
+        _runtime_analysis_cache_tables[threading.current_thread()] = (generation, caches)
+
+
 def _runtime_cache_bucket(name):
     caches = getattr(_runtime_analysis_cache_local, "caches", None)
-    if caches is None:
+    # 多线程 worker 下每个线程各有一份缓存，清理时只递增代数，其余线程下次访问时自行丢弃旧缓存。
+    generation = _runtime_analysis_cache_generation
+    if caches is None or getattr(_runtime_analysis_cache_local, "generation", None) != generation:
         caches = {}
         _runtime_analysis_cache_local.caches = caches
+        _runtime_analysis_cache_local.generation = generation
+        _track_runtime_cache_table(caches, generation)
     return caches.setdefault(name, {})
 
 
@@ -345,7 +473,9 @@ def _runtime_cache_get(name, key):
     bucket = _runtime_cache_bucket(name)
     value = bucket.get(key)
     if value is None:
+        _runtime_analysis_cache_stats.miss()
         return None
+    _runtime_analysis_cache_stats.hit()
     return copy.deepcopy(value)
 
 
@@ -354,6 +484,7 @@ def _runtime_cache_set(name, key, value, max_items=_RUNTIME_ANALYSIS_CACHE_MAX_I
     if len(bucket) >= max(1, int(max_items or _RUNTIME_ANALYSIS_CACHE_MAX_ITEMS)):
         try:
             bucket.pop(next(iter(bucket)))
+            _runtime_analysis_cache_stats.evicted()
         except StopIteration:
             pass
     bucket[key] = copy.deepcopy(value)
@@ -361,12 +492,87 @@ def _runtime_cache_set(name, key, value, max_items=_RUNTIME_ANALYSIS_CACHE_MAX_I
 
 
 def _clear_runtime_analysis_caches():
+    global _runtime_analysis_cache_generation
+    with _runtime_analysis_cache_generation_lock:
+        _runtime_analysis_cache_generation += 1
     try:
         _runtime_analysis_cache_local.caches = {}
+        _runtime_analysis_cache_local.generation = _runtime_analysis_cache_generation
+        _track_runtime_cache_table(_runtime_analysis_cache_local.caches, _runtime_analysis_cache_generation)
     except Exception:
         pass
 
 
+def _iter_runtime_analysis_cache_items():
+    """所有线程当前代数的缓存条目，键为 (缓存桶名, 原键)。"""
+    generation = _runtime_analysis_cache_generation
+    with _runtime_analysis_cache_generation_lock:
+        tables = [caches for table_generation, caches in _runtime_analysis_cache_tables.values() if table_generation == generation]
+    for caches in tables:
+        for bucket_name, bucket in list(caches.items()):
+            for key, value in list(bucket.items()):
+                yield (bucket_name, key), value
+
+
+_runtime_analysis_cache_stats = cache_registry.register(
+    "runtime_analysis",
+    "分析中间结果（按线程）",
+    items=_iter_runtime_analysis_cache_items,
+    clear=lambda region: _clear_runtime_analysis_caches(),
+    group_of=lambda key, value: key[0],
+    group_label="bucket",
+)
+
+
+def _reset_request_thread_state():
+    """清掉上一个请求可能残留在当前线程上的临时覆盖（线程池会复用线程）。"""
+    for local_state, names in (
+        (_strategy_config_override_local, ("configs",)),
+        (_backtest_cutoff_period_local, ("period",)),
+        (_backtest_strict_strategy_local, ("enabled",)),
+        (_shared_analysis_scope_local, ("values", "depth")),
+    ):
+        for name in names:
+            try:
+                delattr(local_state, name)
+            except AttributeError:
+                pass
+
+
+@contextmanager
+def _shared_prediction_analysis_scope():
+    """Share per-draw analysis between strategies computed inside one batch."""
+    depth = int(getattr(_shared_analysis_scope_local, "depth", 0) or 0)
+    if depth == 0:
+        _shared_analysis_scope_local.values = {}
+    _shared_analysis_scope_local.depth = depth + 1
+    try:
+        yield
+    finally:
+        _shared_analysis_scope_local.depth = depth
+        if depth == 0:
+            _shared_analysis_scope_local.values = {}
+
+
+def _shared_analysis_call(name, key, builder):
+    """Memoize ``builder()`` under ``key`` while a shared analysis scope is open.
+
+    ``key`` may be a callable so that signature hashing is skipped entirely
+    outside of a batch.
+    """
+    if not int(getattr(_shared_analysis_scope_local, "depth", 0) or 0):
+        return builder()
+    if callable(key):
+        key = key()
+    values = _shared_analysis_scope_local.values
+    scoped_key = (name, key)
+    if scoped_key in values:
+        return copy.deepcopy(values[scoped_key])
+    value = builder()
+    values[scoped_key] = copy.deepcopy(value)
+    return value
+
+
 def _runtime_draws_signature(data, limit=None):
     selected = list(data or [])
     if limit:
@@ -441,6 +647,21 @@ def _prune_stale_ai_prediction_cache(region, latest_period):
         ]
         for key in stale_keys:
             _ai_prediction_cache.pop(key, None)
+        _ai_prediction_cache_stats.evicted(len(stale_keys))
+        if _ai_prediction_store_pruned_periods.get(normalized_region) == latest_period:
+            return
+    # 共享表里的旧期结果每个 worker 在期号推进后清理一次即可。
+    table = AIPredictionCache.__table__
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(
+                table.delete().where(table.c.region == normalized_region, table.c.latest_period != latest_period)
+            )
+    except Exception as e:
+        print(f"清理共享 AI 预测缓存失败 region={normalized_region}: {e}")
+        return
+    with _ai_prediction_cache_lock:
+        _ai_prediction_store_pruned_periods[normalized_region] = latest_period
 
 
 def _clear_ai_prediction_cache(region=None):
@@ -448,70 +669,342 @@ def _clear_ai_prediction_cache(region=None):
     with _ai_prediction_cache_lock:
         if not normalized_region:
             _ai_prediction_cache.clear()
-            return
-        for key in [
-            key
-            for key, item in _ai_prediction_cache.items()
-            if str(item.get("region") or "").strip().lower() == normalized_region
-        ]:
-            _ai_prediction_cache.pop(key, None)
+            _ai_prediction_store_pruned_periods.clear()
+        else:
+            for key in [
+                key
+                for key, item in _ai_prediction_cache.items()
+                if str(item.get("region") or "").strip().lower() == normalized_region
+            ]:
+                _ai_prediction_cache.pop(key, None)
+            _ai_prediction_store_pruned_periods.pop(normalized_region, None)
+    table = AIPredictionCache.__table__
+    statement = table.delete()
+    if normalized_region:
+        statement = statement.where(table.c.region == normalized_region)
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(statement)
+    except Exception as e:
+        print(f"清空共享 AI 预测缓存失败 region={normalized_region or 'all'}: {e}")
+
+
+def _remember_ai_prediction(cache_key, entry, ttl_seconds, now):
+    with _ai_prediction_cache_lock:
+        if ttl_seconds is not None:
+            expired_keys = [
+                key
+                for key, item in _ai_prediction_cache.items()
+                if now - float(item.get("cached_at") or 0.0) > ttl_seconds
+            ]
+            for key in expired_keys:
+                _ai_prediction_cache.pop(key, None)
+            _ai_prediction_cache_stats.evicted(len(expired_keys))
+        if cache_key not in _ai_prediction_cache and len(_ai_prediction_cache) >= 64:
+            oldest_key = min(
+                _ai_prediction_cache.keys(),
+                key=lambda key: float(_ai_prediction_cache[key].get("last_used_at") or _ai_prediction_cache[key].get("cached_at") or 0.0),
+            )
+            _ai_prediction_cache.pop(oldest_key, None)
+            _ai_prediction_cache_stats.evicted()
+        _ai_prediction_cache[cache_key] = entry
+
+
+def _load_shared_ai_prediction(cache_key, ttl_seconds, now):
+    """进程内未命中时读取共享表，命中后回填本进程缓存并累计命中次数。
+
+    共享表的读写都走独立连接：这里处在预测路径中，不能替调用方提交或回滚共享的 scoped session。
+    命中次数只是统计，写失败（如 SQLite 写锁被占）时跳过。
+    """
+    table = AIPredictionCache.__table__
+    try:
+        with db.engine.connect() as connection:
+            row = connection.execute(table.select().where(table.c.cache_key == cache_key)).first()
+    except Exception as e:
+        print(f"读取共享 AI 预测缓存失败: {e}")
+        return None
+    if row is None or not row.payload:
+        return None
+    cached_at = row.created_at.timestamp() if row.created_at else 0.0
+    expired = ttl_seconds is not None and now - cached_at > ttl_seconds
+    result = None
+    if not expired:
+        try:
+            result = json.loads(row.payload)
+        except (TypeError, ValueError):
+            return None
+    try:
+        with db.engine.begin() as connection:
+            if expired:
+                connection.execute(table.delete().where(table.c.id == row.id))
+            else:
+                connection.execute(
+                    table.update()
+                    .where(table.c.id == row.id)
+                    .values(hit_count=db.func.coalesce(table.c.hit_count, 0) + 1, last_hit_at=datetime.now())
+                )
+    except Exception as e:
+        print(f"更新共享 AI 预测缓存失败: {e}")
+    if expired:
+        return None
+    hit_count = int(row.hit_count or 0) + 1
+    entry = {
+        "cached_at": cached_at,
+        "last_used_at": now,
+        "region": str(row.region or "").strip().lower(),
+        "latest_period": str(row.latest_period or "").strip(),
+        "hit_count": hit_count,
+        "result": result,
+    }
+    _remember_ai_prediction(cache_key, entry, ttl_seconds, now)
+    return entry
 
 
 def _get_cached_ai_prediction(cache_key):
     now = time.time()
     ttl_seconds = _prediction_cache_ttl_seconds(_AI_PREDICTION_CACHE_TTL_SECONDS)
+    cache_source = "memory"
     with _ai_prediction_cache_lock:
         cached = _ai_prediction_cache.get(cache_key)
+        if cached and ttl_seconds is not None and now - float(cached.get("cached_at") or 0.0) > ttl_seconds:
+            _ai_prediction_cache.pop(cache_key, None)
+            _ai_prediction_cache_stats.evicted()
+            cached = None
+        if cached:
+            cached["last_used_at"] = now
+            cached["hit_count"] = int(cached.get("hit_count") or 0) + 1
+            cached_at = float(cached.get("cached_at") or 0.0)
+            hit_count = cached["hit_count"]
+            result = copy.deepcopy(cached.get("result"))
+    if not cached:
+        cached = _load_shared_ai_prediction(cache_key, ttl_seconds, now)
         if not cached:
+            _ai_prediction_cache_stats.miss()
             return None
+        cache_source = "shared"
         cached_at = float(cached.get("cached_at") or 0.0)
-        if ttl_seconds is not None and now - cached_at > ttl_seconds:
-            _ai_prediction_cache.pop(cache_key, None)
-            return None
-        cached["last_used_at"] = now
+        hit_count = cached["hit_count"]
         result = copy.deepcopy(cached.get("result"))
+    _ai_prediction_cache_stats.hit()
     if isinstance(result, dict):
         meta = dict(result.get("model_meta") or {})
         meta["ai_cache_hit"] = True
+        meta["ai_cache_source"] = cache_source
+        meta["ai_cache_hits"] = hit_count
         meta["ai_cache_age_seconds"] = round(now - cached_at, 2)
         result["model_meta"] = meta
     return result
 
 
+def _store_shared_ai_prediction(cache_key, result, region, latest_period, ttl_seconds, now):
+    # 走独立连接和事务，理由同 _load_shared_ai_prediction。
+    table = AIPredictionCache.__table__
+    values = {
+        "region": region,
+        "latest_period": latest_period,
+        "payload": json.dumps(result, ensure_ascii=False, default=str),
+        "hit_count": 0,
+        "created_at": datetime.fromtimestamp(now),
+        "last_hit_at": None,
+    }
+    try:
+        with db.engine.begin() as connection:
+            if ttl_seconds is not None:
+                connection.execute(table.delete().where(table.c.created_at < datetime.fromtimestamp(now - ttl_seconds)))
+            updated = connection.execute(
+                table.update().where(table.c.cache_key == cache_key).values(**values)
+            ).rowcount
+            if not updated:
+                connection.execute(table.insert().values(cache_key=cache_key, **values))
+    except Exception as e:
+        # 其它 worker 同时写入了同一键，保留对方结果即可。
+        duplicate_hint = str(e).lower()
+        if 'unique' not in duplicate_hint and 'duplicate' not in duplicate_hint:
+            print(f"保存共享 AI 预测缓存失败 region={region}: {e}")
+
+
 def _store_cached_ai_prediction(cache_key, result, region=None, latest_period=None):
     if not isinstance(result, dict) or result.get("error"):
         return result
     now = time.time()
     ttl_seconds = _prediction_cache_ttl_seconds(_AI_PREDICTION_CACHE_TTL_SECONDS)
+    normalized_region = str(region or "").strip().lower()
+    latest_period = str(latest_period or "").strip()
     cached_result = copy.deepcopy(result)
     meta = dict(cached_result.get("model_meta") or {})
     meta["ai_cache_hit"] = False
     meta["ai_cached_at"] = datetime.now().isoformat(timespec="seconds")
     cached_result["model_meta"] = meta
-    with _ai_prediction_cache_lock:
-        if ttl_seconds is not None:
-            expired_keys = [
-                key
-                for key, item in _ai_prediction_cache.items()
-                if now - float(item.get("cached_at") or 0.0) > ttl_seconds
-            ]
-            for key in expired_keys:
-                _ai_prediction_cache.pop(key, None)
-        if len(_ai_prediction_cache) >= 64:
-            oldest_key = min(
-                _ai_prediction_cache.keys(),
-                key=lambda key: float(_ai_prediction_cache[key].get("last_used_at") or _ai_prediction_cache[key].get("cached_at") or 0.0),
-            )
-            _ai_prediction_cache.pop(oldest_key, None)
-        _ai_prediction_cache[cache_key] = {
+    _remember_ai_prediction(
+        cache_key,
+        {
             "cached_at": now,
             "last_used_at": now,
-            "region": str(region or "").strip().lower(),
-            "latest_period": str(latest_period or "").strip(),
+            "region": normalized_region,
+            "latest_period": latest_period,
+            "hit_count": 0,
             "result": cached_result,
-        }
+        },
+        ttl_seconds,
+        now,
+    )
+    _store_shared_ai_prediction(cache_key, cached_result, normalized_region, latest_period, ttl_seconds, now)
     return copy.deepcopy(cached_result)
 
+
+def _build_ai_prompt_context_cache_key(region, data, tuned, history_window, candidate_count):
+    tuned_payload = {
+        key: value
+        for key, value in dict(tuned or {}).items()
+        if key not in {"updated_at", "auto_optimize_history", "auto_rollback_history", "auto_restore_history"}
+    }
+    payload = {
+        "region": str(region or "").strip().lower(),
+        "periods": _runtime_draws_signature(data, limit=18),
+        "draw_count": len(data or []),
+        "tuned": tuned_payload,
+        "history_window": int(history_window or 0),
+        "candidate_count": int(candidate_count or 0),
+    }
+    fingerprint = json.dumps(payload, ensure_ascii=True, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.md5(fingerprint.encode("utf-8")).hexdigest()
+
+
+def _clear_ai_prompt_context_cache(region=None):
+    normalized_region = str(region or "").strip().lower()
+    with _ai_prompt_context_cache_lock:
+        if not normalized_region:
+            _ai_prompt_context_cache.clear()
+            return
+        for key in [
+            key
+            for key, item in _ai_prompt_context_cache.items()
+            if item.get("region") == normalized_region
+        ]:
+            _ai_prompt_context_cache.pop(key, None)
+
+
+def _lookup_ai_prompt_context(cache_key, region, latest_period):
+    with _ai_prompt_context_cache_lock:
+        for key in [
+            key
+            for key, item in _ai_prompt_context_cache.items()
+            if item.get("region") == region and item.get("latest_period") != latest_period
+        ]:
+            _ai_prompt_context_cache.pop(key, None)
+            _ai_prompt_context_cache_stats.evicted()
+        cached = _ai_prompt_context_cache.get(cache_key)
+        if not cached:
+            return None
+        _ai_prompt_context_cache_stats.hit()
+        cached["last_used_at"] = time.time()
+        return copy.deepcopy(cached["shortlist_context"]), cached["prompt"]
+
+
+def _get_ai_prompt_context(data, region, tuned, history_window, candidate_count):
+    """返回 (shortlist_context, prompt)。
+
+    两者只取决于地区、最新一期的开奖截面和 AI 参数，同一期内按这三者复用，
+    开奖后由 _clear_draw_dependent_caches 清掉。并发请求同一个键时只构建一次。
+    """
+    if _current_backtest_cutoff_period():
+        shortlist_context = _build_ai_shortlist_context(data, region, config=tuned)
+        prompt = _build_ai_prompt_v4(
+            data,
+            region,
+            shortlist_context,
+            history_window=history_window,
+            candidate_count=candidate_count,
+        )
+        return shortlist_context, prompt
+
+    cache_region, cache_latest_period = _prediction_cache_meta(region, data)
+    cache_key = _build_ai_prompt_context_cache_key(region, data, tuned, history_window, candidate_count)
+    cached = _lookup_ai_prompt_context(cache_key, cache_region, cache_latest_period)
+    if cached is not None:
+        return cached
+
+    with _ai_prompt_context_cache_lock:
+        build_event = _ai_prompt_context_build_events.get(cache_key)
+        should_build = build_event is None
+        if should_build:
+            build_event = threading.Event()
+            _ai_prompt_context_build_events[cache_key] = build_event
+    if not should_build:
+        build_event.wait(_AI_HTTP_READ_TIMEOUT_SECONDS)
+        cached = _lookup_ai_prompt_context(cache_key, cache_region, cache_latest_period)
+        if cached is not None:
+            return cached
+
+    _ai_prompt_context_cache_stats.miss()
+    try:
+        shortlist_context = _build_ai_shortlist_context(data, region, config=tuned)
+        prompt = _build_ai_prompt_v4(
+            data,
+            region,
+            shortlist_context,
+            history_window=history_window,
+            candidate_count=candidate_count,
+        )
+        now = time.time()
+        with _ai_prompt_context_cache_lock:
+            if cache_key not in _ai_prompt_context_cache and len(_ai_prompt_context_cache) >= _AI_PROMPT_CONTEXT_CACHE_MAX_ITEMS:
+                oldest_key = min(
+                    _ai_prompt_context_cache.keys(),
+                    key=lambda key: float(_ai_prompt_context_cache[key].get("last_used_at") or 0.0),
+                )
+                _ai_prompt_context_cache.pop(oldest_key, None)
+                _ai_prompt_context_cache_stats.evicted()
+            _ai_prompt_context_cache[cache_key] = {
+                "region": cache_region,
+                "latest_period": cache_latest_period,
+                "last_used_at": now,
+                "shortlist_context": copy.deepcopy(shortlist_context),
+                "prompt": prompt,
+            }
+        return shortlist_context, prompt
+    finally:
+        if should_build:
+            with _ai_prompt_context_cache_lock:
+                if _ai_prompt_context_build_events.get(cache_key) is build_event:
+                    _ai_prompt_context_build_events.pop(cache_key, None)
+            build_event.set()
+
+
+def _claim_ai_prediction_flight(cache_key):
+    with _ai_prediction_cache_lock:
+        flight = _ai_prediction_flights.get(cache_key)
+        if flight is not None:
+            flight["followers"] += 1
+            return flight, False
+        flight = {"event": threading.Event(), "result": None, "followers": 0}
+        _ai_prediction_flights[cache_key] = flight
+        return flight, True
+
+
+def _finish_ai_prediction_flight(cache_key, flight, result):
+    with _ai_prediction_cache_lock:
+        if _ai_prediction_flights.get(cache_key) is flight:
+            _ai_prediction_flights.pop(cache_key, None)
+        if isinstance(result, dict):
+            flight["result"] = copy.deepcopy(result)
+    flight["event"].set()
+
+
+def _wait_ai_prediction_flight(flight, timeout):
+    """等待同一缓存键的领跑请求完成；超时或领跑请求异常时返回 None。"""
+    if not flight["event"].wait(timeout):
+        return None
+    result = flight.get("result")
+    if not isinstance(result, dict):
+        return None
+    result = copy.deepcopy(result)
+    if not result.get("error"):
+        meta = dict(result.get("model_meta") or {})
+        meta["ai_single_flight"] = "follower"
+        result["model_meta"] = meta
+    return result
+
 def _load_or_create_secret_key():
     env_secret = os.environ.get("SECRET_KEY")
     if env_secret:
@@ -535,6 +1028,16 @@ def _load_or_create_secret_key():
 
 app = Flask(__name__)
 app.secret_key = _load_or_create_secret_key()
+# 请求指标要在其他钩子之前注册：before_request 最先执行、after_request 最后执行，
+# 这样其他钩子里的耗时和 SQL 也算在内，记录的响应大小是压缩后的实际字节数。
+request_metrics = RequestMetrics(
+    metrics_dir=os.environ.get("METRICS_DIR") or os.path.join(data_dir, "metrics"),
+    flush_seconds=_env_float("METRICS_FLUSH_SECONDS", 5),
+    slow_ms=_env_float("SLOW_REQUEST_LOG_MS", 1000),
+    top_queries=int(_env_float("SLOW_REQUEST_TOP_QUERIES", 5)),
+    namespace="marksix",
+)
+request_metrics.init_app(app)
 app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(days=365)
 app.config["SESSION_REFRESH_EACH_REQUEST"] = True
 app.config["SESSION_COOKIE_HTTPONLY"] = True
@@ -549,10 +1052,6 @@ _trust_proxy_headers = os.environ.get("TRUST_PROXY_HEADERS", "").lower() in ("1"
 if _trust_proxy_headers:
     app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_port=1)
 
-_SECURITY_RATE_LIMITS = {}
-_SECURITY_RATE_LIMITS_LOCK = threading.Lock()
-
-
 def _client_rate_key(scope):
     user_id = session.get("user_id")
     remote_addr = request.headers.get("X-Forwarded-For", request.remote_addr or "")
@@ -561,20 +1060,8 @@ def _client_rate_key(scope):
 
 
 def _rate_limited(scope, limit, window_seconds):
-    now = time.time()
-    key = _client_rate_key(scope)
-    with _SECURITY_RATE_LIMITS_LOCK:
-        bucket = [
-            timestamp
-            for timestamp in _SECURITY_RATE_LIMITS.get(key, [])
-            if now - timestamp < window_seconds
-        ]
-        if len(bucket) >= limit:
-            _SECURITY_RATE_LIMITS[key] = bucket
-            return True
-        bucket.append(now)
-        _SECURITY_RATE_LIMITS[key] = bucket
-    return False
+    # 计数默认放在 data/rate_limits.db，同一台机器上的所有 worker 共用一份额度
+    return get_rate_limiter().hit(_client_rate_key(scope), limit, window_seconds)
 
 
 def _same_origin_request():
@@ -660,6 +1147,11 @@ def _require_admin_session_json():
     return user, None
 
 
+@app.before_request
+def _prepare_request_thread_state():
+    _reset_request_thread_state()
+
+
 @app.before_request
 def security_request_guards():
     if request.method in {"POST", "PUT", "PATCH", "DELETE"} and not _csrf_exempt_endpoint():
@@ -730,6 +1222,23 @@ _CSRF_AUTO_SCRIPT = """
 """
 
 
+# 压缩必须最后执行：after_request 按注册的逆序调用，所以注册在其他钩子之前。
+@app.after_request
+def compress_large_responses(response):
+    if not _RESPONSE_GZIP_ENABLED:
+        return response
+    try:
+        return compress_response(
+            request,
+            response,
+            min_size=_RESPONSE_GZIP_MIN_BYTES,
+            level=_RESPONSE_GZIP_LEVEL,
+        )
+    except Exception as e:
+        print(f"压缩响应失败: {e}")
+        return response
+
+
 @app.after_request
 def inject_csrf_helpers(response):
     try:
@@ -1774,6 +2283,65 @@ LOCAL_STRATEGY_KEYS = ["hot", "cold", "trend", "hybrid", "balanced", "markov", "
 _draws_api_cache_lock = threading.Lock()
 _draws_api_cache = {}
 _DRAWS_API_CACHE_TTL = 60
+_draws_api_cache_stats = cache_registry.register(
+    "draws_api",
+    "开奖列表接口",
+    items=lambda: _draws_api_cache.items(),
+    clear=lambda region: _clear_draws_cache(region),
+    group_of=lambda key, item: key[0] if isinstance(key, tuple) else None,
+    regional=True,
+)
+_latest_draw_marker_cache_lock = threading.Lock()
+_latest_draw_marker_cache = {}
+# 其他 worker 入库新开奖后本进程最多沿用这么久的旧标记。
+_LATEST_DRAW_MARKER_CACHE_TTL_SECONDS = _env_float("LATEST_DRAW_MARKER_CACHE_TTL_SECONDS", 15)
+_zodiac_settings_generation_cache = {}
+_hk_zodiac_mapping_signature_cache = {}
+_earliest_draw_date_cache = {}
+_HK_ZODIAC_MAPPING_SIGNATURE_CACHE_MAX_ITEMS = 32
+_draw_statistics_cache_lock = threading.Lock()
+_draw_statistics_cache = {}
+_DRAW_STATISTICS_CACHE_MAX_ITEMS = 32
+_latest_draw_marker_cache_stats = cache_registry.register(
+    "latest_draw_marker",
+    "最新开奖标记",
+    items=lambda: _latest_draw_marker_cache.items(),
+    clear=lambda region: _clear_latest_draw_marker_cache(region),
+    group_of=lambda region, item: region,
+    regional=True,
+)
+_zodiac_settings_generation_cache_stats = cache_registry.register(
+    "zodiac_settings_generation",
+    "生肖设置代数",
+    items=lambda: _zodiac_settings_generation_cache.items(),
+    clear=lambda region: _clear_zodiac_marker_cache(_zodiac_settings_generation_cache),
+)
+_hk_zodiac_mapping_signature_cache_stats = cache_registry.register(
+    "hk_zodiac_mapping_signature",
+    "香港生肖映射指纹",
+    items=lambda: _hk_zodiac_mapping_signature_cache.items(),
+    clear=lambda region: _clear_zodiac_marker_cache(_hk_zodiac_mapping_signature_cache),
+    group_of=lambda key, item: key[1],
+    group_label="year",
+)
+_earliest_draw_date_cache_stats = cache_registry.register(
+    "earliest_draw_date",
+    "最早开奖日期",
+    items=lambda: _earliest_draw_date_cache.items(),
+    clear=lambda region: _clear_latest_draw_marker_cache(region),
+    group_of=lambda region, item: region,
+    regional=True,
+)
+_draw_statistics_cache_stats = cache_registry.register(
+    "draw_statistics",
+    "特码统计快照",
+    items=lambda: _draw_statistics_cache.items(),
+    clear=lambda region: _clear_draw_statistics_cache(region),
+    group_of=lambda key, item: key[0],
+    regional=True,
+)
+# 开奖类接口的响应格式版本，计入 ETag；改动这些接口返回的字段或结构时手动递增，旧 ETag 随之失效。
+_DRAW_RESPONSE_ETAG_VERSION = "1"
 
 # 数据库配置
 db_path = os.path.join(data_dir, 'lottery_system.db')
@@ -1931,6 +2499,11 @@ def _sync_runtime_database_schema():
         'manual_bet_records': {
             'bettor_name': 'VARCHAR(50)',
         },
+        'lottery_draws': {
+            'special_color': 'VARCHAR(10)',
+            'special_parity': 'VARCHAR(10)',
+            'display_breakdown': 'MEDIUMTEXT' if dialect in ('mysql', 'mariadb') else 'TEXT',
+        },
     }
 
     for table_name, columns in column_specs.items():
@@ -2052,6 +2625,7 @@ def _sync_runtime_database_schema():
         'manual_bet_records': {
             'ix_manual_bet_records_user_region_created_at': ('user_id', 'region', 'created_at'),
             'ix_manual_bet_records_region_period_profit': ('region', 'period', 'total_profit'),
+            'ix_manual_bet_records_created_at': ('created_at',),
             'ix_manual_bet_records_user_region_period_profit_created_at': (
                 'user_id',
                 'region',
@@ -2062,6 +2636,9 @@ def _sync_runtime_database_schema():
         },
         'lottery_draws': {
             'ix_lottery_draws_region_draw_date_draw_id': ('region', 'draw_date', 'draw_id'),
+            'ix_lottery_draws_region_special_number_draw_date': ('region', 'special_number', 'draw_date'),
+            'ix_lottery_draws_region_special_color_draw_date': ('region', 'special_color', 'draw_date'),
+            'ix_lottery_draws_region_special_parity_draw_date': ('region', 'special_parity', 'draw_date'),
         },
         'macau_collected_data': {
             'ix_macau_collected_region_period': ('region', 'period'),
@@ -2480,18 +3057,18 @@ def next_draw_time_api():
                 now.isoformat(timespec='seconds'),
                 '香港下期时间缓存更新时间'
             )
-        return jsonify({
+        return _with_content_etag(jsonify({
             "success": True,
             "region": "hk",
             "next_time": value
-        })
+        }))
     if region == 'macau':
         value = _format_datetime_ymdhm(_compute_next_macau_draw_time(now))
-        return jsonify({
+        return _with_content_etag(jsonify({
             "success": True,
             "region": "macau",
             "next_time": value
-        })
+        }))
     return jsonify({
         "success": False,
         "message": "未知地区"
@@ -3598,6 +4175,14 @@ def _strategy_backtest_min_history(strategy, region=None, configured_minimum=Non
 
 def _calculate_strategy_hit_rates(region, strategy, limit=200, cutoff_period=None):
     cutoff_period = cutoff_period or _current_backtest_cutoff_period()
+    return _shared_analysis_call(
+        "strategy_hit_rates",
+        (region, strategy, limit, cutoff_period),
+        lambda: _compute_strategy_hit_rates(region, strategy, limit=limit, cutoff_period=cutoff_period),
+    )
+
+
+def _compute_strategy_hit_rates(region, strategy, limit=200, cutoff_period=None):
     predictions = _load_learning_scope_predictions(
         region,
         strategy,
@@ -5860,6 +6445,14 @@ def update_strategy_configs(region, strategies=None):
         print(f"Markov profile promotion failed for {region}: {e}")
 
 def _get_number_to_zodiac_map(year):
+    return _shared_analysis_call(
+        "number_to_zodiac",
+        str(year or ""),
+        lambda: _build_number_to_zodiac_map(year),
+    )
+
+
+def _build_number_to_zodiac_map(year):
     number_to_zodiac = {}
     try:
         from models import ZodiacSetting
@@ -6000,6 +6593,14 @@ def analyze_special_zodiac_frequency(data, region, year=None):
 
 
 def _build_repeat_transition_profile(data, region, year=None, recent_window=36):
+    return _shared_analysis_call(
+        "repeat_transition_profile",
+        lambda: (_runtime_draws_signature(data), region, year, recent_window),
+        lambda: _compute_repeat_transition_profile(data, region, year=year, recent_window=recent_window),
+    )
+
+
+def _compute_repeat_transition_profile(data, region, year=None, recent_window=36):
     records = list(data or [])
     if len(records) < 2:
         return {
@@ -6357,6 +6958,14 @@ def _personalized_predictions_enabled():
 
 def _build_prediction_feedback(region, strategy, limit=240, cutoff_period=None):
     cutoff_period = cutoff_period or _current_backtest_cutoff_period()
+    return _shared_analysis_call(
+        "prediction_feedback",
+        (region, strategy, limit, cutoff_period),
+        lambda: _compute_prediction_feedback(region, strategy, limit=limit, cutoff_period=cutoff_period),
+    )
+
+
+def _compute_prediction_feedback(region, strategy, limit=240, cutoff_period=None):
     predictions = _load_learning_scope_predictions(region, strategy, cutoff_period=cutoff_period)
     if limit:
         predictions = predictions[:limit]
@@ -6461,6 +7070,26 @@ def _build_prediction_feedback(region, strategy, limit=240, cutoff_period=None):
     }
 
 def _build_attribute_preferences(data, region, feedback, year, apply_recent_zodiac_cooldown=True):
+    return _shared_analysis_call(
+        "attribute_preferences",
+        lambda: (
+            _runtime_draws_signature(data),
+            region,
+            _runtime_json_signature(feedback),
+            year,
+            bool(apply_recent_zodiac_cooldown),
+        ),
+        lambda: _compute_attribute_preferences(
+            data,
+            region,
+            feedback,
+            year,
+            apply_recent_zodiac_cooldown=apply_recent_zodiac_cooldown,
+        ),
+    )
+
+
+def _compute_attribute_preferences(data, region, feedback, year, apply_recent_zodiac_cooldown=True):
     color_counter = analyze_special_color_frequency(data, region)
     zodiac_counter = analyze_special_zodiac_frequency(data, region, year)
     parity_counter = analyze_special_parity_frequency(data)
@@ -6482,7 +7111,8 @@ def _build_attribute_preferences(data, region, feedback, year, apply_recent_zodi
         )
         for color in ("红", "蓝", "绿")
     }
-    zodiac_keys = set(zodiac_scores) | set(feedback_zodiac)
+    # 固定键顺序，同分生肖在各 worker 里的排序才一致，提示词与缓存键可以共享。
+    zodiac_keys = sorted(set(zodiac_scores) | set(feedback_zodiac))
     merged_zodiac = {
         zodiac: round(
             zodiac_scores.get(zodiac, 0.0) * history_weight +
@@ -6520,7 +7150,7 @@ def _build_attribute_preferences(data, region, feedback, year, apply_recent_zodi
                 elif heat == 1:
                     cooled *= 0.9
                 merged_zodiac[zodiac] = round(max(0.0, cooled), 4)
-    parity_keys = set(parity_scores) | set(feedback_parity)
+    parity_keys = sorted(set(parity_scores) | set(feedback_parity))
     merged_parity = {
         parity: round(
             parity_scores.get(parity, 0.0) * history_weight +
@@ -6710,24 +7340,48 @@ def _markov_attribute_state(number, zodiac_map=None):
     }
 
 
-def _score_markov_attribute_transition(candidate, latest_special, attribute_profile, zodiac_map=None):
+def _build_markov_attribute_index(zodiac_map=None):
+    """1..49 号在各属性上的取值索引矩阵，-1 表示该号码没有这一属性。"""
+    values = {attr: [] for attr in MARKOV_ATTRIBUTE_KEYS}
+    index = {attr: [] for attr in MARKOV_ATTRIBUTE_KEYS}
+    for number in range(1, MARKOV_NUMBER_COUNT + 1):
+        state = _markov_attribute_state(number, zodiac_map=zodiac_map)
+        for attr in MARKOV_ATTRIBUTE_KEYS:
+            value = state.get(attr) or ""
+            if not value:
+                index[attr].append(-1)
+                continue
+            if value not in values[attr]:
+                values[attr].append(value)
+            index[attr].append(values[attr].index(value))
+    return {"values": values, "index": index}
+
+
+def _score_markov_attribute_transitions(latest_special, attribute_profile, attribute_index):
+    """最新特码属性所在行与候选号码属性索引相乘，得到 1..49 的平均属性转移分。"""
+    size = MARKOV_NUMBER_COUNT
     if not latest_special or not attribute_profile:
-        return 0.0
-    source_state = _markov_attribute_state(latest_special, zodiac_map=zodiac_map)
-    candidate_state = _markov_attribute_state(candidate, zodiac_map=zodiac_map)
-    total = 0.0
-    active_attrs = 0
-    for attr, source_value in source_state.items():
-        if not source_value:
+        return [0.0] * size
+    totals = [0.0] * size
+    active_attrs = [0] * size
+    for attr in MARKOV_ATTRIBUTE_KEYS:
+        values = attribute_index["values"][attr]
+        indices = attribute_index["index"][attr]
+        source_idx = indices[int(latest_special) - 1]
+        if source_idx < 0:
             continue
-        targets = ((attribute_profile.get(attr) or {}).get(source_value) or {})
-        target_value = candidate_state.get(attr)
-        if target_value and targets:
-            total += float(targets.get(target_value, 0.0) or 0.0)
-            active_attrs += 1
-    if active_attrs <= 0:
-        return 0.0
-    return round(total / active_attrs, 6)
+        targets = (attribute_profile.get(attr) or {}).get(values[source_idx]) or {}
+        if not targets:
+            continue
+        row = [float(targets.get(value, 0.0) or 0.0) for value in values]
+        for candidate_idx, target_idx in enumerate(indices):
+            if target_idx >= 0:
+                totals[candidate_idx] += row[target_idx]
+                active_attrs[candidate_idx] += 1
+    return [
+        round(total / active, 6) if active > 0 else 0.0
+        for total, active in zip(totals, active_attrs)
+    ]
 
 
 def _build_markov_failure_profile(region, limit=180, cutoff_period=None):
@@ -7012,98 +7666,634 @@ def _rebalance_local_combo_shape(selected_numbers, ranked_numbers, score_map, re
     return sorted(best_numbers), best_profile
 
 
-def _build_markov_special_transition_profile(data, window=80, decay=0.985, year=None, min_samples=3):
-    ordered = list(reversed((data or [])[:max(2, int(window or 80))]))
-    cache_key = (
-        _runtime_draws_signature(data, limit=max(2, int(window or 80))),
-        int(window or 80),
-        round(float(decay or 0.985), 6),
-        int(year or _infer_draw_year(data) or 0),
-        int(min_samples or 3),
-    )
-    cached = _runtime_cache_get("markov_special_profile", cache_key)
-    if cached is not None:
-        return cached
+MARKOV_STATE_VERSION = 3
+# 增量推进超过该步数后整窗重算一次，顺带把存储权重的基准拉回 1。
+MARKOV_STATE_REBASE_INTERVAL = 64
+# 市场阶段标签只看前 12 期，窗口滑动时最旧的这几步上下文会被截断。
+MARKOV_STATE_PHASE_CONTEXT = 12
+MARKOV_STATE_ALL_PARTS = ("base", "second", "phase")
+MARKOV_ATTRIBUTE_KEYS = ("color", "parity", "zone", "tail", "zodiac")
+MARKOV_NUMBER_COUNT = 49
+# 计数桶的存储形态：一阶/特码转移为 49x49 稠密矩阵（按行展开的 float64 数组），
+# 来源/目标合计为 49 维向量，阶段转移按阶段标签各存一份矩阵，
+# 二阶转移按 (前前期, 前期) 行稀疏存储；其余小表保持字典。
+MARKOV_STATE_BUCKET_KINDS = {
+    "transitions": "matrix",
+    "special_transitions": "matrix",
+    "special_direct_transitions": "matrix",
+    "source_totals": "vector",
+    "special_source_totals": "vector",
+    "target_totals": "vector",
+    "special_target_totals": "vector",
+    "special_direct_totals": "vector",
+    "phase_transitions": "phase_matrix",
+    "phase_totals": "phase_vector",
+    "second_order_transitions": "rows",
+    "special_second_order_transitions": "rows",
+}
 
-    direct_transitions = {number: Counter() for number in range(1, 50)}
-    direct_totals = Counter()
-    second_order_transitions = Counter()
-    second_order_totals = Counter()
-    attribute_transitions = {
-        "color": {},
-        "parity": {},
-        "zone": {},
-        "tail": {},
-        "zodiac": {},
+
+def _markov_state_params(window=80, decay=0.985, source_special_weight=1.28, year=None):
+    return {
+        "window": max(2, int(window or 80)),
+        "decay": round(float(decay or 0.985), 6),
+        "source_special_weight": round(float(source_special_weight or 1.0), 6),
+        "year": int(year or 0),
     }
-    zodiac_map = _get_number_to_zodiac_map(year or _infer_draw_year(data))
 
-    for idx in range(1, len(ordered)):
-        previous_previous = ordered[idx - 2] if idx >= 2 else None
-        previous_special = _safe_draw_special(ordered[idx - 1])
-        current_special = _safe_draw_special(ordered[idx])
-        if not previous_special or not current_special:
-            continue
 
-        recency_weight = float(decay or 0.985) ** max(0, len(ordered) - idx - 1)
-        direct_totals[previous_special] += recency_weight
-        direct_transitions[previous_special][current_special] += recency_weight
+def _markov_state_config_hash(params):
+    # 属性转移按生肖映射计数，生肖设置或澳门映射变了，旧状态不能再推进。
+    year = (params or {}).get("year")
+    return _runtime_json_signature({
+        "state_version": MARKOV_STATE_VERSION,
+        **(params or {}),
+        "zodiac_generation": _get_cached_zodiac_settings_generation(),
+        "zodiac_map": _runtime_json_signature(_get_number_to_zodiac_map(year)),
+    })
+
+
+def _markov_state_periods(data, limit):
+    """窗口内各期的期号和开奖号码；期号不变但号码被更正时签名也会变。"""
+    periods = []
+    for item in list(data or [])[:max(0, int(limit or 0))]:
+        numbers = item.get("no") or []
+        if not isinstance(numbers, str):
+            numbers = ",".join(str(number).strip() for number in numbers)
+        periods.append(f"{str(item.get('id') or '').strip()}|{numbers}|{str(item.get('sno') or '').strip()}")
+    return tuple(periods)
+
 
+def _markov_step_phase_label(ordered, idx):
+    if not _extract_draw_numbers(ordered[idx - 1], include_special=True) or not _extract_draw_numbers(ordered[idx], include_special=True):
+        return ""
+    phase_history = list(reversed(ordered[max(0, idx - MARKOV_STATE_PHASE_CONTEXT):idx]))
+    return str(_classify_ai_market_phase(phase_history, window=min(12, max(4, len(phase_history)))).get("label") or "neutral")
+
+
+def _markov_step_entries(ordered, idx, params, zodiac_map, parts=MARKOV_STATE_ALL_PARTS, phase_label=""):
+    """单步转移 ordered[idx-1] -> ordered[idx] 对各计数桶的未衰减贡献。"""
+    entries = []
+    previous_previous = ordered[idx - 2] if idx >= 2 else None
+    previous = ordered[idx - 1]
+    current = ordered[idx]
+    source_numbers = _extract_draw_numbers(previous, include_special=True)
+    target_numbers = _extract_draw_numbers(current, include_special=True)
+    previous_special = _safe_draw_special(previous)
+    current_special = _safe_draw_special(current)
+    source_special_weight = float(params.get("source_special_weight") or 1.0)
+    attribute_entries = []
+    if "base" in parts and previous_special and current_special:
         previous_state = _markov_attribute_state(previous_special, zodiac_map=zodiac_map)
         current_state = _markov_attribute_state(current_special, zodiac_map=zodiac_map)
         for attr, source_value in previous_state.items():
             target_value = current_state.get(attr)
-            if not source_value or not target_value:
-                continue
-            attr_bucket = attribute_transitions.setdefault(attr, {})
-            attr_bucket.setdefault(source_value, Counter())[target_value] += recency_weight
+            if source_value and target_value:
+                attribute_entries.append(("attribute_transitions", (attr, source_value, target_value), 1.0))
 
-        if previous_previous:
+    if source_numbers and target_numbers:
+        if "base" in parts:
+            for target in target_numbers:
+                entries.append(("target_totals", target, 1.0))
+                entries.append(("weights", "target", 1.0))
+            if 1 <= current_special <= 49:
+                entries.append(("special_target_totals", current_special, 1.0))
+                entries.append(("weights", "special_target", 1.0))
+        for source in source_numbers:
+            source_weight = source_special_weight if source == previous_special else 1.0
+            if "base" in parts:
+                entries.append(("source_totals", source, source_weight))
+                for target in target_numbers:
+                    entries.append(("transitions", (source, target), source_weight))
+                if 1 <= current_special <= 49:
+                    entries.append(("special_source_totals", source, source_weight))
+                    entries.append(("special_transitions", (source, current_special), source_weight))
+            if "phase" in parts and phase_label:
+                entries.append(("phase_totals", (phase_label, source), source_weight))
+                for target in target_numbers:
+                    entries.append(("phase_transitions", (phase_label, source, target), source_weight))
+        if "second" in parts and previous_previous:
+            for first_source in _extract_draw_numbers(previous_previous, include_special=True):
+                for second_source in source_numbers:
+                    pair = (int(first_source), int(second_source))
+                    pair_weight = 1.18 if second_source == previous_special else 1.0
+                    entries.append(("second_order_totals", pair, pair_weight))
+                    for target in target_numbers:
+                        entries.append(("second_order_transitions", pair + (int(target),), pair_weight))
+        entries.extend(attribute_entries)
+
+    if previous_special and current_special:
+        if "base" in parts:
+            entries.append(("special_direct_totals", previous_special, 1.0))
+            entries.append(("special_direct_transitions", (previous_special, current_special), 1.0))
+        if "second" in parts and previous_previous:
             first_special = _safe_draw_special(previous_previous)
             if first_special:
                 pair = (int(first_special), int(previous_special))
-                pair_weight = recency_weight * 1.12
-                second_order_totals[pair] += pair_weight
-                second_order_transitions[(pair, int(current_special))] += pair_weight
+                entries.append(("special_second_order_totals", pair, 1.12))
+                entries.append(("special_second_order_transitions", pair + (int(current_special),), 1.12))
+    return entries
+
+
+def _markov_zero_array(size):
+    return array.array("d", bytes(8 * size))
+
+
+def _accumulate_markov_map(bucket, key, amount, factor):
+    if factor >= 0:
+        bucket[key] = bucket.get(key, 0.0) + amount
+        return
+    remaining = bucket.get(key, 0.0) + amount
+    # 扣减后只剩浮点残差的键直接删除，避免“零”计数参与平局比较。
+    if abs(remaining) <= abs(amount) * 1e-9:
+        bucket.pop(key, None)
+    else:
+        bucket[key] = remaining
+
+
+def _apply_markov_entries(counters, entries, factor, owned_rows=None):
+    """把单步贡献按 factor 累加进计数桶；owned_rows 不为空时稀疏行按写时复制处理。"""
+    size = MARKOV_NUMBER_COUNT
+    for bucket_name, key, weight in entries:
+        amount = weight * factor
+        kind = MARKOV_STATE_BUCKET_KINDS.get(bucket_name)
+        if kind == "matrix":
+            bucket = counters.get(bucket_name)
+            if bucket is None:
+                bucket = counters[bucket_name] = _markov_zero_array(size * size)
+            bucket[(key[0] - 1) * size + key[1] - 1] += amount
+        elif kind == "vector":
+            bucket = counters.get(bucket_name)
+            if bucket is None:
+                bucket = counters[bucket_name] = _markov_zero_array(size)
+            bucket[key - 1] += amount
+        elif kind == "phase_matrix":
+            labels = counters.setdefault(bucket_name, {})
+            bucket = labels.get(key[0])
+            if bucket is None:
+                bucket = labels[key[0]] = _markov_zero_array(size * size)
+            bucket[(key[1] - 1) * size + key[2] - 1] += amount
+        elif kind == "phase_vector":
+            labels = counters.setdefault(bucket_name, {})
+            bucket = labels.get(key[0])
+            if bucket is None:
+                bucket = labels[key[0]] = _markov_zero_array(size)
+            bucket[key[1] - 1] += amount
+        elif kind == "rows":
+            rows = counters.setdefault(bucket_name, {})
+            row_key = key[:2]
+            row = rows.get(row_key)
+            if owned_rows is not None and (bucket_name, row_key) not in owned_rows:
+                row = rows[row_key] = dict(row or {})
+                owned_rows.add((bucket_name, row_key))
+            elif row is None:
+                row = rows[row_key] = {}
+            _accumulate_markov_map(row, key[2], amount, factor)
+            if not row:
+                rows.pop(row_key, None)
+        else:
+            _accumulate_markov_map(counters.setdefault(bucket_name, {}), key, amount, factor)
+
+
+def _copy_markov_counters(counters):
+    copied = {}
+    for name, bucket in (counters or {}).items():
+        kind = MARKOV_STATE_BUCKET_KINDS.get(name)
+        if kind in {"matrix", "vector"}:
+            copied[name] = array.array("d", bucket)
+        elif kind in {"phase_matrix", "phase_vector"}:
+            copied[name] = {label: array.array("d", values) for label, values in bucket.items()}
+        else:
+            # 稀疏行只复制外层索引，被改动的行在 _apply_markov_entries 里再复制。
+            copied[name] = dict(bucket)
+    return copied
+
+
+def _build_markov_state(data, params):
+    window = params["window"]
+    decay = params["decay"]
+    ordered = list(reversed((data or [])[:window]))
+    zodiac_map = _get_number_to_zodiac_map(params["year"])
+    counters = {}
+    steps = []
+    last_idx = len(ordered) - 1
+    for idx in range(1, len(ordered)):
+        step = {"seq": idx - last_idx, "phase": _markov_step_phase_label(ordered, idx)}
+        entries = _markov_step_entries(ordered, idx, params, zodiac_map, phase_label=step["phase"])
+        _apply_markov_entries(counters, entries, decay ** (0 - step["seq"]))
+        steps.append(step)
+    return {
+        "version": MARKOV_STATE_VERSION,
+        "periods": list(_markov_state_periods(data, window)),
+        "head": 0,
+        "base": 0,
+        "steps": steps,
+        "counters": counters,
+    }
+
+
+def _advance_markov_state(state, data, params):
+    """在上一期状态基础上追加最新一步转移；窗口已满时同时移出最旧一步。
+
+    计数按 decay ** (base - seq) 存储，读取时统一乘 decay ** (head - base)，
+    因此推进一步无需把全部计数乘一遍衰减系数。
+    """
+    window = params["window"]
+    decay = params["decay"]
+    previous_periods = list(_markov_state_periods((data or [])[1:], window))
+    if not state or not previous_periods or list(state.get("periods") or []) != previous_periods:
+        return None
+    base = int(state.get("base") or 0)
+    head = int(state.get("head") or 0) + 1
+    if head - base > MARKOV_STATE_REBASE_INTERVAL:
+        return None
+
+    zodiac_map = _get_number_to_zodiac_map(params["year"])
+    counters = _copy_markov_counters(state.get("counters"))
+    owned_rows = set()
+    steps = [dict(step) for step in (state.get("steps") or [])]
+    ordered = list(reversed(data[:window]))
+    if len(previous_periods) >= window and steps:
+        previous_ordered = list(reversed(data[1:window + 1]))
+        dropped = steps.pop(0)
+        _apply_markov_entries(
+            counters,
+            _markov_step_entries(previous_ordered, 1, params, zodiac_map, parts=("base", "phase"), phase_label=dropped["phase"]),
+            -(decay ** (base - int(dropped["seq"]))),
+            owned_rows,
+        )
+        for offset, step in enumerate(steps[:MARKOV_STATE_PHASE_CONTEXT - 1]):
+            previous_idx = offset + 2
+            current_idx = offset + 1
+            factor = decay ** (base - int(step["seq"]))
+            if previous_idx == 2:
+                # 新窗口的第一步不再有前前期，二阶贡献随之移出。
+                _apply_markov_entries(
+                    counters,
+                    _markov_step_entries(previous_ordered, previous_idx, params, zodiac_map, parts=("second",)),
+                    -factor,
+                    owned_rows,
+                )
+            phase_label = _markov_step_phase_label(ordered, current_idx)
+            if phase_label != step["phase"]:
+                _apply_markov_entries(
+                    counters,
+                    _markov_step_entries(previous_ordered, previous_idx, params, zodiac_map, parts=("phase",), phase_label=step["phase"]),
+                    -factor,
+                    owned_rows,
+                )
+                _apply_markov_entries(
+                    counters,
+                    _markov_step_entries(ordered, current_idx, params, zodiac_map, parts=("phase",), phase_label=phase_label),
+                    factor,
+                    owned_rows,
+                )
+                step["phase"] = phase_label
+
+    current_idx = len(ordered) - 1
+    step = {"seq": head, "phase": _markov_step_phase_label(ordered, current_idx)}
+    _apply_markov_entries(
+        counters,
+        _markov_step_entries(ordered, current_idx, params, zodiac_map, phase_label=step["phase"]),
+        decay ** (base - head),
+        owned_rows,
+    )
+    steps.append(step)
+    return {
+        "version": MARKOV_STATE_VERSION,
+        "periods": list(_markov_state_periods(data, window)),
+        "head": head,
+        "base": base,
+        "steps": steps,
+        "counters": counters,
+    }
+
+
+def _pack_markov_array(values):
+    # 计数值按 float64 原样打包，保证反序列化后扣减时能与当初加入的权重精确抵消。
+    packed = array.array("d", values)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode("ascii")
+
+
+def _unpack_markov_array(payload):
+    values = array.array("d")
+    values.frombytes(base64.b64decode(payload or ""))
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def _pack_markov_map(bucket):
+    keys = list(bucket.keys())
+    arity = len(keys[0]) if keys and isinstance(keys[0], tuple) else 0
+    return {
+        "arity": arity,
+        "keys": list(chain.from_iterable(keys)) if arity else keys,
+        "values": _pack_markov_array(bucket.values()),
+    }
+
+
+def _unpack_markov_map(packed):
+    arity = int(packed.get("arity") or 0)
+    flat_keys = packed.get("keys") or []
+    keys = list(zip(*([iter(flat_keys)] * arity))) if arity else flat_keys
+    return dict(zip(keys, _unpack_markov_array(packed.get("values"))))
+
+
+def _serialize_markov_state(state):
+    buckets = {}
+    for name, bucket in (state.get("counters") or {}).items():
+        kind = MARKOV_STATE_BUCKET_KINDS.get(name)
+        if kind in {"matrix", "vector"}:
+            buckets[name] = _pack_markov_array(bucket)
+        elif kind in {"phase_matrix", "phase_vector"}:
+            buckets[name] = {label: _pack_markov_array(values) for label, values in bucket.items()}
+        elif kind == "rows":
+            buckets[name] = _pack_markov_map({
+                row_key + (column,): value
+                for row_key, row in bucket.items()
+                for column, value in row.items()
+            })
+        else:
+            buckets[name] = _pack_markov_map(bucket)
+    payload = dict(state)
+    payload["counters"] = buckets
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def _deserialize_markov_state(payload):
+    state = json.loads(payload)
+    counters = {}
+    for name, packed in (state.get("counters") or {}).items():
+        kind = MARKOV_STATE_BUCKET_KINDS.get(name)
+        if kind in {"matrix", "vector"}:
+            counters[name] = _unpack_markov_array(packed)
+        elif kind in {"phase_matrix", "phase_vector"}:
+            counters[name] = {label: _unpack_markov_array(values) for label, values in packed.items()}
+        elif kind == "rows":
+            rows = {}
+            for key, value in _unpack_markov_map(packed).items():
+                rows.setdefault(key[:2], {})[key[2]] = value
+            counters[name] = rows
+        else:
+            counters[name] = _unpack_markov_map(packed)
+    state["counters"] = counters
+    return state
+
+
+def _load_persisted_markov_state(region, config_hash):
+    try:
+        row = MarkovState.query.filter_by(region=region, config_hash=config_hash).first()
+    except Exception as e:
+        print(f"读取马尔可夫状态失败 region={region}: {e}")
+        return None
+    if not row or not row.payload:
+        return None
+    try:
+        state = _deserialize_markov_state(row.payload)
+    except Exception:
+        return None
+    if int(state.get("version") or 0) != MARKOV_STATE_VERSION:
+        return None
+    return state
+
+
+def _store_persisted_markov_state(region, config_hash, state):
+    # 走独立连接和事务：这里处在预测路径中，不能替调用方提交或回滚共享的 scoped session。
+    table = MarkovState.__table__
+    values = {
+        "period": str((state.get("periods") or [""])[0] or "").split("|", 1)[0],
+        "payload": _serialize_markov_state(state),
+        "updated_at": datetime.now(),
+    }
+    with _markov_state_cache_lock:
+        prune_stale = _markov_state_pruned_hashes.get(region) != config_hash
+    try:
+        with db.engine.begin() as connection:
+            if prune_stale:
+                # 窗口或衰减参数变化后旧指纹的状态不会再被推进，每个进程在指纹变化后清理一次。
+                connection.execute(
+                    table.delete().where(table.c.region == region, table.c.config_hash != config_hash)
+                )
+            updated = connection.execute(
+                table.update()
+                .where(table.c.region == region, table.c.config_hash == config_hash)
+                .values(**values)
+            ).rowcount
+            if not updated:
+                connection.execute(table.insert().values(region=region, config_hash=config_hash, **values))
+    except Exception as e:
+        duplicate_hint = str(e).lower()
+        if 'unique' not in duplicate_hint and 'duplicate' not in duplicate_hint:
+            print(f"保存马尔可夫状态失败 region={region}: {e}")
+        return
+    if prune_stale:
+        with _markov_state_cache_lock:
+            _markov_state_pruned_hashes[region] = config_hash
+
+
+def _clear_markov_state_cache(region=None):
+    """清掉进程内和持久化的马尔可夫状态；开奖数据或生肖设置被改写后调用。"""
+    normalized_region = str(region or "").strip().lower()
+    with _markov_state_cache_lock:
+        _markov_state_cache.clear()
+        if normalized_region:
+            _markov_state_pruned_hashes.pop(normalized_region, None)
+        else:
+            _markov_state_pruned_hashes.clear()
+    table = MarkovState.__table__
+    statement = table.delete()
+    if normalized_region:
+        statement = statement.where(table.c.region == normalized_region)
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(statement)
+    except Exception as e:
+        print(f"清理马尔可夫状态失败 region={normalized_region or 'all'}: {e}")
+
+
+def _resolve_markov_state(data, params, region=None):
+    """取与当前窗口对应的马尔可夫计数状态：命中缓存、由上一期推进，或整窗重算。
+
+    只有线上（非回测截断）调用会读写持久化状态；回测按时间顺序逐期调用，
+    依靠进程内缓存从上一期状态推进。
+    """
+    config_hash = _markov_state_config_hash(params)
+    periods = _markov_state_periods(data, params["window"])
+    previous_periods = _markov_state_periods((data or [])[1:], params["window"])
+    with _markov_state_cache_lock:
+        state = _markov_state_cache.get((config_hash, periods))
+        previous_state = None if state is not None else _markov_state_cache.get((config_hash, previous_periods))
+    if state is not None:
+        _markov_state_cache_stats.hit()
+        return state
+
+    _markov_state_cache_stats.miss()
+    normalized_region = str(region or "").strip().lower()
+    persist = bool(normalized_region) and not _current_backtest_cutoff_period()
+    if previous_state is None and persist:
+        stored_state = _load_persisted_markov_state(normalized_region, config_hash)
+        if stored_state is not None and tuple(stored_state.get("periods") or []) == periods:
+            state = stored_state
+            persist = False
+        else:
+            previous_state = stored_state
+
+    if state is None and previous_state is not None:
+        state = _advance_markov_state(previous_state, data, params)
+    if state is None:
+        state = _build_markov_state(data, params)
+
+    with _markov_state_cache_lock:
+        # 上一期状态已被推进替代，回测链路不再需要保留它。
+        _markov_state_cache.pop((config_hash, previous_periods), None)
+        _markov_state_cache[(config_hash, periods)] = state
+        while len(_markov_state_cache) > _MARKOV_STATE_CACHE_MAX_ITEMS:
+            _markov_state_cache.pop(next(iter(_markov_state_cache)))
+            _markov_state_cache_stats.evicted()
+    if persist:
+        _store_persisted_markov_state(normalized_region, config_hash, state)
+    return state
+
+
+class _MarkovStateView:
+    """把增量状态按当前衰减比例还原成向量/矩阵行，供画像打分直接做向量运算。"""
+
+    def __init__(self, state, params):
+        self.counters = state.get("counters") or {}
+        self.scale = float(params["decay"]) ** (int(state.get("head") or 0) - int(state.get("base") or 0))
+        self.empty = [0.0] * MARKOV_NUMBER_COUNT
+
+    def _scaled(self, values):
+        # 统一舍入到 1e-9，整窗重算与增量推进在平局比较上保持一致。
+        scale = self.scale
+        return [round(value * scale, 9) for value in values]
+
+    def scalar(self, bucket_name, key):
+        return round(float((self.counters.get(bucket_name) or {}).get(key, 0.0) or 0.0) * self.scale, 9)
+
+    def vector(self, bucket_name, label=None):
+        bucket = self.counters.get(bucket_name)
+        if label is not None:
+            bucket = (bucket or {}).get(label)
+        return self._scaled(bucket) if bucket is not None else list(self.empty)
+
+    def matrix_row(self, bucket_name, source, label=None):
+        bucket = self.counters.get(bucket_name)
+        if label is not None:
+            bucket = (bucket or {}).get(label)
+        if bucket is None or not 1 <= int(source or 0) <= MARKOV_NUMBER_COUNT:
+            return list(self.empty)
+        start = (int(source) - 1) * MARKOV_NUMBER_COUNT
+        return self._scaled(bucket[start:start + MARKOV_NUMBER_COUNT])
+
+    def sparse_row(self, bucket_name, row_key):
+        row = (self.counters.get(bucket_name) or {}).get(row_key)
+        if not row:
+            return list(self.empty)
+        scale = self.scale
+        return [round(row.get(column, 0.0) * scale, 9) for column in range(1, MARKOV_NUMBER_COUNT + 1)]
+
+    def attribute_profile(self):
+        attribute_transitions = {attr: {} for attr in MARKOV_ATTRIBUTE_KEYS}
+        for (attr, source_value, target_value), value in list((self.counters.get("attribute_transitions") or {}).items()):
+            attribute_transitions.setdefault(attr, {}).setdefault(source_value, {})[target_value] = round(value * self.scale, 9)
+
+        attribute_profile = {}
+        for attr, source_map in attribute_transitions.items():
+            attribute_profile[attr] = {}
+            for source_value, counter in source_map.items():
+                total = sum(counter.values()) or 1.0
+                attribute_profile[attr][source_value] = {
+                    target_value: round(value / total, 6)
+                    for target_value, value in counter.items()
+                }
+        return attribute_profile
+
+
+def _markov_probability_vector(counts, total, min_samples=3):
+    """_markov_probability 的整行版本：同一来源分母相同，逐元素结果与逐个调用一致。"""
+    denominator = float(total or 0.0)
+    if denominator <= 0:
+        return [0.0] * len(counts)
+    prior_strength = max(float(min_samples or 1), 1.0)
+    prior_mass = (1.0 / 49.0) * prior_strength
+    smoothed_denominator = denominator + prior_strength
+    confidence = _clamp(denominator / (denominator + prior_strength), 0.15, 1.0)
+    return [(float(count) + prior_mass) / smoothed_denominator * confidence for count in counts]
+
+
+def _markov_sum_vectors(vectors, size=MARKOV_NUMBER_COUNT):
+    totals = [0.0] * size
+    for vector in vectors:
+        totals = [total + value for total, value in zip(totals, vector)]
+    return totals
+
+
+def _markov_vector_map(vector):
+    return {str(number): value for number, value in enumerate(vector, start=1)}
+
+
+def refresh_markov_state(region, data):
+    """开奖入库后按当前马尔可夫配置把持久化状态推进到最新一期。"""
+    if not data:
+        return None
+    config = _load_strategy_config("markov", region)
+    window = _clamp(int(config.get("window") or 80), 12, 160)
+    params = _markov_state_params(
+        window=window,
+        decay=config.get("transition_decay"),
+        source_special_weight=config.get("source_special_weight"),
+        year=_infer_draw_year(data[:window]),
+    )
+    return _resolve_markov_state(data, params, region=region)
+
+
+@traced("markov.special_transitions")
+def _build_markov_special_transition_profile(data, window=80, decay=0.985, year=None, min_samples=3, source_special_weight=1.28, region=None):
+    cache_key = (
+        _markov_state_periods(data, max(2, int(window or 80))),
+        int(window or 80),
+        round(float(decay or 0.985), 6),
+        int(year or _infer_draw_year(data) or 0),
+        int(min_samples or 3),
+    )
+    cached = _runtime_cache_get("markov_special_profile", cache_key)
+    if cached is not None:
+        return cached
+
+    # source_special_weight 不影响特码画像，只用于与号码画像共享同一份状态。
+    params = _markov_state_params(window, decay, source_special_weight, year or _infer_draw_year(data))
+    state = _resolve_markov_state(data, params, region=region)
+    view = _MarkovStateView(state, params)
 
     latest_special = _safe_draw_special(data[0]) if data else 0
     latest_previous_special = _safe_draw_special(data[1]) if len(data or []) > 1 else 0
-    direct_sample_total = float(direct_totals.get(latest_special, 0.0) or 0.0)
+    direct_sample_total = view.vector("special_direct_totals")[latest_special - 1] if latest_special else 0.0
     pair = (int(latest_previous_special), int(latest_special)) if latest_previous_special and latest_special else None
-    second_order_sample_total = float(second_order_totals.get(pair, 0.0) or 0.0) if pair else 0.0
+    second_order_sample_total = view.scalar("special_second_order_totals", pair) if pair else 0.0
     direct_confidence = _clamp(direct_sample_total / max(float(min_samples or 1), 1.0), 0.0, 1.0)
     second_order_confidence = _clamp(second_order_sample_total / max(float(min_samples or 1) * 2.0, 1.0), 0.0, 1.0)
 
-    direct_scores = {}
-    second_order_scores = {}
-    for candidate in range(1, 50):
-        direct_scores[str(candidate)] = _markov_probability(
-            direct_transitions[latest_special].get(candidate, 0.0),
-            direct_totals.get(latest_special, 0.0),
-            min_samples=min_samples,
-        ) if latest_special else 0.0
-        second_order_scores[str(candidate)] = _markov_probability(
-            second_order_transitions.get((pair, candidate), 0.0),
-            second_order_totals.get(pair, 0.0),
-            min_samples=min_samples,
-        ) if pair else 0.0
-
-    attribute_profile = {}
-    for attr, source_map in attribute_transitions.items():
-        attribute_profile[attr] = {}
-        for source_value, counter in source_map.items():
-            total = sum(counter.values()) or 1.0
-            attribute_profile[attr][source_value] = {
-                target_value: round(value / total, 6)
-                for target_value, value in counter.items()
-            }
+    direct_scores = _markov_probability_vector(
+        view.matrix_row("special_direct_transitions", latest_special),
+        direct_sample_total,
+        min_samples=min_samples,
+    ) if latest_special else [0.0] * MARKOV_NUMBER_COUNT
+    second_order_scores = _markov_probability_vector(
+        view.sparse_row("special_second_order_transitions", pair),
+        second_order_sample_total,
+        min_samples=min_samples,
+    ) if pair else [0.0] * MARKOV_NUMBER_COUNT
 
     return _runtime_cache_set("markov_special_profile", cache_key, {
         "latest_special": latest_special,
         "latest_previous_special": latest_previous_special,
-        "direct_scores": _normalize_metric_map(direct_scores),
-        "second_order_scores": _normalize_metric_map(second_order_scores),
-        "attribute_profile": attribute_profile,
+        "direct_scores": _normalize_metric_map(_markov_vector_map(direct_scores)),
+        "second_order_scores": _normalize_metric_map(_markov_vector_map(second_order_scores)),
+        "attribute_profile": view.attribute_profile(),
         "direct_confidence": round(direct_confidence, 6),
         "second_order_confidence": round(second_order_confidence, 6),
         "direct_sample_total": round(direct_sample_total, 3),
@@ -7111,10 +8301,10 @@ def _build_markov_special_transition_profile(data, window=80, decay=0.985, year=
     })
 
 
-def _build_markov_transition_profile(data, window=80, decay=0.985, source_special_weight=1.28, year=None, min_samples=3):
-    ordered = list(reversed((data or [])[:max(2, int(window or 80))]))
+@traced("markov.transitions")
+def _build_markov_transition_profile(data, window=80, decay=0.985, source_special_weight=1.28, year=None, min_samples=3, region=None):
     cache_key = (
-        _runtime_draws_signature(data, limit=max(2, int(window or 80))),
+        _markov_state_periods(data, max(2, int(window or 80))),
         int(window or 80),
         round(float(decay or 0.985), 6),
         round(float(source_special_weight or 1.0), 6),
@@ -7125,176 +8315,102 @@ def _build_markov_transition_profile(data, window=80, decay=0.985, source_specia
     if cached is not None:
         return cached
 
-    transitions = {number: Counter() for number in range(1, 50)}
-    special_transitions = {number: Counter() for number in range(1, 50)}
-    second_order_transitions = Counter()
-    second_order_totals = Counter()
-    phase_transitions = {}
-    phase_totals = {}
-    attribute_transitions = {
-        "color": {},
-        "parity": {},
-        "zone": {},
-        "tail": {},
-        "zodiac": {},
-    }
-    source_totals = Counter()
-    special_source_totals = Counter()
-    target_totals = Counter()
-    special_target_totals = Counter()
-    target_total_weight = 0.0
-    special_target_total_weight = 0.0
-    zodiac_map = _get_number_to_zodiac_map(year or _infer_draw_year(data))
-
-    for idx in range(1, len(ordered)):
-        previous_previous = ordered[idx - 2] if idx >= 2 else None
-        previous = ordered[idx - 1]
-        current = ordered[idx]
-        source_numbers = _extract_draw_numbers(previous, include_special=True)
-        target_numbers = _extract_draw_numbers(current, include_special=True)
-        previous_special = _safe_draw_special(previous)
-        current_special = _safe_draw_special(current)
-        if not source_numbers or not target_numbers:
-            continue
-
-        recency_weight = float(decay or 0.985) ** max(0, len(ordered) - idx - 1)
-        phase_history = list(reversed(ordered[max(0, idx - 12):idx]))
-        phase_label = str(_classify_ai_market_phase(phase_history, window=min(12, max(4, len(phase_history)))).get("label") or "neutral")
-        if phase_label not in phase_transitions:
-            phase_transitions[phase_label] = {number: Counter() for number in range(1, 50)}
-            phase_totals[phase_label] = Counter()
-        for target in target_numbers:
-            target_totals[target] += recency_weight
-            target_total_weight += recency_weight
-        if 1 <= current_special <= 49:
-            special_target_totals[current_special] += recency_weight
-            special_target_total_weight += recency_weight
-        for source in source_numbers:
-            source_weight = recency_weight * (float(source_special_weight or 1.0) if source == previous_special else 1.0)
-            source_totals[source] += source_weight
-            phase_totals[phase_label][source] += source_weight
-            for target in target_numbers:
-                transitions[source][target] += source_weight
-                phase_transitions[phase_label][source][target] += source_weight
-            if 1 <= current_special <= 49:
-                special_source_totals[source] += source_weight
-                special_transitions[source][current_special] += source_weight
-
-        if previous_previous:
-            prior_sources = _extract_draw_numbers(previous_previous, include_special=True)
-            for first_source in prior_sources:
-                for second_source in source_numbers:
-                    pair = (int(first_source), int(second_source))
-                    pair_weight = recency_weight * (1.18 if second_source == previous_special else 1.0)
-                    second_order_totals[pair] += pair_weight
-                    for target in target_numbers:
-                        second_order_transitions[(pair, int(target))] += pair_weight
-
-        if previous_special and current_special:
-            previous_state = _markov_attribute_state(previous_special, zodiac_map=zodiac_map)
-            current_state = _markov_attribute_state(current_special, zodiac_map=zodiac_map)
-            for attr, source_value in previous_state.items():
-                target_value = current_state.get(attr)
-                if not source_value or not target_value:
-                    continue
-                attr_bucket = attribute_transitions.setdefault(attr, {})
-                attr_bucket.setdefault(source_value, Counter())[target_value] += recency_weight
+    params = _markov_state_params(window, decay, source_special_weight, year or _infer_draw_year(data))
+    state = _resolve_markov_state(data, params, region=region)
+    view = _MarkovStateView(state, params)
 
     latest_sources = _extract_draw_numbers(data[0], include_special=True) if data else []
     latest_second_sources = _extract_draw_numbers(data[1], include_special=True) if len(data or []) > 1 else []
     latest_special = _safe_draw_special(data[0]) if data else 0
     latest_phase = str(_classify_ai_market_phase(list(data or [])[:12], window=min(12, max(4, len(data or [])))).get("label") or "neutral")
+    latest_pairs = [
+        (int(first_source), int(second_source))
+        for first_source in latest_second_sources
+        for second_source in latest_sources
+    ]
+    source_totals = view.vector("source_totals")
+    special_source_totals = view.vector("special_source_totals")
+    phase_totals = view.vector("phase_totals", label=latest_phase)
+    second_order_totals = [view.scalar("second_order_totals", pair) for pair in latest_pairs]
     second_order_sample_total = 0.0
     second_order_pair_count = 0
-    for first_source in latest_second_sources:
-        for second_source in latest_sources:
-            pair = (int(first_source), int(second_source))
-            pair_samples = float(second_order_totals.get(pair, 0.0) or 0.0)
-            if pair_samples > 0:
-                second_order_sample_total += pair_samples
-                second_order_pair_count += 1
+    for pair_samples in second_order_totals:
+        if pair_samples > 0:
+            second_order_sample_total += pair_samples
+            second_order_pair_count += 1
     second_order_avg_samples = second_order_sample_total / max(second_order_pair_count, 1)
     second_order_confidence = _clamp(
         second_order_avg_samples / max(float(min_samples or 1) * 2.0, 1.0),
         0.0,
         1.0,
     )
-    transition_scores = {}
-    special_transition_scores = {}
-    transition_lift_scores = {}
-    special_transition_lift_scores = {}
-    second_order_scores = {}
-    phase_transition_scores = {}
+
+    # 每个来源号码（或来源号码对）对应转移矩阵的一行，
+    # 候选得分即各行概率向量之和，相当于来源指示向量与概率矩阵的乘积。
+    source_rows = [
+        _markov_probability_vector(view.matrix_row("transitions", source), source_totals[source - 1], min_samples=min_samples)
+        for source in latest_sources
+    ]
+    special_source_rows = [
+        _markov_probability_vector(view.matrix_row("special_transitions", source), special_source_totals[source - 1], min_samples=min_samples)
+        for source in latest_sources
+    ]
+    phase_source_rows = [
+        _markov_probability_vector(view.matrix_row("phase_transitions", source, label=latest_phase), phase_totals[source - 1], min_samples=min_samples)
+        for source in latest_sources
+    ]
+    pair_rows = [
+        _markov_probability_vector(view.sparse_row("second_order_transitions", pair), pair_total, min_samples=min_samples)
+        for pair, pair_total in zip(latest_pairs, second_order_totals)
+    ]
+    base_probabilities = _markov_probability_vector(
+        view.vector("target_totals"),
+        view.scalar("weights", "target"),
+        min_samples=min_samples,
+    )
+    special_base_probabilities = _markov_probability_vector(
+        view.vector("special_target_totals"),
+        view.scalar("weights", "special_target"),
+        min_samples=min_samples,
+    )
+    transition_vector = _markov_sum_vectors(source_rows)
+    special_transition_vector = _markov_sum_vectors(special_source_rows)
+    phase_transition_vector = _markov_sum_vectors(phase_source_rows)
+    second_order_vector = _markov_sum_vectors(pair_rows)
     latest_source_count = max(len(latest_sources), 1)
-    for candidate in range(1, 50):
-        total = 0.0
-        special_total = 0.0
-        second_total = 0.0
-        phase_total = 0.0
-        base_probability = _markov_probability(
-            target_totals.get(candidate, 0.0),
-            target_total_weight,
-            min_samples=min_samples,
-        )
-        special_base_probability = _markov_probability(
-            special_target_totals.get(candidate, 0.0),
-            special_target_total_weight,
-            min_samples=min_samples,
-        )
-        for source in latest_sources:
-            total += _markov_probability(transitions[source].get(candidate, 0.0), source_totals.get(source, 0.0), min_samples=min_samples)
-            special_total += _markov_probability(special_transitions[source].get(candidate, 0.0), special_source_totals.get(source, 0.0), min_samples=min_samples)
-            if latest_phase in phase_transitions:
-                phase_total += _markov_probability(phase_transitions[latest_phase][source].get(candidate, 0.0), phase_totals[latest_phase].get(source, 0.0), min_samples=min_samples)
-        for first_source in latest_second_sources:
-            for second_source in latest_sources:
-                pair = (int(first_source), int(second_source))
-                second_total += _markov_probability(second_order_transitions.get((pair, candidate), 0.0), second_order_totals.get(pair, 0.0), min_samples=min_samples)
-        transition_scores[str(candidate)] = total
-        special_transition_scores[str(candidate)] = special_total
-        transition_lift_scores[str(candidate)] = max(0.0, (total / latest_source_count) - base_probability)
-        special_transition_lift_scores[str(candidate)] = max(0.0, (special_total / latest_source_count) - special_base_probability)
-        second_order_scores[str(candidate)] = second_total
-        phase_transition_scores[str(candidate)] = phase_total
-
-    attribute_profile = {}
-    for attr, source_map in attribute_transitions.items():
-        attribute_profile[attr] = {}
-        for source_value, counter in source_map.items():
-            total = sum(counter.values()) or 1.0
-            attribute_profile[attr][source_value] = {
-                target_value: round(value / total, 6)
-                for target_value, value in counter.items()
-            }
+    transition_lift_vector = [
+        max(0.0, (total / latest_source_count) - base_probability)
+        for total, base_probability in zip(transition_vector, base_probabilities)
+    ]
+    special_transition_lift_vector = [
+        max(0.0, (total / latest_source_count) - base_probability)
+        for total, base_probability in zip(special_transition_vector, special_base_probabilities)
+    ]
 
-    normalized_transition = _normalize_metric_map(transition_scores)
-    normalized_second = _normalize_metric_map(second_order_scores)
-    normalized_phase = _normalize_metric_map(phase_transition_scores)
     top_support = {}
-    for candidate in range(1, 50):
+    for candidate_idx in range(MARKOV_NUMBER_COUNT):
+        candidate = candidate_idx + 1
         candidate_support = []
-        for source in latest_sources:
-            source_probability = _markov_probability(transitions[source].get(candidate, 0.0), source_totals.get(source, 0.0), min_samples=min_samples)
+        for source, row in zip(latest_sources, source_rows):
+            source_probability = row[candidate_idx]
             if source_probability > 0:
                 candidate_support.append({
                     "type": "one_step",
                     "source": source,
                     "target": candidate,
                     "score": round(source_probability * 100, 2),
-                    "samples": round(float(source_totals.get(source, 0.0) or 0.0), 2),
+                    "samples": round(float(source_totals[source - 1] or 0.0), 2),
+                })
+        for pair, pair_total, row in zip(latest_pairs, second_order_totals, pair_rows):
+            pair_probability = row[candidate_idx]
+            if pair_probability > 0:
+                candidate_support.append({
+                    "type": "two_step",
+                    "source": [pair[0], pair[1]],
+                    "target": candidate,
+                    "score": round(pair_probability * 100, 2),
+                    "samples": round(float(pair_total or 0.0), 2),
                 })
-        for first_source in latest_second_sources:
-            for second_source in latest_sources:
-                pair = (int(first_source), int(second_source))
-                pair_probability = _markov_probability(second_order_transitions.get((pair, candidate), 0.0), second_order_totals.get(pair, 0.0), min_samples=min_samples)
-                if pair_probability > 0:
-                    candidate_support.append({
-                        "type": "two_step",
-                        "source": [first_source, second_source],
-                        "target": candidate,
-                        "score": round(pair_probability * 100, 2),
-                        "samples": round(float(second_order_totals.get(pair, 0.0) or 0.0), 2),
-                    })
         candidate_support.sort(key=lambda item: item.get("score", 0.0), reverse=True)
         top_support[str(candidate)] = candidate_support[:4]
 
@@ -7303,15 +8419,15 @@ def _build_markov_transition_profile(data, window=80, decay=0.985, source_specia
         "latest_second_sources": latest_second_sources,
         "latest_phase": latest_phase,
         "latest_special": latest_special,
-        "transition_scores": normalized_transition,
-        "special_transition_scores": _normalize_metric_map(special_transition_scores),
-        "transition_lift_scores": _normalize_metric_map(transition_lift_scores),
-        "special_transition_lift_scores": _normalize_metric_map(special_transition_lift_scores),
-        "second_order_scores": normalized_second,
-        "phase_transition_scores": normalized_phase,
-        "attribute_profile": attribute_profile,
+        "transition_scores": _normalize_metric_map(_markov_vector_map(transition_vector)),
+        "special_transition_scores": _normalize_metric_map(_markov_vector_map(special_transition_vector)),
+        "transition_lift_scores": _normalize_metric_map(_markov_vector_map(transition_lift_vector)),
+        "special_transition_lift_scores": _normalize_metric_map(_markov_vector_map(special_transition_lift_vector)),
+        "second_order_scores": _normalize_metric_map(_markov_vector_map(second_order_vector)),
+        "phase_transition_scores": _normalize_metric_map(_markov_vector_map(phase_transition_vector)),
+        "attribute_profile": view.attribute_profile(),
         "support_chains": top_support,
-        "transition_samples": sum(1 for counter in transitions.values() if counter),
+        "transition_samples": sum(1 for value in source_totals if value > 0),
         "second_order_confidence": round(second_order_confidence, 6),
         "second_order_sample_total": round(second_order_sample_total, 3),
     })
@@ -7335,20 +8451,24 @@ def _predict_with_markov(data, region, variation_key=None):
 
     year = _infer_draw_year(recent_data)
     number_to_zodiac = _get_number_to_zodiac_map(year)
+    # 传入完整历史：增量状态需要看到刚移出窗口的那一期才能从上一期推进。
     transition_profile = _build_markov_transition_profile(
-        recent_data,
+        data,
         window=window,
         decay=float(config.get("transition_decay") or 0.985),
         source_special_weight=float(config.get("source_special_weight") or 1.28),
         year=year,
         min_samples=transition_min_samples,
+        region=region,
     )
     special_profile = _build_markov_special_transition_profile(
-        recent_data,
+        data,
         window=window,
         decay=float(config.get("transition_decay") or 0.985),
         year=year,
         min_samples=transition_min_samples,
+        source_special_weight=float(config.get("source_special_weight") or 1.28),
+        region=region,
     )
     transition_norm = transition_profile.get("transition_scores") or {}
     special_transition_norm = transition_profile.get("special_transition_scores") or {}
@@ -7367,10 +8487,11 @@ def _predict_with_markov(data, region, variation_key=None):
     trend_norm = _normalize_metric_map(analyze_special_number_frequency(trend_data))
     normal_norm = _normalize_metric_map(_build_number_frequency(recent_data))
     overdue_norm = _normalize_metric_map(_build_overdue_scores(recent_data))
-    feedback = _build_prediction_feedback(region, "markov", cutoff_period=cutoff_period)
-    failure_profile = _build_markov_failure_profile(region, cutoff_period=cutoff_period)
-    ml_distillation = _build_markov_ml_distillation(region, cutoff_period=cutoff_period) if markov_guard.get("mode") == "anchor_guard" else {"confidence": 0.0, "samples": 0, "special": {}, "normal": {}}
-    anchor_profile = _build_markov_anchor_profile(region, cutoff_period=cutoff_period)
+    with span("markov.feedback_profiles"):
+        feedback = _build_prediction_feedback(region, "markov", cutoff_period=cutoff_period)
+        failure_profile = _build_markov_failure_profile(region, cutoff_period=cutoff_period)
+        ml_distillation = _build_markov_ml_distillation(region, cutoff_period=cutoff_period) if markov_guard.get("mode") == "anchor_guard" else {"confidence": 0.0, "samples": 0, "special": {}, "normal": {}}
+        anchor_profile = _build_markov_anchor_profile(region, cutoff_period=cutoff_period)
     feedback_confidence = float(feedback.get("confidence") or 0.0)
     failure_confidence = float(failure_profile.get("confidence") or 0.0)
     ml_distill_confidence = float(ml_distillation.get("confidence") or 0.0)
@@ -7391,81 +8512,110 @@ def _predict_with_markov(data, region, variation_key=None):
     latest_numbers = set(_extract_draw_numbers(recent_data[0], include_special=True) if recent_data else [])
     preferred_parity = max(parity_pref.items(), key=lambda item: item[1])[0] if parity_pref else ""
 
-    def attribute_score(number):
-        return (
-            float(weights.get("color", 0.0)) * color_pref.get(_get_color_zh(number), 0.0) +
-            float(weights.get("zodiac", 0.0)) * zodiac_pref.get(number_to_zodiac.get(str(number), ""), 0.0) +
-            float(weights.get("parity", 0.0)) * parity_pref.get(_get_parity_zh(number), 0.0)
-        )
-
-    def repeat_penalty(number):
-        return float(config.get("repeat_penalty", -0.18) or -0.18) if number in latest_numbers else 0.0
-
-    number_scores = {}
-    special_scores = {}
-    for number in range(1, 50):
-        key = str(number)
-        feedback_score = (
-            (feedback.get("special", {}).get(key, 0.5) - 0.5) * 0.66 +
-            (feedback.get("normal", {}).get(key, 0.5) - 0.5) * 0.34
-        ) * feedback_confidence
-        ml_distill_score = (
-            ((ml_distillation.get("special") or {}).get(key, 0.5) - 0.5) * 0.58 +
-            ((ml_distillation.get("normal") or {}).get(key, 0.5) - 0.5) * 0.42
-        ) * ml_distill_confidence
-        anchor_score = (
-            ((anchor_profile.get("special") or {}).get(key, 0.5) - 0.5) * 0.62 +
-            ((anchor_profile.get("normal") or {}).get(key, 0.5) - 0.5) * 0.38
-        ) * anchor_confidence
-        attr = attribute_score(number)
-        attribute_transition_score = _score_markov_attribute_transition(
-            number,
-            transition_profile.get("latest_special"),
-            attribute_profile,
-            zodiac_map=number_to_zodiac,
-        )
-        special_attribute_transition_score = _score_markov_attribute_transition(
-            number,
-            special_profile.get("latest_special"),
-            special_attribute_profile,
-            zodiac_map=number_to_zodiac,
+    # 各特征先展开成 1..49 的向量，号码得分是特征矩阵按权重做的一次线性组合；
+    # 逐项相加的顺序与原逐号公式保持一致，保证浮点结果不变。
+    numbers = range(1, MARKOV_NUMBER_COUNT + 1)
+    keys = [str(number) for number in numbers]
+
+    def metric_vector(metric_map, default=0.0):
+        metric_map = metric_map or {}
+        return [metric_map.get(key, default) for key in keys]
+
+    def centered_vector(metric_map, factor):
+        return [(value - 0.5) * factor for value in metric_vector(metric_map, 0.5)]
+
+    def weighted_sum(terms):
+        totals = [0.0] * MARKOV_NUMBER_COUNT
+        for coefficient, vector in terms:
+            totals = [total + coefficient * value for total, value in zip(totals, vector)]
+        return totals
+
+    attribute_index = _build_markov_attribute_index(number_to_zodiac)
+    color_values = [color_pref.get(_get_color_zh(number), 0.0) for number in numbers]
+    zodiac_values = [zodiac_pref.get(number_to_zodiac.get(key, ""), 0.0) for key in keys]
+    parity_labels = [_get_parity_zh(number) for number in numbers]
+    attribute_vector = weighted_sum([
+        (float(weights.get("color", 0.0)), color_values),
+        (float(weights.get("zodiac", 0.0)), zodiac_values),
+        (float(weights.get("parity", 0.0)), [parity_pref.get(label, 0.0) for label in parity_labels]),
+    ])
+    repeat_penalty_value = float(config.get("repeat_penalty", -0.18) or -0.18)
+    repeat_vector = [repeat_penalty_value if number in latest_numbers else 0.0 for number in numbers]
+    feedback_vector = [
+        (special_part + normal_part) * feedback_confidence
+        for special_part, normal_part in zip(
+            centered_vector(feedback.get("special"), 0.66),
+            centered_vector(feedback.get("normal"), 0.34),
         )
-        failure_adjustment = (float((failure_profile.get("candidate") or {}).get(key, 0.5)) - 0.5) * 2.0 * failure_confidence
-        score = (
-            float(weights.get("transition", 1.0)) * transition_norm.get(key, 0.0) +
-            float(weights.get("transition_lift", 0.0)) * transition_lift_norm.get(key, 0.0) +
-            float(weights.get("second_order", 0.0)) * second_order_confidence * second_order_norm.get(key, 0.0) +
-            float(weights.get("phase_transition", 0.0)) * phase_transition_norm.get(key, 0.0) +
-            float(weights.get("attribute_transition", 0.0)) * attribute_transition_score +
-            float(weights.get("hot", 0.0)) * hot_norm.get(key, 0.0) +
-            float(weights.get("trend", 0.0)) * trend_norm.get(key, 0.0) +
-            float(weights.get("normal", 0.0)) * normal_norm.get(key, 0.0) +
-            float(weights.get("overdue", 0.0)) * overdue_norm.get(key, 0.0) +
-            float(weights.get("feedback", 0.0)) * feedback_score +
-            (0.42 if markov_guard.get("mode") == "anchor_guard" else 0.12) * ml_distill_score +
-            anchor_weight * anchor_score +
-            float(weights.get("failure", 0.0)) * failure_adjustment +
-            attr +
-            repeat_penalty(number)
+    ]
+    ml_distill_vector = [
+        (special_part + normal_part) * ml_distill_confidence
+        for special_part, normal_part in zip(
+            centered_vector(ml_distillation.get("special"), 0.58),
+            centered_vector(ml_distillation.get("normal"), 0.42),
         )
-        number_scores[number] = round(score, 6)
-        parity_bonus = 0.08 if preferred_parity and _get_parity_zh(number) == preferred_parity else 0.0
-        special_scores[number] = round(
-            score +
-            float(weights.get("special_transition", 0.0)) * special_transition_norm.get(key, 0.0) +
-            float(weights.get("special_transition_lift", 0.0)) * special_transition_lift_norm.get(key, 0.0) +
-            float(weights.get("special_chain", 0.0)) * (
-                special_direct_confidence * special_direct_norm.get(key, 0.0) +
-                special_second_order_confidence * special_second_order_norm.get(key, 0.0) * 0.72
-            ) +
-            float(weights.get("special_attribute", 0.0)) * special_direct_confidence * special_attribute_transition_score +
-            float(weights.get("second_order", 0.0)) * second_order_confidence * second_order_norm.get(key, 0.0) * 0.35 +
-            float(weights.get("phase_transition", 0.0)) * phase_transition_norm.get(key, 0.0) * 0.25 +
-            (feedback.get("special", {}).get(key, 0.5) - 0.5) * feedback_confidence * 0.32 +
-            ((anchor_profile.get("special") or {}).get(key, 0.5) - 0.5) * anchor_confidence * anchor_weight * 0.75 +
-            parity_bonus,
-            6,
+    ]
+    anchor_vector = [
+        (special_part + normal_part) * anchor_confidence
+        for special_part, normal_part in zip(
+            centered_vector(anchor_profile.get("special"), 0.62),
+            centered_vector(anchor_profile.get("normal"), 0.38),
         )
+    ]
+    attribute_transition_vector = _score_markov_attribute_transitions(
+        transition_profile.get("latest_special"),
+        attribute_profile,
+        attribute_index,
+    )
+    special_attribute_transition_vector = _score_markov_attribute_transitions(
+        special_profile.get("latest_special"),
+        special_attribute_profile,
+        attribute_index,
+    )
+    failure_vector = [
+        (float(value) - 0.5) * 2.0 * failure_confidence
+        for value in metric_vector(failure_profile.get("candidate"), 0.5)
+    ]
+    transition_vector = metric_vector(transition_norm)
+    second_order_vector = metric_vector(second_order_norm)
+    phase_transition_vector = metric_vector(phase_transition_norm)
+    raw_scores = weighted_sum([
+        (float(weights.get("transition", 1.0)), transition_vector),
+        (float(weights.get("transition_lift", 0.0)), metric_vector(transition_lift_norm)),
+        (float(weights.get("second_order", 0.0)) * second_order_confidence, second_order_vector),
+        (float(weights.get("phase_transition", 0.0)), phase_transition_vector),
+        (float(weights.get("attribute_transition", 0.0)), attribute_transition_vector),
+        (float(weights.get("hot", 0.0)), metric_vector(hot_norm)),
+        (float(weights.get("trend", 0.0)), metric_vector(trend_norm)),
+        (float(weights.get("normal", 0.0)), metric_vector(normal_norm)),
+        (float(weights.get("overdue", 0.0)), metric_vector(overdue_norm)),
+        (float(weights.get("feedback", 0.0)), feedback_vector),
+        (0.42 if markov_guard.get("mode") == "anchor_guard" else 0.12, ml_distill_vector),
+        (anchor_weight, anchor_vector),
+        (float(weights.get("failure", 0.0)), failure_vector),
+        (1.0, attribute_vector),
+        (1.0, repeat_vector),
+    ])
+    second_order_coefficient = float(weights.get("second_order", 0.0)) * second_order_confidence
+    phase_coefficient = float(weights.get("phase_transition", 0.0))
+    special_chain_vector = [
+        special_direct_confidence * direct_value + special_second_order_confidence * second_value * 0.72
+        for direct_value, second_value in zip(metric_vector(special_direct_norm), metric_vector(special_second_order_norm))
+    ]
+    special_raw_scores = weighted_sum([
+        (1.0, raw_scores),
+        (float(weights.get("special_transition", 0.0)), metric_vector(special_transition_norm)),
+        (float(weights.get("special_transition_lift", 0.0)), metric_vector(special_transition_lift_norm)),
+        (float(weights.get("special_chain", 0.0)), special_chain_vector),
+        (float(weights.get("special_attribute", 0.0)) * special_direct_confidence, special_attribute_transition_vector),
+        (1.0, [second_order_coefficient * value * 0.35 for value in second_order_vector]),
+        (1.0, [phase_coefficient * value * 0.25 for value in phase_transition_vector]),
+        (1.0, [(value - 0.5) * feedback_confidence * 0.32 for value in metric_vector(feedback.get("special"), 0.5)]),
+        (1.0, [(value - 0.5) * anchor_confidence * anchor_weight * 0.75 for value in metric_vector(anchor_profile.get("special"), 0.5)]),
+        (1.0, [0.08 if preferred_parity and label == preferred_parity else 0.0 for label in parity_labels]),
+    ])
+    number_scores = {number: round(score, 6) for number, score in zip(numbers, raw_scores)}
+    special_scores = {number: round(score, 6) for number, score in zip(numbers, special_raw_scores)}
 
     overall_rank = _rank_numbers(number_scores)
     bucket_counts = _resolve_local_bucket_counts(config.get("bucket_counts") or [2, 2, 2], "neutral")
@@ -7633,9 +8783,11 @@ def _predict_with_markov(data, region, variation_key=None):
 
 
 def _resolve_local_strategy_phase_profile(data, config=None):
-    profile = _classify_ai_market_phase(
-        data,
-        window=max(8, int((config or {}).get("window") or 12)),
+    window = max(8, int((config or {}).get("window") or 12))
+    profile = _shared_analysis_call(
+        "market_phase",
+        lambda: (_runtime_draws_signature(data), window),
+        lambda: _classify_ai_market_phase(data, window=window),
     )
     return profile if isinstance(profile, dict) else {"label": "neutral", "confidence": 0.0, "adjustments": {}}
 
@@ -8236,6 +9388,7 @@ def _get_ml_bucket_name(number):
     return "high"
 
 
+@traced("ml.select_normal")
 def _select_ml_normal_numbers(
     ranked_numbers,
     score_map,
@@ -8337,6 +9490,7 @@ def _build_ml_recent_selection_state(history_data, region, year=None):
     }
 
 
+@traced("ml.select_special")
 def _select_ml_special_number(
     special_ranked_numbers,
     special_score_map,
@@ -8555,6 +9709,7 @@ def _get_ml_ensemble_weights(region, strategies=None):
     }
 
 
+@traced("ml.ensemble_signals")
 def _build_ml_ensemble_signals(data, region):
     strategies = tuple(_select_ml_ensemble_strategies(region, persist=False))
     if not strategies:
@@ -8643,6 +9798,7 @@ def _score_ml_model(model):
     )
 
 
+@traced("ml.optimize_runtime")
 def _optimize_ml_runtime_config(data, region, config):
     data_size = len(data or [])
     base_config = dict(config or {})
@@ -8796,6 +9952,7 @@ def _optimize_ml_runtime_config(data, region, config):
     return best_config, best_model
 
 
+@traced("ml.train_model")
 def _train_ml_number_model(data, region, config):
     history_window = _clamp(int(config.get("history_window") or 120), 80, 240)
     feature_window = _clamp(int(config.get("feature_window") or 60), 30, 90)
@@ -9149,22 +10306,149 @@ def _train_ml_number_model(data, region, config):
     }
 
 
+def _prediction_settlement_state_key(region):
+    return f"prediction_settlement_state_{str(region or '').strip().lower()}"
+
+
+def _count_settled_predictions_by_strategy(region):
+    """Aggregate settled hit/total counters per strategy with one grouped query.
+
+    Numbers are compared as integers, like ``_normalize_draw_number`` does at settlement
+    time: macau rows store "5" while predictions may carry "05".
+    """
+    predicted = db.cast(db.func.trim(PredictionRecord.special_number), db.Integer)
+    actual = db.cast(db.func.trim(PredictionRecord.actual_special_number), db.Integer)
+    rows = (
+        db.session.query(
+            PredictionRecord.strategy,
+            db.func.count(PredictionRecord.id),
+            db.func.sum(db.case((predicted == actual, 1), else_=0)),
+        )
+        .filter(
+            PredictionRecord.region == region,
+            PredictionRecord.is_result_updated.is_(True),
+            PredictionRecord.actual_special_number != None,
+            db.func.trim(PredictionRecord.actual_special_number) != "",
+        )
+        .group_by(PredictionRecord.strategy)
+        .all()
+    )
+    return {
+        str(strategy or ""): {"hits": int(hits or 0), "total": int(total or 0)}
+        for strategy, total, hits in rows
+        if strategy
+    }
+
+
+def _parse_prediction_settlement_state(raw):
+    try:
+        state = json.loads(raw) if raw else {}
+    except Exception:
+        state = {}
+    return state if isinstance(state, dict) else {}
+
+
+def _rebuild_prediction_settlement_state(region, max_attempts=10):
+    """Recount settled predictions and advance the generation with a compare-and-swap.
+
+    The state row is only overwritten if it still holds the value this call read, otherwise
+    the recount is retried. Concurrent settlers therefore each move the generation forward,
+    and the counters stored last come from a recount that saw every committed settlement.
+    """
+    normalized_region = str(region or "").strip().lower()
+    key = _prediction_settlement_state_key(normalized_region)
+    for attempt in range(max(1, int(max_attempts))):
+        if attempt:
+            # 抖动退避，避免几个进程同时重读、同时再撞一次。
+            time.sleep(random.uniform(0.01, 0.05) * attempt)
+        current = db.session.query(SystemConfig.id, SystemConfig.value).filter_by(key=key).first()
+        state = {
+            "generation": int(_parse_prediction_settlement_state(current.value if current else "").get("generation") or 0) + 1,
+            "strategies": _count_settled_predictions_by_strategy(normalized_region),
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        payload = json.dumps(state, ensure_ascii=True, sort_keys=True)
+        try:
+            if current is None:
+                db.session.add(SystemConfig(key=key, value=payload, description=f"Prediction settlement counters ({normalized_region})"))
+                updated = 1
+            else:
+                updated = (
+                    SystemConfig.query
+                    .filter(SystemConfig.id == current.id, SystemConfig.value == current.value)
+                    .update({"value": payload, "updated_at": datetime.now()}, synchronize_session=False)
+                )
+            db.session.commit()
+        except IntegrityError:
+            # 另一个进程抢先插入了同一键，重读后再试。
+            db.session.rollback()
+            continue
+        if updated:
+            return state
+    raise RuntimeError(f"预测结算计数并发更新冲突，已重试 {max_attempts} 次")
+
+
+def _load_prediction_settlement_state(region, rebuild_missing=True):
+    normalized_region = str(region or "").strip().lower()
+    state = _parse_prediction_settlement_state(
+        SystemConfig.get_config(_prediction_settlement_state_key(normalized_region), "")
+    )
+    if "generation" not in state:
+        if not rebuild_missing:
+            return {"generation": 0, "strategies": {}}
+        try:
+            state = _rebuild_prediction_settlement_state(normalized_region)
+        except Exception as e:
+            db.session.rollback()
+            print(f"初始化 {normalized_region} 预测结算计数失败: {e}")
+            return {"generation": 0, "strategies": {}}
+    state.setdefault("strategies", {})
+    return state
+
+
+def get_prediction_settlement_generation(region):
+    """Return the region's settlement generation; it advances whenever settled rows change."""
+    return int(_load_prediction_settlement_state(region).get("generation") or 0)
+
+
+def _record_prediction_settlements(region, strategy_counters):
+    if not strategy_counters:
+        return None
+    # 不在旧计数上累加：并发结算时读-改-写会丢增量，按库内已提交的结算重数一遍（一条分组查询）。
+    return _rebuild_prediction_settlement_state(region)
+
+
+def invalidate_prediction_settlement_state(region=None):
+    """Recount settled predictions after bulk edits such as deletes or imports."""
+    regions = [region] if region else ["hk", "macau"]
+    for item in regions:
+        try:
+            _rebuild_prediction_settlement_state(item)
+        except Exception as e:
+            db.session.rollback()
+            print(f"重建 {item} 预测结算计数失败: {e}")
+    _clear_ml_prediction_cache(region)
+
+
 def _build_ml_prediction_cache_key(region, data, config):
     normalized_region = str(region or "").strip().lower()
     head_periods = [
         str(item.get("id") or "").strip()
         for item in list(data or [])[:16]
     ]
+    settlement_state = _load_prediction_settlement_state(normalized_region)
+    settled_counters = settlement_state.get("strategies") or {}
     accuracy_signature = {}
     for strategy in ("hybrid", "balanced", "markov", "trend", "hot", "cold"):
-        accuracy, total = _calculate_strategy_accuracy(normalized_region, strategy, limit=None)
+        counter = settled_counters.get(strategy) or {}
         accuracy_signature[strategy] = {
-            "accuracy": round(float(accuracy or 0.0), 6),
-            "total": int(total or 0),
+            "hits": int(counter.get("hits") or 0),
+            "total": int(counter.get("total") or 0),
         }
     payload = {
-        "cache_version": 4,
+        "cache_version": 5,
         "region": normalized_region,
+        "settlement_generation": int(settlement_state.get("generation") or 0),
         "backtest_cutoff_period": _current_backtest_cutoff_period(),
         "periods": head_periods,
         "draw_count": len(data or []),
@@ -9213,6 +10497,7 @@ def _prune_stale_ml_prediction_cache(region, latest_period):
         ]
         for key in stale_keys:
             _ml_prediction_cache.pop(key, None)
+        _ml_prediction_cache_stats.evicted(len(stale_keys))
 
 
 def _clear_ml_prediction_cache(region=None):
@@ -9245,6 +10530,7 @@ def _get_cached_ml_prediction_artifacts(cache_key):
         cached_at = float(cached.get("cached_at") or 0.0)
         if ttl_seconds is not None and now - cached_at > ttl_seconds:
             _ml_prediction_cache.pop(cache_key, None)
+            _ml_prediction_cache_stats.evicted()
             return None
         cached["cached_at"] = now
         return copy.deepcopy(cached.get("artifacts"))
@@ -9266,12 +10552,14 @@ def _store_cached_ml_prediction_artifacts(cache_key, artifacts, region=None, lat
             ]
             for key in expired_keys:
                 _ml_prediction_cache.pop(key, None)
+            _ml_prediction_cache_stats.evicted(len(expired_keys))
         while len(_ml_prediction_cache) >= _ML_PREDICTION_CACHE_MAX_ITEMS:
             oldest_key = min(
                 _ml_prediction_cache.keys(),
                 key=lambda key: float(_ml_prediction_cache[key].get("cached_at") or 0.0),
             )
             _ml_prediction_cache.pop(oldest_key, None)
+            _ml_prediction_cache_stats.evicted()
         _ml_prediction_cache[cache_key] = {
             "cached_at": now,
             "region": str(region or "").strip().lower(),
@@ -9305,21 +10593,22 @@ def _build_uncached_ml_prediction_artifacts(enriched_data, supplemental_draws, r
     color_pref, _, parity_pref = _build_attribute_preferences(
         enriched_data[:feature_window], region, feedback, year, apply_recent_zodiac_cooldown=True
     )
-    feature_table = _build_ml_feature_table(enriched_data, region, feature_window=feature_window)
-    feature_table = _apply_ml_feature_profile(
-        feature_table,
-        runtime_config.get("feature_profile") or model.get("feature_profile"),
-    )
-    score_pairs = _build_ml_score_pairs(
-        feature_table,
-        model.get("weights", []),
-        model.get("bias", 0.0),
-    )
-    probability_map = _build_ml_probability_map(score_pairs)
-    heuristic_map = _build_ml_heuristic_score_map(feature_table)
-    blend_weight = float(model.get("selected_blend", 0.7) or 0.7)
-    blended_scores = _blend_ml_rankings(probability_map, heuristic_map, blend_weight)
-    ranked_numbers = _rank_numbers(blended_scores)
+    with span("ml.score_features"):
+        feature_table = _build_ml_feature_table(enriched_data, region, feature_window=feature_window)
+        feature_table = _apply_ml_feature_profile(
+            feature_table,
+            runtime_config.get("feature_profile") or model.get("feature_profile"),
+        )
+        score_pairs = _build_ml_score_pairs(
+            feature_table,
+            model.get("weights", []),
+            model.get("bias", 0.0),
+        )
+        probability_map = _build_ml_probability_map(score_pairs)
+        heuristic_map = _build_ml_heuristic_score_map(feature_table)
+        blend_weight = float(model.get("selected_blend", 0.7) or 0.7)
+        blended_scores = _blend_ml_rankings(probability_map, heuristic_map, blend_weight)
+        ranked_numbers = _rank_numbers(blended_scores)
     ensemble_signals = _build_ml_ensemble_signals(enriched_data, region)
     special_score_map, normal_score_map = _build_ml_dual_score_maps(
         ranked_numbers,
@@ -9354,6 +10643,7 @@ def _build_ml_prediction_artifacts(data, region):
     _prune_stale_ml_prediction_cache(cache_region, cache_latest_period)
     cached_artifacts = _get_cached_ml_prediction_artifacts(cache_key)
     if cached_artifacts is not None:
+        _ml_prediction_cache_stats.hit()
         return cached_artifacts
 
     build_event, should_build = _claim_ml_prediction_build(cache_key)
@@ -9361,14 +10651,17 @@ def _build_ml_prediction_artifacts(data, region):
         build_event.wait()
         cached_artifacts = _get_cached_ml_prediction_artifacts(cache_key)
         if cached_artifacts is not None:
+            _ml_prediction_cache_stats.hit()
             return cached_artifacts
         build_event, should_build = _claim_ml_prediction_build(cache_key)
 
     try:
         cached_artifacts = _get_cached_ml_prediction_artifacts(cache_key)
         if cached_artifacts is not None:
+            _ml_prediction_cache_stats.hit()
             return cached_artifacts
 
+        _ml_prediction_cache_stats.miss()
         artifacts = _build_uncached_ml_prediction_artifacts(
             enriched_data,
             supplemental_draws,
@@ -9387,7 +10680,9 @@ def _build_ml_prediction_artifacts(data, region):
 
 
 def _predict_with_ml(data, region, variation_key=None):
-    artifacts = _build_ml_prediction_artifacts(data, region)
+    # 命中缓存时 ml.artifacts 下面没有训练相关的子阶段。
+    with span("ml.artifacts"):
+        artifacts = _build_ml_prediction_artifacts(data, region)
     enriched_data = artifacts["enriched_data"]
     supplemental_draws = artifacts["supplemental_draws"]
     runtime_config = artifacts["runtime_config"]
@@ -9540,7 +10835,42 @@ def _predict_with_ml(data, region, variation_key=None):
         "model_meta": model_meta,
     }
 
+def _prediction_trace_in_meta():
+    return _PREDICTION_TRACE_IN_META or app.debug
+
+
+def _attach_stage_timings(result, trace_span):
+    """调试开关打开时把 trace_span 及其子阶段的耗时写进 model_meta，返回新的结果字典。"""
+    if trace_span is None or not _prediction_trace_in_meta() or not isinstance(result, dict) or result.get("error"):
+        return result
+    result = dict(result)
+    model_meta = dict(result.get("model_meta") or {})
+    model_meta["stage_timings_ms"] = trace_span.timings()
+    result["model_meta"] = model_meta
+    return result
+
+
 def get_local_recommendations(strategy, data, region, variation_key=None):
+    with span(f"local.{strategy}") as trace_span:
+        if variation_key is not None:
+            result = _compute_local_recommendations(strategy, data, region, variation_key=variation_key)
+        else:
+            result = _shared_analysis_call(
+                "local_recommendation",
+                lambda: (
+                    strategy,
+                    region,
+                    _runtime_draws_signature(data),
+                    _current_backtest_cutoff_period(),
+                    _backtest_strict_strategy_enabled(),
+                    _runtime_json_signature(getattr(_strategy_config_override_local, "configs", {}) or {}),
+                ),
+                lambda: _compute_local_recommendations(strategy, data, region),
+            )
+    return _attach_stage_timings(result, trace_span)
+
+
+def _compute_local_recommendations(strategy, data, region, variation_key=None):
     all_numbers = list(range(1, 50))
     if not data:
         return _build_default_baseline_prediction()
@@ -9877,13 +11207,47 @@ def get_local_recommendations(strategy, data, region, variation_key=None):
                 return _build_default_baseline_prediction()
             return get_local_recommendations('balanced', data, region, variation_key=variation_key)
 
-def _build_ai_prompt(data, region, history_window=10):
-    history_lines = []
-    recent_data = data[:history_window]
-    learning_context = _build_ai_learning_context(data, region, history_window=history_window)
-    if region == 'hk':
-        year = datetime.now().year
-        if recent_data:
+def iter_strategy_predictions(data, region, strategies=None, variation_keys=None):
+    """Yield ``(strategy, result)`` as each local strategy finishes, sharing one analysis pass."""
+    requested = [
+        strategy
+        for strategy in _dedupe_keep_order(strategies or LOCAL_STRATEGY_KEYS)
+        if strategy in LOCAL_STRATEGY_KEYS
+    ]
+    # 机器学习会把其它本地策略的结果作为集成信号，放到最后以复用同批次的结果。
+    ordered = [strategy for strategy in requested if strategy != "ml"]
+    if "ml" in requested:
+        ordered.append("ml")
+    variation_keys = dict(variation_keys or {})
+    with _shared_prediction_analysis_scope():
+        for strategy in ordered:
+            try:
+                result = get_local_recommendations(
+                    strategy,
+                    data,
+                    region,
+                    variation_key=variation_keys.get(strategy),
+                )
+            except Exception as e:
+                if _backtest_strict_strategy_enabled():
+                    raise
+                print(f"批量预测 {region} {strategy} 策略失败: {e}")
+                result = {"error": f"预测失败：{e}"}
+            yield strategy, result
+
+
+def predict_all_strategies(data, region, strategies=None, variation_keys=None):
+    """批量计算多个本地策略，频率、转移、属性偏好和反馈等分析只做一次。"""
+    return dict(iter_strategy_predictions(data, region, strategies=strategies, variation_keys=variation_keys))
+
+
+def _build_ai_prompt(data, region, history_window=10):
+    history_lines = []
+    recent_data = data[:history_window]
+    learning_context = _build_ai_learning_context(data, region, history_window=history_window)
+    if region == 'hk':
+        year = datetime.now().year
+        if recent_data:
             try:
                 year = int(str(recent_data[0].get('date', ''))[:4])
             except (TypeError, ValueError):
@@ -10073,21 +11437,298 @@ def _build_ai_sampling_temperatures(base_temperature, sample_count):
     return values
 
 
-def _call_ai_completion(ai_config, prompt, temperature=0.35):
+def _get_ai_http_session(api_url):
+    """同一接口地址复用一个带连接池的 Session，省去每次补全的 DNS/TCP/TLS 握手。"""
+    key = str(api_url or "").strip()
+    with _ai_http_sessions_lock:
+        session_obj = _ai_http_sessions.get(key)
+        if session_obj is None:
+            session_obj = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=_AI_HTTP_POOL_MAXSIZE,
+            )
+            session_obj.mount("https://", adapter)
+            session_obj.mount("http://", adapter)
+            _ai_http_sessions[key] = session_obj
+        return session_obj
+
+
+def _mark_ai_http_connection(response):
+    """给底层连接计数，返回本次请求是否复用了已有的长连接。"""
+    connection = getattr(getattr(response, "raw", None), "connection", None)
+    if connection is None:
+        return False
+    served = int(getattr(connection, "_ai_requests_served", 0) or 0)
+    try:
+        connection._ai_requests_served = served + 1
+    except AttributeError:
+        return False
+    return served > 0
+
+
+def _ai_http_retry_delay_seconds(attempt, response=None):
+    retry_after = str((response.headers.get("Retry-After") if response is not None else "") or "").strip()
+    if retry_after.replace(".", "", 1).isdigit():
+        return min(float(retry_after), 30.0)
+    # 指数退避加随机抖动，避免并发采样同时撞上限流后又同时重试。
+    base_delay = float(_AI_HTTP_RETRY_BACKOFF_SECONDS) * (2 ** max(0, int(attempt) - 1))
+    return base_delay * (0.5 + random.random())
+
+
+def _record_ai_http_call(api_url, elapsed_seconds, status_code=None, reused=False, retried=False, error=None):
+    host = urlparse(str(api_url or "")).netloc or str(api_url or "")
+    elapsed_ms = round(max(0.0, float(elapsed_seconds or 0.0)) * 1000, 1)
+    with _ai_http_metrics_lock:
+        metrics = _ai_http_metrics.setdefault(host, {
+            "requests": 0,
+            "reused_connections": 0,
+            "new_connections": 0,
+            "retries": 0,
+            "errors": 0,
+            "total_ms": 0.0,
+            "max_ms": 0.0,
+            "status_counts": {},
+        })
+        metrics["requests"] += 1
+        if status_code is not None:
+            metrics["reused_connections" if reused else "new_connections"] += 1
+            status_key = str(status_code)
+            metrics["status_counts"][status_key] = metrics["status_counts"].get(status_key, 0) + 1
+        if retried:
+            metrics["retries"] += 1
+        if error is not None:
+            metrics["errors"] += 1
+        metrics["total_ms"] += elapsed_ms
+        metrics["max_ms"] = max(metrics["max_ms"], elapsed_ms)
+        metrics["last_ms"] = elapsed_ms
+        _ai_http_recent_calls.append({
+            "host": host,
+            "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "elapsed_ms": elapsed_ms,
+            "status": status_code,
+            "reused": bool(reused),
+            "retried": bool(retried),
+            "error": str(error)[:200] if error is not None else "",
+        })
+
+
+def get_ai_http_metrics():
+    """AI 接口调用统计快照：按主机汇总的连接复用率、重试与耗时，以及最近的调用明细。"""
+    with _ai_http_metrics_lock:
+        hosts = {}
+        for host, metrics in _ai_http_metrics.items():
+            snapshot = dict(metrics)
+            snapshot["status_counts"] = dict(metrics.get("status_counts") or {})
+            connected = snapshot["reused_connections"] + snapshot["new_connections"]
+            snapshot["reuse_rate"] = round(snapshot["reused_connections"] / connected, 4) if connected else 0.0
+            snapshot["avg_ms"] = round(snapshot["total_ms"] / snapshot["requests"], 1) if snapshot["requests"] else 0.0
+            hosts[host] = snapshot
+        return {"hosts": hosts, "recent_calls": list(_ai_http_recent_calls)}
+
+
+def _ai_request_cancelled(deadline=None, cancel_event=None):
+    if cancel_event is not None and cancel_event.is_set():
+        return True
+    return deadline is not None and time.perf_counter() >= deadline
+
+
+def _read_ai_response_body(response, deadline=None, cancel_event=None):
+    """分块读取正文，每块之间检查截止时间和取消信号。
+
+    读超时只限制单次 recv，慢慢吐字的接口可以一直拖过预算；被取消时直接关闭
+    连接（读了一半的连接不会放回池里），让采样线程立刻归还给线程池。
+    """
+    if deadline is None and cancel_event is None:
+        return response.content
+    # read1 有多少数据就返回多少；普通 read(n) 会一直等凑满 n 字节才回来检查。
+    read_chunk = getattr(response.raw, "read1", None) or response.raw.read
+    chunks = []
+    while True:
+        if _ai_request_cancelled(deadline, cancel_event):
+            response.close()
+            raise TimeoutError("AI 采样已取消")
+        chunk = read_chunk(8192, decode_content=True)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    response._content = b"".join(chunks)
+    response._content_consumed = True
+    return response._content
+
+
+def _post_ai_request(api_url, payload, headers, timeout=None, stream=False, deadline=None, cancel_event=None):
+    """经连接池发送 AI 请求；429/5xx 与连接错误按抖动退避重试，并记录每次调用的指标。
+
+    stream=False 时在返回前读完正文，让连接尽快回到池里；cancel_event 被置位后
+    不再重试，正在读的正文也会中断并关闭连接。
+    """
+    session_obj = _get_ai_http_session(api_url)
+    attempt = 0
+    while True:
+        attempt += 1
+        request_timeout = _ai_http_timeout_until(deadline) if deadline is not None else (timeout or _ai_http_timeout())
+        started_at = time.perf_counter()
+        try:
+            response = session_obj.post(api_url, json=payload, headers=headers, timeout=request_timeout, stream=True)
+        except requests.exceptions.ConnectionError as exc:
+            retry_delay = _ai_http_retry_delay_seconds(attempt)
+            can_retry = attempt <= _AI_HTTP_MAX_RETRIES and (deadline is None or time.perf_counter() + retry_delay < deadline)
+            _record_ai_http_call(api_url, time.perf_counter() - started_at, retried=can_retry, error=exc)
+            if not can_retry or (cancel_event is not None and cancel_event.wait(retry_delay)):
+                raise
+            if cancel_event is None:
+                time.sleep(retry_delay)
+            continue
+        except Exception as exc:
+            _record_ai_http_call(api_url, time.perf_counter() - started_at, error=exc)
+            raise
+
+        reused = _mark_ai_http_connection(response)
+        if response.status_code in _AI_HTTP_RETRY_STATUSES and attempt <= _AI_HTTP_MAX_RETRIES:
+            retry_delay = _ai_http_retry_delay_seconds(attempt, response)
+            if deadline is None or time.perf_counter() + retry_delay < deadline:
+                _record_ai_http_call(api_url, time.perf_counter() - started_at, response.status_code, reused=reused, retried=True)
+                response.close()
+                if cancel_event is None:
+                    time.sleep(retry_delay)
+                elif cancel_event.wait(retry_delay):
+                    raise TimeoutError("AI 采样已取消")
+                continue
+        if not stream:
+            try:
+                _read_ai_response_body(response, deadline, cancel_event)
+            except Exception as exc:
+                _record_ai_http_call(api_url, time.perf_counter() - started_at, response.status_code, reused=reused, error=exc)
+                raise
+        _record_ai_http_call(api_url, time.perf_counter() - started_at, response.status_code, reused=reused)
+        return response
+
+
+def _ai_cassette_mode():
+    mode = str(_AI_CASSETTE_MODE or "").strip().lower()
+    return mode if mode in {"record", "replay"} else "off"
+
+
+def _ai_completion_available(ai_config):
+    # 回放模式只读录制结果，不需要真实的 API Key。
+    if _ai_cassette_mode() == "replay":
+        return True
+    api_key = str((ai_config or {}).get("api_key") or "").strip()
+    return bool(api_key and "你的" not in api_key)
+
+
+def _ai_cassette_key(payload):
+    fingerprint = json.dumps(
+        {
+            "model": str(payload.get("model") or ""),
+            "messages": payload.get("messages") or [],
+            "temperature": round(float(payload.get("temperature") or 0.0), 4),
+        },
+        ensure_ascii=True,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.md5(fingerprint.encode("utf-8")).hexdigest()
+
+
+def _ai_cassette_path(cassette_key):
+    return os.path.join(_AI_CASSETTE_DIR, f"{cassette_key}.json")
+
+
+def _record_ai_cassette(cassette_key, payload, content):
+    messages = payload.get("messages") or []
+    entry = {
+        "key": cassette_key,
+        "model": str(payload.get("model") or ""),
+        "temperature": payload.get("temperature"),
+        "prompt": str((messages[-1] if messages else {}).get("content") or ""),
+        "content": content,
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    path = _ai_cassette_path(cassette_key)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(_AI_CASSETTE_DIR, exist_ok=True)
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"写入 AI 录制结果失败 key={cassette_key}: {e}")
+        return
+    global _ai_cassette_writes
+    with _ai_cassette_prune_lock:
+        _ai_cassette_writes += 1
+        # 每写入一批才扫一次目录，首次写入时也检查一次，接上之前遗留的文件。
+        if _ai_cassette_writes % _AI_CASSETTE_PRUNE_EVERY != 1:
+            return
+    _prune_ai_cassettes()
+
+
+def _prune_ai_cassettes(max_files=None):
+    """录制文件超过上限时按修改时间删除最旧的，返回删除的文件数。"""
+    max_files = _AI_CASSETTE_MAX_FILES if max_files is None else max(1, int(max_files))
+    try:
+        entries = [
+            (entry.stat().st_mtime, entry.path)
+            for entry in os.scandir(_AI_CASSETTE_DIR)
+            if entry.is_file() and entry.name.endswith(".json")
+        ]
+    except OSError:
+        return 0
+    if len(entries) <= max_files:
+        return 0
+    entries.sort()
+    removed = 0
+    for _, path in entries[:len(entries) - max_files]:
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            continue
+    if removed:
+        print(f"AI 录制目录超过 {max_files} 个文件，已删除最旧的 {removed} 个")
+    return removed
+
+
+def _replay_ai_cassette(cassette_key, deadline=None):
+    latency_seconds = _AI_CASSETTE_REPLAY_LATENCY_MS / 1000.0
+    if latency_seconds > 0:
+        if deadline is not None and time.perf_counter() + latency_seconds > deadline:
+            time.sleep(max(0.0, deadline - time.perf_counter()))
+            raise TimeoutError("AI 采样预算已耗尽")
+        time.sleep(latency_seconds)
+    try:
+        with open(_ai_cassette_path(cassette_key), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        raise LookupError(f"AI 回放未找到录制结果 key={cassette_key}")
+    return str(entry.get("content") or "")
+
+
+def _call_ai_completion(ai_config, prompt, temperature=0.35, timeout=None, deadline=None, cancel_event=None, system_prompt=None):
     payload = {
         "model": ai_config['model'],
         "messages": [
-            {"role": "system", "content": _build_ai_system_prompt()},
+            {"role": "system", "content": system_prompt or _build_ai_system_prompt()},
             {"role": "user", "content": prompt}
         ],
         "temperature": temperature
     }
+    cassette_mode = _ai_cassette_mode()
+    if cassette_mode == "replay":
+        return _replay_ai_cassette(_ai_cassette_key(payload), deadline=deadline)
     headers = {"Authorization": f"Bearer {ai_config['api_key']}", "Content-Type": "application/json"}
-    response = requests.post(ai_config['api_url'], json=payload, headers=headers, timeout=_ai_http_timeout())
+    response = _post_ai_request(
+        ai_config['api_url'], payload, headers, timeout=timeout, deadline=deadline, cancel_event=cancel_event
+    )
     response.raise_for_status()
     if not response.encoding or response.encoding.lower() in ("iso-8859-1", "latin-1"):
         response.encoding = "utf-8"
-    return response.json()['choices'][0]['message']['content']
+    content = response.json()['choices'][0]['message']['content']
+    if cassette_mode == "record":
+        _record_ai_cassette(_ai_cassette_key(payload), payload, content)
+    return content
 
 
 def _safe_float(value, default=0.0):
@@ -10617,21 +12258,113 @@ def _repair_ai_response_text(response_text, region=None):
     return normalized
 
 
-def _call_ai_completion_with_retries(ai_config, prompt, temperature=0.35, max_attempts=2, region=None):
-    last_error = None
-    for attempt in range(max(1, int(max_attempts or 1))):
-        try:
-            response_text = _call_ai_completion(ai_config, prompt, temperature=temperature)
-            repaired = _repair_ai_response_text(response_text, region=region)
-            if str(repaired or "").strip():
-                return repaired
-        except Exception as exc:
-            last_error = exc
-        temperature = round(_clamp(float(temperature or 0.35) + 0.05, 0.16, 0.58), 2)
+def _call_ai_completion_repaired(ai_config, prompt, temperature=0.35, region=None, deadline=None, cancel_event=None):
+    # 连接错误和 429/5xx 只在 _post_ai_request 里重试，这里不再套一层，单个采样的上游请求数有上限。
+    if _ai_request_cancelled(deadline, cancel_event):
+        return ""
+    response_text = _call_ai_completion(
+        ai_config,
+        prompt,
+        temperature=temperature,
+        deadline=deadline,
+        cancel_event=cancel_event,
+    )
+    return _repair_ai_response_text(response_text, region=region) or ""
 
-    if last_error:
-        raise last_error
-    return ""
+
+def _get_ai_sample_executor():
+    global _ai_sample_executor
+    with _ai_sample_executor_lock:
+        if _ai_sample_executor is None:
+            _ai_sample_executor = ThreadPoolExecutor(
+                max_workers=_AI_SAMPLE_MAX_WORKERS,
+                thread_name_prefix="ai-sample",
+            )
+        return _ai_sample_executor
+
+
+def _run_ai_completion_sample(ai_config, prompt, temperature, region=None, deadline=None, cancel_event=None):
+    with app.app_context():
+        return _call_ai_completion_repaired(
+            ai_config,
+            prompt,
+            temperature=temperature,
+            region=region,
+            deadline=deadline,
+            cancel_event=cancel_event,
+        )
+
+
+def _ai_first_sample_deadline(deadline):
+    """保底首个采样的截止时间：比预算多留一次读超时，预测请求的总耗时仍有上限。"""
+    return None if deadline is None else deadline + _AI_HTTP_READ_TIMEOUT_SECONDS
+
+
+def _collect_ai_completions(ai_config, prompt, temperatures, region=None, deadline=None, guarantee_first=False):
+    """在有界线程池里并发发起多次采样，截止前按完成顺序收集结果。
+
+    guarantee_first=True 时第一个采样可以越过预算，最多再等一次读超时
+    （_ai_first_sample_deadline），预算耗尽前没有任何结果就继续等它。截止时仍在排队的
+    采样直接取消，已经发出的采样通过取消信号中断读取并关闭连接，不会继续占着共享线程池。
+    返回值按采样序号排列，与串行调用时的顺序一致。
+    """
+    temperatures = list(temperatures or [])
+    if not temperatures:
+        return []
+    first_deadline = _ai_first_sample_deadline(deadline) if guarantee_first else deadline
+    if len(temperatures) == 1:
+        try:
+            response_text = _call_ai_completion_repaired(
+                ai_config,
+                prompt,
+                temperature=temperatures[0],
+                region=region,
+                deadline=first_deadline,
+            )
+        except Exception:
+            return []
+        return [response_text] if str(response_text or "").strip() else []
+
+    executor = _get_ai_sample_executor()
+    futures = {}
+    cancel_events = {}
+    for index, temp in enumerate(temperatures):
+        cancel_event = threading.Event()
+        sample_deadline = first_deadline if index == 0 else deadline
+        future = executor.submit(_run_ai_completion_sample, ai_config, prompt, temp, region, sample_deadline, cancel_event)
+        futures[future] = index
+        cancel_events[future] = cancel_event
+    first_future = next(iter(futures)) if guarantee_first else None
+    collected = {}
+    pending = set(futures)
+    try:
+        while pending:
+            timeout = None
+            if deadline is not None:
+                now = time.perf_counter()
+                timeout = deadline - now
+                if timeout <= 0:
+                    if collected or first_future not in pending or now >= first_deadline:
+                        break
+                    # 预算已耗尽但还一无所获：其余采样取消，只等首个采样到它自己的截止时间。
+                    for future in pending:
+                        if future is not first_future:
+                            future.cancel()
+                            cancel_events[future].set()
+                    timeout = first_deadline - now
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response_text = future.result()
+                except Exception:
+                    continue
+                if str(response_text or "").strip():
+                    collected[futures[future]] = response_text
+    finally:
+        for future in pending:
+            future.cancel()
+            cancel_events[future].set()
+    return [collected[index] for index in sorted(collected)]
 
 
 def _resolve_ai_latency_budget_seconds(tuned=None, stream_mode=False):
@@ -10798,25 +12531,16 @@ def _ensure_ai_candidate_coverage(ai_responses, region, context, desired_count=3
     return responses
 
 
-def _extend_ai_responses_for_coverage(ai_config, prompt, responses, region, target_candidates, base_temperature=0.35, max_extra_calls=2):
+def _extend_ai_responses_for_coverage(ai_config, prompt, responses, region, target_candidates, base_temperature=0.35, max_extra_calls=2, deadline=None):
     responses = list(responses or [])
     target = max(2, int(target_candidates or 2))
-    for extra_index in range(max(0, int(max_extra_calls or 0))):
-        if _count_ai_unique_candidates(responses, region=region) >= target:
-            break
-        extra_temp = round(_clamp(float(base_temperature or 0.35) + 0.12 + extra_index * 0.05, 0.18, 0.58), 2)
-        try:
-            responses.append(
-                _call_ai_completion_with_retries(
-                    ai_config,
-                    prompt,
-                    temperature=extra_temp,
-                    max_attempts=2,
-                    region=region,
-                )
-            )
-        except Exception:
-            continue
+    if _count_ai_unique_candidates(responses, region=region) >= target:
+        return responses
+    extra_temperatures = [
+        round(_clamp(float(base_temperature or 0.35) + 0.12 + extra_index * 0.05, 0.18, 0.58), 2)
+        for extra_index in range(max(0, int(max_extra_calls or 0)))
+    ]
+    responses.extend(_collect_ai_completions(ai_config, prompt, extra_temperatures, region=region, deadline=deadline))
     return responses
 
 
@@ -10850,6 +12574,7 @@ def _attach_ai_prediction_metadata(result, tuned, region, elapsed_seconds=None,
     return result
 
 
+@traced("ai.prediction")
 def _run_ai_prediction_pipeline(
     data,
     region,
@@ -10863,11 +12588,15 @@ def _run_ai_prediction_pipeline(
     initial_response_text="",
     stream_mode=False,
 ):
-    started_at = time.perf_counter()
-    budget_seconds = _resolve_ai_latency_budget_seconds(tuned, stream_mode=stream_mode)
-    use_cache = not stream_mode and not str(initial_response_text or "").strip()
+    # 回测按历史截面预测，不写共享结果缓存，也不触发按最新期号的淘汰。
+    use_cache = (
+        not stream_mode
+        and not str(initial_response_text or "").strip()
+        and not _current_backtest_cutoff_period()
+    )
     cache_key = ""
     cache_region, cache_latest_period = _prediction_cache_meta(region, data)
+    flight = None
     if use_cache:
         cache_key = _build_ai_prediction_cache_key(
             region,
@@ -10884,6 +12613,64 @@ def _run_ai_prediction_pipeline(
         if cached_result is not None:
             return cached_result
 
+        # 同一缓存键只让一个请求去调上游，其余请求等它的结果。
+        flight, is_leader = _claim_ai_prediction_flight(cache_key)
+        if not is_leader:
+            budget_seconds = _resolve_ai_latency_budget_seconds(tuned, stream_mode=stream_mode)
+            # 与 _ai_first_sample_deadline 一致：领跑请求最多比预算多跑一次读超时。
+            leader_seconds = budget_seconds + _AI_HTTP_READ_TIMEOUT_SECONDS
+            shared_result = _wait_ai_prediction_flight(flight, leader_seconds + _AI_PREDICTION_FLIGHT_GRACE_SECONDS)
+            if shared_result is not None:
+                return shared_result
+            cached_result = _get_cached_ai_prediction(cache_key)
+            if cached_result is not None:
+                return cached_result
+            flight = None
+
+    result = None
+    try:
+        result = _run_uncached_ai_prediction_pipeline(
+            data,
+            region,
+            tuned,
+            ai_config,
+            shortlist_context,
+            prompt,
+            temperature=temperature,
+            sample_count=sample_count,
+            candidate_count=candidate_count,
+            initial_response_text=initial_response_text,
+            stream_mode=stream_mode,
+        )
+        if use_cache and cache_key:
+            result = _store_cached_ai_prediction(
+                cache_key,
+                result,
+                region=cache_region,
+                latest_period=cache_latest_period,
+            )
+    finally:
+        if flight is not None:
+            _finish_ai_prediction_flight(cache_key, flight, result)
+    return result
+
+
+@traced("ai.generate")
+def _run_uncached_ai_prediction_pipeline(
+    data,
+    region,
+    tuned,
+    ai_config,
+    shortlist_context,
+    prompt,
+    temperature=0.35,
+    sample_count=3,
+    candidate_count=3,
+    initial_response_text="",
+    stream_mode=False,
+):
+    started_at = time.perf_counter()
+    budget_seconds = _resolve_ai_latency_budget_seconds(tuned, stream_mode=stream_mode)
     responses = []
 
     initial_text = str(initial_response_text or "").strip()
@@ -10898,21 +12685,16 @@ def _run_ai_prediction_pipeline(
     elif responses and temperatures:
         temperatures = temperatures[1:]
 
-    for temp in temperatures:
-        if _ai_budget_exhausted(started_at, budget_seconds):
-            break
-        try:
-            responses.append(
-                _call_ai_completion_with_retries(
-                    ai_config,
-                    prompt,
-                    temperature=temp,
-                    max_attempts=2,
-                    region=region,
-                )
-            )
-        except Exception:
-            continue
+    deadline = started_at + budget_seconds
+    with span("ai.completions"):
+        responses.extend(_collect_ai_completions(
+            ai_config,
+            prompt,
+            temperatures,
+            region=region,
+            deadline=deadline,
+            guarantee_first=not responses,
+        ))
 
     budget_exhausted = _ai_budget_exhausted(started_at, budget_seconds)
     if not budget_exhausted:
@@ -10925,34 +12707,38 @@ def _run_ai_prediction_pipeline(
         elif remaining_seconds >= 4:
             extra_calls = 1
         if extra_calls > 0:
-            responses = _extend_ai_responses_for_coverage(
-                ai_config,
-                prompt,
-                responses,
-                region,
-                candidate_count,
-                base_temperature=temperature,
-                max_extra_calls=extra_calls,
-            )
+            with span("ai.extra_completions"):
+                responses = _extend_ai_responses_for_coverage(
+                    ai_config,
+                    prompt,
+                    responses,
+                    region,
+                    candidate_count,
+                    base_temperature=temperature,
+                    max_extra_calls=extra_calls,
+                    deadline=deadline,
+                )
         budget_exhausted = _ai_budget_exhausted(started_at, budget_seconds)
 
-    responses = _ensure_ai_candidate_coverage(
-        responses,
-        region,
-        shortlist_context,
-        desired_count=candidate_count,
-    )
-    result, error = _finalize_ai_multi_sample_result(responses, region, shortlist_context)
+    with span("ai.finalize"):
+        responses = _ensure_ai_candidate_coverage(
+            responses,
+            region,
+            shortlist_context,
+            desired_count=candidate_count,
+        )
+        result, error = _finalize_ai_multi_sample_result(responses, region, shortlist_context)
     elapsed_seconds = time.perf_counter() - started_at
     if error:
         return {"error": error}
 
-    result = _blend_ai_with_anchor_strategy(
-        result,
-        data,
-        region,
-        shortlist_context=shortlist_context,
-    )
+    with span("ai.anchor_blend"):
+        result = _blend_ai_with_anchor_strategy(
+            result,
+            data,
+            region,
+            shortlist_context=shortlist_context,
+        )
     result = _attach_ai_prediction_metadata(
         result,
         tuned,
@@ -10961,76 +12747,115 @@ def _run_ai_prediction_pipeline(
         budget_seconds=budget_seconds,
         budget_exhausted=budget_exhausted,
     )
-    if use_cache and cache_key:
-        result = _store_cached_ai_prediction(
-            cache_key,
-            result,
-            region=cache_region,
-            latest_period=cache_latest_period,
-        )
-    return result
+    # 跟 ai_elapsed_ms 一样随结果进缓存，命中缓存时看到的是当初生成那次的耗时。
+    return _attach_stage_timings(result, current_span())
+
+
+# 1-49 号码的静态属性按下标直接取；区段、尾数、波色、单双各自归成位掩码，
+# 组合在某一组里有几个号码就是掩码求交后的位数。
+_AI_ZONE_MASKS = tuple(
+    sum(1 << number for number in range(low, high + 1))
+    for low, high in ((1, 16), (17, 33), (34, 49))
+)
+_AI_TAIL_MASKS = tuple(
+    sum(1 << number for number in range(1, 50) if number % 10 == tail)
+    for tail in range(10)
+)
+_AI_COLOR_MASKS = (
+    sum(1 << number for number in RED_BALLS),
+    sum(1 << number for number in BLUE_BALLS),
+    sum(1 << number for number in GREEN_BALLS),
+)
+_AI_ODD_MASK = sum(1 << number for number in range(1, 50, 2))
+_AI_EVEN_MASK = sum(1 << number for number in range(2, 50, 2))
+_AI_NUMBER_COLORS = tuple(_get_color_zh(number) for number in range(50))
+
+
+def _ai_number_mask(numbers):
+    mask = 0
+    for number in numbers:
+        mask |= 1 << number
+    return mask
+
+
+def _ai_mask_group_counts(mask, group_masks):
+    return [count for count in ((mask & group).bit_count() for group in group_masks) if count]
+
+
+def _ai_number_color(number):
+    return _AI_NUMBER_COLORS[number] if 0 <= number < 50 else _get_color_zh(number)
+
+
+def _ai_candidate_similarity_key(candidate):
+    normal_mask = _ai_number_mask(
+        int(number) for number in (candidate.get("normal") or []) if str(number).isdigit()
+    )
+    return normal_mask, int(candidate.get("special") or 0)
+
+
+def _ai_candidate_pair_penalty(candidate_key, selected_key):
+    normal_mask, candidate_special = candidate_key
+    selected_mask, selected_special = selected_key
+    overlap = (normal_mask & selected_mask).bit_count()
+    penalty = 0.0
+    if overlap >= 5:
+        penalty += 0.18
+    elif overlap >= 4:
+        penalty += 0.1
+    elif overlap >= 3:
+        penalty += 0.05
+
+    if candidate_special and selected_special:
+        if candidate_special == selected_special:
+            penalty += 0.28
+        elif candidate_special % 10 == selected_special % 10:
+            penalty += 0.05
+        candidate_color = _ai_number_color(candidate_special)
+        if candidate_color and candidate_color == _ai_number_color(selected_special):
+            penalty += 0.03
+    return penalty
 
 
 def _candidate_similarity_penalty(candidate, selected_candidates):
     if not selected_candidates:
         return 0.0
 
-    normal = {int(number) for number in (candidate.get("normal") or []) if str(number).isdigit()}
-    if not normal:
+    candidate_key = _ai_candidate_similarity_key(candidate)
+    if not candidate_key[0]:
         return 0.0
 
-    candidate_special = int(candidate.get("special") or 0)
-    candidate_tail = candidate_special % 10 if candidate_special else None
-    candidate_color = _get_color_zh(candidate_special) if candidate_special else ""
     max_penalty = 0.0
-
     for selected in selected_candidates:
-        selected_normal = {int(number) for number in (selected.get("normal") or []) if str(number).isdigit()}
-        overlap = len(normal & selected_normal)
-        penalty = 0.0
-        if overlap >= 5:
-            penalty += 0.18
-        elif overlap >= 4:
-            penalty += 0.1
-        elif overlap >= 3:
-            penalty += 0.05
-
-        selected_special = int(selected.get("special") or 0)
-        if candidate_special and selected_special:
-            if candidate_special == selected_special:
-                penalty += 0.28
-            elif candidate_tail is not None and candidate_tail == (selected_special % 10):
-                penalty += 0.05
-            if candidate_color and candidate_color == _get_color_zh(selected_special):
-                penalty += 0.03
-
-        max_penalty = max(max_penalty, penalty)
-
+        max_penalty = max(max_penalty, _ai_candidate_pair_penalty(candidate_key, _ai_candidate_similarity_key(selected)))
     return round(max_penalty, 6)
 
 
 def _diversify_ai_ranked_candidates(ranked):
     pool = [dict(item) for item in (ranked or [])]
+    # 每个候选对已选集合的惩罚是与各已选候选两两惩罚的最大值，选中一个后只需和它比一次。
+    pool_keys = [_ai_candidate_similarity_key(item) for item in pool]
+    pool_penalties = [0.0] * len(pool)
     diversified = []
     while pool:
         best_index = 0
         best_score = None
         for idx, item in enumerate(pool):
-            penalty = _candidate_similarity_penalty(item, diversified)
+            penalty = round(pool_penalties[idx], 6)
             adjusted = round(float(item.get("aggregate_score", 0.0)) - penalty, 6)
             if best_score is None or adjusted > best_score:
                 best_score = adjusted
                 best_index = idx
         chosen = pool.pop(best_index)
-        chosen["diversity_penalty"] = round(
-            _candidate_similarity_penalty(chosen, diversified),
-            6,
-        )
+        chosen_key = pool_keys.pop(best_index)
+        chosen["diversity_penalty"] = round(pool_penalties.pop(best_index), 6)
         chosen["diversified_score"] = round(
             float(chosen.get("aggregate_score", 0.0)) - float(chosen.get("diversity_penalty", 0.0)),
             6,
         )
         diversified.append(chosen)
+        for idx, key in enumerate(pool_keys):
+            if key[0]:
+                pool_penalties[idx] = max(pool_penalties[idx], _ai_candidate_pair_penalty(key, chosen_key))
     return diversified
 
 
@@ -11065,145 +12890,99 @@ def _extract_ai_candidate_entries(ai_response, region=None):
     return [normalized] if normalized else []
 
 
-def _score_ai_combination_shape(normal, special, context):
-    numbers = [int(number) for number in (normal or []) if str(number).isdigit()]
-    if special is not None:
-        try:
-            numbers.append(int(special))
-        except (TypeError, ValueError):
-            pass
-    if len(numbers) < 7:
-        return -0.2, {"shape_score": -0.2}
-
-    zone_counts = Counter(1 if number <= 16 else 2 if number <= 33 else 3 for number in numbers)
-    zone_penalty = 0.0
-    for count in zone_counts.values():
-        if count >= 5:
-            zone_penalty -= 0.18
-        elif count == 4:
-            zone_penalty -= 0.08
-    covered_zones = len(zone_counts)
-    zone_bonus = 0.06 if covered_zones == 3 else -0.05
+def _build_ai_candidate_score_tables(context):
+    """把候选打分用到的按号码查询的量展开成 50 长度数组和位掩码，整批候选共用一份。"""
+    context = context or {}
+    special_score_map = context.get("special_score_map") or {}
+    normal_score_map = context.get("normal_score_map") or {}
+    special_votes = context.get("special_votes") or Counter()
+    normal_votes = context.get("normal_votes") or Counter()
+    normal_shortlist = set(context.get("normal_shortlist") or [])
+    recent_draw_sets = list(context.get("recent_draw_sets") or [])
+    recent_draw_number_counter = Counter(context.get("recent_draw_number_counter") or {})
 
-    tails = [number % 10 for number in numbers]
-    tail_counts = Counter(tails)
-    tail_penalty = 0.0
-    for count in tail_counts.values():
-        if count >= 3:
-            tail_penalty -= 0.12
+    latest_draw_mask = 0
+    recent_three_mask = 0
+    normal_repeat_steps = None
+    if recent_draw_sets:
+        latest_draw_mask = _ai_number_mask(int(number) for number in (recent_draw_sets[0] or []) if 0 <= int(number) < 50)
+        for draw_set in recent_draw_sets[:3]:
+            recent_three_mask |= _ai_number_mask(int(number) for number in (draw_set or []) if 0 <= int(number) < 50)
+        normal_repeat_steps = []
+        for number in range(50):
+            appearances = int(recent_draw_number_counter.get(number, 0) or 0)
+            appearance_step = 0.035 if appearances >= 2 else 0.012 if appearances == 1 else 0.0
+            recent_step = 0.01 if recent_three_mask >> number & 1 else 0.0
+            normal_repeat_steps.append((appearance_step, recent_step))
 
-    colors = [_get_color_zh(number) for number in numbers if _get_color_zh(number)]
-    color_counts = Counter(colors)
-    color_penalty = 0.0
-    if color_counts and max(color_counts.values()) >= 5:
-        color_penalty -= 0.12
-    elif len(color_counts) == 3:
-        color_penalty += 0.05
-
-    parities = [_get_parity_zh(number) for number in numbers if _get_parity_zh(number)]
-    parity_counts = Counter(parities)
-    parity_penalty = -0.06 if parity_counts and max(parity_counts.values()) >= 6 else 0.03 if len(parity_counts) == 2 else 0.0
-
-    special_shortlist = set(context.get("special_shortlist") or [])
-    normal_shortlist = set(context.get("normal_shortlist") or [])
-    shortlist_coverage = sum(1 for number in normal if int(number) in normal_shortlist)
-    if special in special_shortlist:
-        shortlist_coverage += 1
-    shortlist_bonus = max(0.0, (shortlist_coverage - 4) * 0.03)
-
-    total = round(zone_penalty + zone_bonus + tail_penalty + color_penalty + parity_penalty + shortlist_bonus, 6)
-    return total, {
-        "zone_penalty": round(zone_penalty, 4),
-        "zone_bonus": round(zone_bonus, 4),
-        "tail_penalty": round(tail_penalty, 4),
-        "color_penalty": round(color_penalty, 4),
-        "parity_penalty": round(parity_penalty, 4),
-        "shortlist_coverage_bonus": round(shortlist_bonus, 4),
-        "shape_score": total,
-    }
-
-
-def _score_ai_structure_alignment(normal, special, context):
-    profile = dict(context.get("structure_profile") or {})
-    structure_scores = dict(profile.get("structure_scores") or {})
-    confidence = _clamp(_safe_float(profile.get("confidence"), 0.0), 0.0, 1.0)
-    if confidence <= 0.0:
-        return 0.0, {"structure_bonus": 0.0, "structure_confidence": 0.0}
-
-    numbers = [int(number) for number in (normal or []) if str(number).isdigit()]
-    if not numbers:
-        return 0.0, {"structure_bonus": 0.0, "structure_confidence": round(confidence, 4)}
-
-    zone_spread = len(set(1 if n <= 16 else 2 if n <= 33 else 3 for n in numbers))
-    tail_spread = len(set(n % 10 for n in numbers))
-    all_numbers = numbers + ([int(special)] if special is not None else [])
-    color_spread = len(set(_get_color_zh(n) for n in all_numbers if _get_color_zh(n)))
-    odd_count = sum(1 for n in all_numbers if n % 2 == 1)
-    even_count = len(all_numbers) - odd_count
-    parity_key = "parity:balanced" if abs(odd_count - even_count) <= 1 else "parity:skewed"
-    special_zone = "small" if int(special) <= 16 else "mid" if int(special) <= 33 else "large"
-    special_color = _get_color_zh(int(special)) or "unknown"
-
-    total = 0.0
-    total += _safe_float(structure_scores.get(f"zone_spread:{zone_spread}"), 0.0) * 0.18
-    total += _safe_float(structure_scores.get(f"color_spread:{color_spread}"), 0.0) * 0.14
-    total += _safe_float(structure_scores.get(parity_key), 0.0) * 0.12
-    total += _safe_float(structure_scores.get(f"special_zone:{special_zone}"), 0.0) * 0.18
-    total += _safe_float(structure_scores.get(f"special_color:{special_color}"), 0.0) * 0.12
-    if tail_spread >= 5:
-        total += _safe_float(structure_scores.get("tail_spread:wide"), 0.0) * 0.16
-    elif tail_spread >= 4:
-        total += _safe_float(structure_scores.get("tail_spread:balanced"), 0.0) * 0.16
-    else:
-        total += _safe_float(structure_scores.get("tail_spread:tight"), 0.0) * 0.16
+    phase_profile = dict(context.get("phase_profile") or {})
+    phase_adjustments = dict(phase_profile.get("adjustments") or {})
+    phase_confidence = _clamp(_safe_float(phase_profile.get("confidence"), 0.0), 0.0, 1.0)
+    gate_profile = dict(context.get("gate_profile") or {})
+    gate_adjustment = 0.0
+    if gate_profile.get("status") == "guarded":
+        gate_adjustment -= 0.08
+    elif gate_profile.get("status") == "fallback":
+        gate_adjustment -= 0.2
+    structure_profile = dict(context.get("structure_profile") or {})
 
-    structure_bonus = round((total - 0.45) * max(0.35, confidence), 6)
-    return structure_bonus, {
-        "structure_bonus": structure_bonus,
-        "structure_confidence": round(confidence, 4),
-        "zone_spread": zone_spread,
-        "tail_spread": tail_spread,
-        "color_spread": color_spread,
-        "parity_key": parity_key,
-        "special_zone": special_zone,
-        "special_color": special_color,
+    return {
+        "special_score": [special_score_map.get(number, 0.0) for number in range(50)],
+        "normal_score": [normal_score_map.get(number, 0.0) for number in range(50)],
+        "special_vote": [_safe_float(special_votes.get(number, 0.0)) for number in range(50)],
+        "normal_vote": [_safe_float(normal_votes.get(number, 0.0)) for number in range(50)],
+        "normal_shortlist_bonus": [0.028 if number in normal_shortlist else -0.04 for number in range(50)],
+        "special_shortlist_mask": _ai_number_mask(
+            int(number) for number in (context.get("special_shortlist") or []) if 0 <= int(number) < 50
+        ),
+        "normal_shortlist_mask": _ai_number_mask(
+            int(number) for number in normal_shortlist if 0 <= int(number) < 50
+        ),
+        "latest_draw_mask": latest_draw_mask,
+        "normal_repeat_steps": normal_repeat_steps,
+        "rerank_weights": _normalize_ai_rerank_weights(context.get("rerank_weights")),
+        "target_mode": str(context.get("target_mode") or "top1_safe"),
+        "phase_label": str(phase_profile.get("label") or "neutral"),
+        "phase_confidence": phase_confidence,
+        "phase_terms": {
+            key: _safe_float(phase_adjustments.get(key), 0.0) * phase_confidence
+            for key in (
+                "base_special",
+                "avg_normal",
+                "special_vote",
+                "diversity_bonus",
+                "repeat_penalty",
+                "overheat_penalty",
+                "shape_score",
+                "structure_bonus",
+            )
+        },
+        "gate_adjustment": gate_adjustment,
+        "structure_scores": dict(structure_profile.get("structure_scores") or {}),
+        "structure_confidence": _clamp(_safe_float(structure_profile.get("confidence"), 0.0), 0.0, 1.0),
+        "failure_scores": dict(structure_profile.get("failure_scores") or {}),
+        "special_terms": {},
     }
 
 
-def _score_ai_candidate(candidate, context):
-    special = int(candidate.get("special"))
-    normal = [int(number) for number in candidate.get("normal") or []]
-    if len(normal) < 6:
-        return -999.0, {}
+def _score_ai_special_terms(special, context, tables):
+    """只取决于特码的加减分项，同一批候选里每个特码只算一次。"""
+    cached = tables["special_terms"].get(special)
+    if cached is not None:
+        return cached
 
-    special_score_map = context.get("special_score_map") or {}
-    normal_score_map = context.get("normal_score_map") or {}
-    special_votes = context.get("special_votes") or Counter()
-    normal_votes = context.get("normal_votes") or Counter()
     number_to_zodiac = context.get("number_to_zodiac") or {}
-    special_shortlist = set(context.get("special_shortlist") or [])
-    normal_shortlist = set(context.get("normal_shortlist") or [])
     recent_specials = list(context.get("recent_specials") or [])
     recent_special_counter = Counter(context.get("recent_special_counter") or {})
     recent_tail_counter = Counter(context.get("recent_tail_counter") or {})
     recent_color_counter = Counter(context.get("recent_color_counter") or {})
     recent_zodiacs = list(context.get("recent_zodiacs") or [])
     recent_zodiac_counter = Counter(context.get("recent_zodiac_counter") or {})
-    recent_draw_numbers = list(context.get("recent_draw_numbers") or [])
     recent_draw_number_counter = Counter(context.get("recent_draw_number_counter") or {})
     recent_draw_sets = list(context.get("recent_draw_sets") or [])
     repeat_transition_profile = dict(context.get("repeat_transition_profile") or {})
-    target_mode = str(context.get("target_mode") or "top1_safe")
-
-    base_special = special_score_map.get(special, 0.0)
-    avg_normal = sum(normal_score_map.get(number, 0.0) for number in normal) / max(len(normal), 1)
-    special_vote = _safe_float(special_votes.get(special, 0.0))
-    normal_vote_avg = sum(_safe_float(normal_votes.get(number, 0.0)) for number in normal) / max(len(normal), 1)
-    shortlist_bonus = (0.16 if special in special_shortlist else -0.18)
-    shortlist_bonus += sum(0.028 if number in normal_shortlist else -0.04 for number in normal)
-    rerank_weights = _normalize_ai_rerank_weights(context.get("rerank_weights"))
 
-    special_color = _get_color_zh(special)
+    special_color = _ai_number_color(special)
     special_parity = _get_parity_zh(special)
     special_zodiac = number_to_zodiac.get(str(special), "")
     attr_bonus = 0.0
@@ -11214,11 +12993,6 @@ def _score_ai_candidate(candidate, context):
     if context.get("preferred_zodiac") and special_zodiac == context.get("preferred_zodiac"):
         attr_bonus += 0.08
 
-    zones = set(1 if number <= 16 else 2 if number <= 33 else 3 for number in normal)
-    diversity_bonus = len(zones) * 0.04
-    parity_mix = len(set(_get_parity_zh(number) for number in normal if _get_parity_zh(number)))
-    diversity_bonus += 0.04 if parity_mix >= 2 else -0.03
-
     repeat_penalty = 0.0
     latest_special_repeat_probability = float(repeat_transition_profile.get("latest_special_repeat_probability") or 0.0)
     latest_zodiac_repeat_probability = float(repeat_transition_profile.get("latest_zodiac_repeat_probability") or 0.0)
@@ -11273,44 +13047,171 @@ def _score_ai_candidate(candidate, context):
     elif draw_heat == 1:
         overheat_penalty -= 0.07
 
+    terms = (attr_bonus, repeat_penalty, overheat_penalty)
+    tables["special_terms"][special] = terms
+    return terms
+
+
+def _score_ai_combination_shape(normal, special, context, tables=None):
+    numbers = [int(number) for number in (normal or []) if str(number).isdigit()]
+    if special is not None:
+        try:
+            numbers.append(int(special))
+        except (TypeError, ValueError):
+            pass
+    if len(numbers) < 7:
+        return -0.2, {"shape_score": -0.2}
+    if tables is None:
+        tables = _build_ai_candidate_score_tables(context)
+
+    numbers_mask = _ai_number_mask(numbers)
+    zone_counts = _ai_mask_group_counts(numbers_mask, _AI_ZONE_MASKS)
+    zone_penalty = 0.0
+    for count in zone_counts:
+        if count >= 5:
+            zone_penalty -= 0.18
+        elif count == 4:
+            zone_penalty -= 0.08
+    covered_zones = len(zone_counts)
+    zone_bonus = 0.06 if covered_zones == 3 else -0.05
+
+    tail_penalty = 0.0
+    for count in _ai_mask_group_counts(numbers_mask, _AI_TAIL_MASKS):
+        if count >= 3:
+            tail_penalty -= 0.12
+
+    color_counts = _ai_mask_group_counts(numbers_mask, _AI_COLOR_MASKS)
+    color_penalty = 0.0
+    if color_counts and max(color_counts) >= 5:
+        color_penalty -= 0.12
+    elif len(color_counts) == 3:
+        color_penalty += 0.05
+
+    parity_counts = _ai_mask_group_counts(numbers_mask, (_AI_ODD_MASK, _AI_EVEN_MASK))
+    parity_penalty = -0.06 if parity_counts and max(parity_counts) >= 6 else 0.03 if len(parity_counts) == 2 else 0.0
+
+    shortlist_coverage = (_ai_number_mask(int(number) for number in normal) & tables["normal_shortlist_mask"]).bit_count()
+    if special is not None and 0 <= int(special) < 50 and tables["special_shortlist_mask"] >> int(special) & 1:
+        shortlist_coverage += 1
+    shortlist_bonus = max(0.0, (shortlist_coverage - 4) * 0.03)
+
+    total = round(zone_penalty + zone_bonus + tail_penalty + color_penalty + parity_penalty + shortlist_bonus, 6)
+    return total, {
+        "zone_penalty": round(zone_penalty, 4),
+        "zone_bonus": round(zone_bonus, 4),
+        "tail_penalty": round(tail_penalty, 4),
+        "color_penalty": round(color_penalty, 4),
+        "parity_penalty": round(parity_penalty, 4),
+        "shortlist_coverage_bonus": round(shortlist_bonus, 4),
+        "shape_score": total,
+    }
+
+
+def _score_ai_structure_alignment(normal, special, context, tables=None):
+    if tables is None:
+        tables = _build_ai_candidate_score_tables(context)
+    structure_scores = tables["structure_scores"]
+    confidence = tables["structure_confidence"]
+    if confidence <= 0.0:
+        return 0.0, {"structure_bonus": 0.0, "structure_confidence": 0.0}
+
+    numbers = [int(number) for number in (normal or []) if str(number).isdigit()]
+    if not numbers:
+        return 0.0, {"structure_bonus": 0.0, "structure_confidence": round(confidence, 4)}
+
+    normal_mask = _ai_number_mask(numbers)
+    zone_spread = len(_ai_mask_group_counts(normal_mask, _AI_ZONE_MASKS))
+    tail_spread = len(_ai_mask_group_counts(normal_mask, _AI_TAIL_MASKS))
+    all_numbers = numbers + ([int(special)] if special is not None else [])
+    color_spread = len(_ai_mask_group_counts(_ai_number_mask(all_numbers), _AI_COLOR_MASKS))
+    odd_count = sum(1 for n in all_numbers if n % 2 == 1)
+    even_count = len(all_numbers) - odd_count
+    parity_key = "parity:balanced" if abs(odd_count - even_count) <= 1 else "parity:skewed"
+    special_zone = "small" if int(special) <= 16 else "mid" if int(special) <= 33 else "large"
+    special_color = _ai_number_color(int(special)) or "unknown"
+
+    total = 0.0
+    total += _safe_float(structure_scores.get(f"zone_spread:{zone_spread}"), 0.0) * 0.18
+    total += _safe_float(structure_scores.get(f"color_spread:{color_spread}"), 0.0) * 0.14
+    total += _safe_float(structure_scores.get(parity_key), 0.0) * 0.12
+    total += _safe_float(structure_scores.get(f"special_zone:{special_zone}"), 0.0) * 0.18
+    total += _safe_float(structure_scores.get(f"special_color:{special_color}"), 0.0) * 0.12
+    if tail_spread >= 5:
+        total += _safe_float(structure_scores.get("tail_spread:wide"), 0.0) * 0.16
+    elif tail_spread >= 4:
+        total += _safe_float(structure_scores.get("tail_spread:balanced"), 0.0) * 0.16
+    else:
+        total += _safe_float(structure_scores.get("tail_spread:tight"), 0.0) * 0.16
+
+    structure_bonus = round((total - 0.45) * max(0.35, confidence), 6)
+    return structure_bonus, {
+        "structure_bonus": structure_bonus,
+        "structure_confidence": round(confidence, 4),
+        "zone_spread": zone_spread,
+        "tail_spread": tail_spread,
+        "color_spread": color_spread,
+        "parity_key": parity_key,
+        "special_zone": special_zone,
+        "special_color": special_color,
+    }
+
+
+def _score_ai_candidate(candidate, context, tables=None):
+    special = int(candidate.get("special"))
+    normal = [int(number) for number in candidate.get("normal") or []]
+    if len(normal) < 6:
+        return -999.0, {}
+    if tables is None:
+        tables = _build_ai_candidate_score_tables(context)
+
+    normal_count = max(len(normal), 1)
+    normal_mask = _ai_number_mask(normal)
+    special_in_shortlist = bool(tables["special_shortlist_mask"] >> special & 1)
+    target_mode = tables["target_mode"]
+    rerank_weights = dict(tables["rerank_weights"])
+    phase_terms = tables["phase_terms"]
+
+    normal_score = tables["normal_score"]
+    normal_vote = tables["normal_vote"]
+    normal_shortlist_bonus = tables["normal_shortlist_bonus"]
+    base_special = tables["special_score"][special]
+    avg_normal = sum(normal_score[number] for number in normal) / normal_count
+    special_vote = tables["special_vote"][special]
+    normal_vote_avg = sum(normal_vote[number] for number in normal) / normal_count
+    shortlist_bonus = (0.16 if special_in_shortlist else -0.18)
+    shortlist_bonus += sum(normal_shortlist_bonus[number] for number in normal)
+
+    attr_bonus, repeat_penalty, overheat_penalty = _score_ai_special_terms(special, context, tables)
+
+    diversity_bonus = len(_ai_mask_group_counts(normal_mask, _AI_ZONE_MASKS)) * 0.04
+    parity_mix = len(_ai_mask_group_counts(normal_mask, (_AI_ODD_MASK, _AI_EVEN_MASK)))
+    diversity_bonus += 0.04 if parity_mix >= 2 else -0.03
+
     normal_repeat_penalty = 0.0
-    if recent_draw_sets:
-        latest_draw_set = {int(number) for number in (recent_draw_sets[0] or [])}
-        latest_repeat_count = sum(1 for number in normal if number in latest_draw_set)
+    normal_repeat_steps = tables["normal_repeat_steps"]
+    if normal_repeat_steps is not None:
+        latest_repeat_count = (normal_mask & tables["latest_draw_mask"]).bit_count()
         normal_repeat_penalty -= latest_repeat_count * 0.06
-        recent_three_sets = [
-            {int(number) for number in (draw_set or [])}
-            for draw_set in recent_draw_sets[:3]
-        ]
         for number in normal:
-            appearances = int(recent_draw_number_counter.get(number, 0) or 0)
-            if appearances >= 2:
-                normal_repeat_penalty -= 0.035
-            elif appearances == 1:
-                normal_repeat_penalty -= 0.012
-            if any(number in draw_set for draw_set in recent_three_sets):
-                normal_repeat_penalty -= 0.01
+            appearance_step, recent_step = normal_repeat_steps[number]
+            if appearance_step:
+                normal_repeat_penalty -= appearance_step
+            if recent_step:
+                normal_repeat_penalty -= recent_step
 
     confidence_bonus = _clamp(candidate.get("confidence", 0.0), 0.0, 1.0) * 0.08
-    shape_score, shape_diagnostics = _score_ai_combination_shape(normal, special, context)
-    structure_bonus, structure_diagnostics = _score_ai_structure_alignment(normal, special, context)
-    phase_profile = dict(context.get("phase_profile") or {})
-    phase_adjustments = dict(phase_profile.get("adjustments") or {})
-    gate_profile = dict(context.get("gate_profile") or {})
-    gate_adjustment = 0.0
-    if gate_profile.get("status") == "guarded":
-        gate_adjustment -= 0.08
-    elif gate_profile.get("status") == "fallback":
-        gate_adjustment -= 0.2
-    phase_confidence = _clamp(_safe_float(phase_profile.get("confidence"), 0.0), 0.0, 1.0)
-    base_special += _safe_float(phase_adjustments.get("base_special"), 0.0) * phase_confidence
-    avg_normal += _safe_float(phase_adjustments.get("avg_normal"), 0.0) * phase_confidence
-    special_vote += _safe_float(phase_adjustments.get("special_vote"), 0.0) * phase_confidence
-    diversity_bonus += _safe_float(phase_adjustments.get("diversity_bonus"), 0.0) * phase_confidence
-    repeat_penalty -= _safe_float(phase_adjustments.get("repeat_penalty"), 0.0) * phase_confidence
-    overheat_penalty -= _safe_float(phase_adjustments.get("overheat_penalty"), 0.0) * phase_confidence
-    shape_score += _safe_float(phase_adjustments.get("shape_score"), 0.0) * phase_confidence
-    structure_bonus += _safe_float(phase_adjustments.get("structure_bonus"), 0.0) * phase_confidence
+    shape_score, shape_diagnostics = _score_ai_combination_shape(normal, special, context, tables=tables)
+    structure_bonus, structure_diagnostics = _score_ai_structure_alignment(normal, special, context, tables=tables)
+    gate_adjustment = tables["gate_adjustment"]
+    phase_confidence = tables["phase_confidence"]
+    base_special += phase_terms["base_special"]
+    avg_normal += phase_terms["avg_normal"]
+    special_vote += phase_terms["special_vote"]
+    diversity_bonus += phase_terms["diversity_bonus"]
+    repeat_penalty -= phase_terms["repeat_penalty"]
+    overheat_penalty -= phase_terms["overheat_penalty"]
+    shape_score += phase_terms["shape_score"]
+    structure_bonus += phase_terms["structure_bonus"]
     total = (
         base_special * rerank_weights.get("base_special", 0.9) +
         avg_normal * rerank_weights.get("avg_normal", 0.55) +
@@ -11327,18 +13228,19 @@ def _score_ai_candidate(candidate, context):
         structure_bonus * rerank_weights.get("structure_bonus", 1.0) +
         gate_adjustment * rerank_weights.get("gate_adjustment", 1.0)
     )
-    structure_profile = dict(context.get("structure_profile") or {})
-    failure_scores = dict(structure_profile.get("failure_scores") or {})
+    failure_scores = tables["failure_scores"]
+    zone_spread = len(_ai_mask_group_counts(normal_mask, _AI_ZONE_MASKS))
+    tail_spread = len(_ai_mask_group_counts(normal_mask, _AI_TAIL_MASKS))
     if target_mode == "top6_cover":
         cover_bonus = 0.0
-        if len(set(1 if number <= 16 else 2 if number <= 33 else 3 for number in normal)) == 3:
+        if zone_spread == 3:
             cover_bonus += 0.05
-        if len(set(number % 10 for number in normal)) >= 5:
+        if tail_spread >= 5:
             cover_bonus += 0.04
         total += cover_bonus
     else:
         special_focus_bonus = 0.0
-        if special in special_shortlist:
+        if special_in_shortlist:
             special_focus_bonus += 0.05
         if special_vote > 0:
             special_focus_bonus += min(0.05, special_vote * 0.04)
@@ -11349,12 +13251,10 @@ def _score_ai_candidate(candidate, context):
         total += special_focus_bonus
 
     failure_penalty = 0.0
-    zone_spread = len(set(1 if number <= 16 else 2 if number <= 33 else 3 for number in normal))
-    tail_spread = len(set(number % 10 for number in normal))
-    all_numbers = normal + [special]
-    color_spread = len(set(_get_color_zh(number) for number in all_numbers if _get_color_zh(number)))
-    odd_count = sum(1 for number in all_numbers if number % 2 == 1)
-    even_count = len(all_numbers) - odd_count
+    all_mask = normal_mask | (1 << special)
+    color_spread = len(_ai_mask_group_counts(all_mask, _AI_COLOR_MASKS))
+    odd_count = (all_mask & _AI_ODD_MASK).bit_count()
+    even_count = len(normal) + 1 - odd_count
     parity_key = "parity:balanced" if abs(odd_count - even_count) <= 1 else "parity:skewed"
     special_zone = "small" if special <= 16 else "mid" if special <= 33 else "large"
     failure_penalty -= _safe_float(failure_scores.get(f"zone_spread:{zone_spread}"), 0.0) * 0.045
@@ -11385,7 +13285,7 @@ def _score_ai_candidate(candidate, context):
         "shape_score": round(shape_score, 4),
         "structure_bonus": round(structure_bonus, 4),
         "failure_penalty": round(failure_penalty, 4),
-        "phase_label": str(phase_profile.get("label") or "neutral"),
+        "phase_label": tables["phase_label"],
         "phase_confidence": round(phase_confidence, 4),
         "gate_adjustment": round(gate_adjustment, 4),
         "total": round(total, 6),
@@ -11424,7 +13324,8 @@ def _build_ai_selection_recommendation(best_candidate, context, ranked_candidate
 
 
 def _finalize_ai_multi_sample_result(ai_responses, region, context):
-    rerank_weights = _normalize_ai_rerank_weights(context.get("rerank_weights"))
+    score_tables = _build_ai_candidate_score_tables(context)
+    rerank_weights = dict(score_tables["rerank_weights"])
     appearance_vote_weight = rerank_weights.get("appearance_vote", 0.24)
     signature_votes = Counter()
     best_by_signature = {}
@@ -11438,7 +13339,7 @@ def _finalize_ai_multi_sample_result(ai_responses, region, context):
             signature = f"{candidate['special']}|{','.join(map(str, candidate['normal']))}"
             appearance_weight = max(0.35, 1.0 - rank_index * 0.18) * max(0.6, 1.0 - sample_index * 0.08)
             signature_votes[signature] += appearance_weight
-            score, diagnostics = _score_ai_candidate(candidate, context)
+            score, diagnostics = _score_ai_candidate(candidate, context, tables=score_tables)
             enriched = {
                 **candidate,
                 "signature": signature,
@@ -11658,16 +13559,17 @@ def _finalize_ai_prediction_result(
     stream_mode=True,
 ):
     tuned = dict(tuned or _load_strategy_config("ai", region))
-    shortlist_context = shortlist_context or _build_ai_shortlist_context(data, region, config=tuned)
     ai_config = ai_config or get_ai_config()
-    if not prompt:
-        prompt = _build_ai_prompt_v4(
+    if not shortlist_context or not prompt:
+        cached_context, cached_prompt = _get_ai_prompt_context(
             data,
             region,
-            shortlist_context,
-            history_window=int(tuned.get("history_window") or 12),
-            candidate_count=candidate_count,
+            tuned,
+            int(tuned.get("history_window") or 12),
+            candidate_count,
         )
+        shortlist_context = shortlist_context or cached_context
+        prompt = prompt or cached_prompt
     return _run_ai_prediction_pipeline(
         data,
         region,
@@ -11685,7 +13587,7 @@ def _finalize_ai_prediction_result(
 
 def predict_with_ai(data, region, config_override=None):
     ai_config = get_ai_config()
-    if not ai_config['api_key'] or "你的" in ai_config['api_key']:
+    if not _ai_completion_available(ai_config):
         return {"error": "AI API Key 未配置"}
     tuned = _load_strategy_config("ai", region)
     if config_override:
@@ -11695,14 +13597,7 @@ def predict_with_ai(data, region, config_override=None):
     sample_count = _clamp(int(tuned.get("sample_count") or 3), 1, 5)
     candidate_count = _clamp(int(tuned.get("candidate_count") or 3), 2, 5)
     try:
-        shortlist_context = _build_ai_shortlist_context(data, region, config=tuned)
-        prompt = _build_ai_prompt_v4(
-            data,
-            region,
-            shortlist_context,
-            history_window=history_window,
-            candidate_count=candidate_count,
-        )
+        shortlist_context, prompt = _get_ai_prompt_context(data, region, tuned, history_window, candidate_count)
         return _run_ai_prediction_pipeline(
             data,
             region,
@@ -11718,43 +13613,138 @@ def predict_with_ai(data, region, config_override=None):
     except Exception as e:
         return {"error": f"调用AI API时出错: {e}"}
 
-def _iter_ai_stream(ai_config, prompt, temperature=0.8):
+def _iter_ai_stream(ai_config, prompt, temperature=0.8, system_prompt=None, deadline=None):
+    """逐段产出 AI 流式回复；deadline 为空时按 _AI_REQUEST_DEADLINE_SECONDS 限制总时长。"""
+    if deadline is None:
+        deadline = time.perf_counter() + _AI_REQUEST_DEADLINE_SECONDS
     payload = {
         "model": ai_config["model"],
         "messages": [
-            {"role": "system", "content": _build_ai_system_prompt()},
+            {"role": "system", "content": system_prompt or _build_ai_system_prompt()},
             {"role": "user", "content": prompt}
         ],
         "temperature": temperature,
         "stream": True
     }
+    cassette_mode = _ai_cassette_mode()
+    if cassette_mode == "replay":
+        # 录制的是完整回复，回放时切成小段模拟增量输出。
+        content = _replay_ai_cassette(_ai_cassette_key(payload))
+        for offset in range(0, len(content), _AI_CASSETTE_STREAM_CHUNK_CHARS):
+            yield content[offset:offset + _AI_CASSETTE_STREAM_CHUNK_CHARS]
+        return
     headers = {"Authorization": f"Bearer {ai_config['api_key']}", "Content-Type": "application/json"}
-    response = requests.post(ai_config["api_url"], json=payload, headers=headers, stream=True, timeout=_ai_http_timeout())
-    response.raise_for_status()
-    if not response.encoding or response.encoding.lower() in ("iso-8859-1", "latin-1"):
-        response.encoding = "utf-8"
-    for line in response.iter_lines(decode_unicode=True):
-        if not line:
-            continue
-        if line.startswith("data:"):
-            line = line[5:].strip()
-        if line == "[DONE]":
-            break
-        try:
-            data = json.loads(line)
-        except json.JSONDecodeError:
-            continue
-        choices = data.get("choices") or []
-        if not choices:
-            continue
-        delta = choices[0].get("delta") or {}
-        content = delta.get("content")
-        if content is None:
-            content = choices[0].get("message", {}).get("content")
-        if content is None:
-            content = choices[0].get("text")
-        if content:
-            yield content
+    response = _post_ai_request(ai_config["api_url"], payload, headers, stream=True, deadline=deadline)
+    recorded = [] if cassette_mode == "record" else None
+    try:
+        response.raise_for_status()
+        if not response.encoding or response.encoding.lower() in ("iso-8859-1", "latin-1"):
+            response.encoding = "utf-8"
+        # 分块传输时按到达的块读取；非分块（以关闭连接结束）的响应按字节读，避免攒满 512 字节才吐出首个增量。
+        chunk_size = 512 if getattr(response.raw, "chunked", False) else 1
+        for line in response.iter_lines(chunk_size=chunk_size, decode_unicode=True):
+            if _ai_request_cancelled(deadline):
+                raise TimeoutError("AI 流式输出超时")
+            if not line:
+                continue
+            if line.startswith("data:"):
+                line = line[5:].strip()
+            if line == "[DONE]":
+                break
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            choices = data.get("choices") or []
+            if not choices:
+                continue
+            delta = choices[0].get("delta") or {}
+            content = delta.get("content")
+            if content is None:
+                content = choices[0].get("message", {}).get("content")
+            if content is None:
+                content = choices[0].get("text")
+            if content:
+                if recorded is not None:
+                    recorded.append(content)
+                yield content
+        # 只录制完整读完的回复，中途断开或出错的不落盘。
+        if recorded is not None:
+            _record_ai_cassette(_ai_cassette_key(payload), payload, "".join(recorded))
+    finally:
+        # 客户端中途断开时生成器被关闭，也要把连接还回连接池。
+        response.close()
+
+
+class _AIStreamBroadcast:
+    """一次上游流式调用的分发器：后台线程拉取增量，各个 SSE 请求按自己的进度读取。"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def publish(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+    def iter_chunks(self, idle_timeout=None):
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.chunks) and not self.done:
+                    if not self.condition.wait(idle_timeout):
+                        raise TimeoutError("等待 AI 流式输出超时")
+                pending = self.chunks[index:]
+                index = len(self.chunks)
+                done = self.done
+                error = self.error
+            for chunk in pending:
+                yield chunk
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+
+def _pump_ai_stream(stream_key, broadcast, ai_config, prompt, temperature):
+    error = None
+    try:
+        with app.app_context():
+            for chunk in _iter_ai_stream(ai_config, prompt, temperature=temperature):
+                broadcast.publish(chunk)
+    except Exception as exc:
+        error = exc
+    finally:
+        with _ai_stream_broadcasts_lock:
+            if _ai_stream_broadcasts.get(stream_key) is broadcast:
+                _ai_stream_broadcasts.pop(stream_key, None)
+        broadcast.finish(error)
+
+
+def _attach_ai_stream(stream_key, ai_config, prompt, temperature=0.8):
+    """同一提示词的流式请求共用一次上游调用，后来的请求从头回放已收到的增量再继续跟随。"""
+    with _ai_stream_broadcasts_lock:
+        broadcast = _ai_stream_broadcasts.get(stream_key)
+        if broadcast is not None:
+            return broadcast, False
+        broadcast = _AIStreamBroadcast()
+        _ai_stream_broadcasts[stream_key] = broadcast
+    # 上游读取放在独立线程里，发起请求的客户端断开也不会中断其它跟随者。
+    threading.Thread(
+        target=_pump_ai_stream,
+        args=(stream_key, broadcast, ai_config, prompt, temperature),
+        daemon=True,
+    ).start()
+    return broadcast, True
 
 # --- Flask 路由 ---
 @app.route('/')
@@ -11843,20 +13833,217 @@ def _load_draw_page_from_db(region, year, page, page_size):
     return [record.to_dict() for record in records]
 
 
+_DRAW_KEYSET_COLUMNS = (LotteryDraw.draw_date, LotteryDraw.draw_id)
+
+
+def _load_draw_rows_from_db(region, year, page, page_size, cursor_values=None):
+    """按 (draw_date, draw_id) 倒序取一页；带游标时从上一页末条之后走索引续读，否则退回 OFFSET。"""
+    query = LotteryDraw.query.filter_by(region=region)
+    query = _apply_draw_year_filter(query, year)
+    query = query.order_by(*[column.desc() for column in _DRAW_KEYSET_COLUMNS])
+    if cursor_values is not None:
+        query = query.filter(keyset_before(_DRAW_KEYSET_COLUMNS, cursor_values))
+    else:
+        query = query.offset((page - 1) * page_size)
+    return query.limit(page_size).all()
+
+
+def _draws_page_response(data, page_size):
+    response = jsonify(data)
+    if len(data) >= page_size:
+        last = data[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last.get("date"), last.get("id"))
+    return response
+
+
+def _hk_draw_display_source(record):
+    # 展示字段只由开奖日期和号码决定；来源变了（被别处改写）就不再信任已存的结果。
+    return "|".join([
+        str(record.get("date") or ""),
+        ",".join(str(num) for num in (record.get("no") or [])),
+        str(record.get("sno") or ""),
+    ])
+
+
+def _hk_zodiac_mapping(zodiac_year, zodiac_map_cache):
+    from models import ZodiacSetting
+
+    mapping = zodiac_map_cache.get(zodiac_year)
+    if mapping is None:
+        mapping = ZodiacSetting.get_all_settings_for_year(zodiac_year) or {}
+        zodiac_map_cache[zodiac_year] = mapping
+    return mapping
+
+
+def _hk_zodiac_mapping_signature(zodiac_year, zodiac_generation):
+    """某农历年当前生肖映射的指纹。
+
+    没有生肖设置的年份按默认规则取号，默认规则又参考澳门数据，澳门数据变了设置代数并不会变；
+    把映射本身的指纹存进展示字段，映射一变已存结果就失效。按代数和年份缓存一小段时间。
+    """
+    key = (zodiac_generation, int(zodiac_year))
+    now = time.time()
+    with _latest_draw_marker_cache_lock:
+        cached = _hk_zodiac_mapping_signature_cache.get(key)
+        if cached and now - cached["cached_at"] <= _LATEST_DRAW_MARKER_CACHE_TTL_SECONDS:
+            _hk_zodiac_mapping_signature_cache_stats.hit()
+            return cached["signature"]
+    _hk_zodiac_mapping_signature_cache_stats.miss()
+    signature = _runtime_json_signature(_hk_zodiac_mapping(int(zodiac_year), {}))
+    with _latest_draw_marker_cache_lock:
+        if len(_hk_zodiac_mapping_signature_cache) >= _HK_ZODIAC_MAPPING_SIGNATURE_CACHE_MAX_ITEMS:
+            _hk_zodiac_mapping_signature_cache_stats.evicted(len(_hk_zodiac_mapping_signature_cache))
+            _hk_zodiac_mapping_signature_cache.clear()
+        _hk_zodiac_mapping_signature_cache[key] = {"cached_at": now, "signature": signature}
+    return signature
+
+
+def _build_hk_draw_display(record, zodiac_map_cache):
+    """按记录所在农历年的生肖设置，生成香港开奖的生肖与波色展示字段。"""
+    from models import ZodiacSetting
+
+    mapping = _hk_zodiac_mapping(ZodiacSetting.get_zodiac_year_for_date(record.get("date")), zodiac_map_cache)
+
+    def _zodiac_of(num):
+        # 设置按整数号码存，香港号码带前导零（"04"），按数值查
+        try:
+            return mapping.get(int(num), '')
+        except (TypeError, ValueError):
+            return ''
+
+    sno = record.get("sno")
+    normal_numbers = record.get("no") or []
+    details_breakdown = []
+    for i, num_str in enumerate(list(normal_numbers) + [sno]):
+        if not num_str:
+            continue
+        color_en = _get_hk_number_color(num_str)
+        details_breakdown.append({
+            "position": f"平码 {i + 1}" if i < 6 else "特码", "number": num_str,
+            "color_en": color_en, "color_zh": COLOR_MAP_EN_TO_ZH.get(color_en, ''),
+            "zodiac": _zodiac_of(num_str)
+        })
+    return {
+        "sno_zodiac": _zodiac_of(sno),
+        "raw_zodiac": ','.join([_zodiac_of(num) for num in normal_numbers] + [_zodiac_of(sno)]),
+        "details_breakdown": details_breakdown,
+    }
+
+
+def _stored_hk_draw_display(row, record, zodiac_generation):
+    from models import ZodiacSetting
+
+    try:
+        stored = json.loads(row.display_breakdown or "null")
+    except (TypeError, ValueError):
+        return None
+    if (
+        not isinstance(stored, dict)
+        or stored.get("generation") != zodiac_generation
+        or stored.get("source") != _hk_draw_display_source(record)
+    ):
+        return None
+    zodiac_year = ZodiacSetting.get_zodiac_year_for_date(record.get("date"))
+    if stored.get("mapping") != _hk_zodiac_mapping_signature(zodiac_year, zodiac_generation):
+        return None
+    return stored.get("display")
+
+
+def _hk_draw_display_for_row(row, record, zodiac_generation, zodiac_map_cache):
+    # 生肖与波色在入库时已算好；代数或号码对不上（设置刚改、旧数据未回填）才现场计算。
+    display = _stored_hk_draw_display(row, record, zodiac_generation) if row is not None else None
+    if display is None:
+        display = _build_hk_draw_display(record, zodiac_map_cache)
+    return display
+
+
+def refresh_hk_draw_displays(draw_ids=None, zodiac_years=None, only_stale=False):
+    """把香港开奖的展示字段写回数据库。
+
+    新开奖入库时只刷新对应期号；生肖设置变化或澳门开奖入库（默认生肖规则会参考澳门数据）时
+    按农历年批量重算。其它途径改动澳门数据时，已存结果靠映射指纹失效、现场重算，
+    下次刷新再写回。内容未变的记录不会重复写入，返回实际更新的条数。
+    """
+    from models import ZodiacSetting
+
+    query = LotteryDraw.query.filter_by(region="hk")
+    if draw_ids is not None:
+        draw_ids = [str(draw_id) for draw_id in draw_ids if draw_id]
+        if not draw_ids:
+            return 0
+        query = query.filter(LotteryDraw.draw_id.in_(draw_ids))
+    target_years = {int(year) for year in zodiac_years} if zodiac_years else None
+    zodiac_generation = ZodiacSetting.get_settings_generation()
+    zodiac_map_cache = {}
+    updated = 0
+    try:
+        for row in query.all():
+            record = row.to_dict()
+            zodiac_year = ZodiacSetting.get_zodiac_year_for_date(record.get("date"))
+            if target_years is not None and zodiac_year not in target_years:
+                continue
+            if only_stale and _stored_hk_draw_display(row, record, zodiac_generation) is not None:
+                continue
+            display = _build_hk_draw_display(record, zodiac_map_cache)
+            payload = json.dumps(
+                {
+                    "generation": zodiac_generation,
+                    "source": _hk_draw_display_source(record),
+                    "mapping": _runtime_json_signature(_hk_zodiac_mapping(zodiac_year, zodiac_map_cache)),
+                    "display": display,
+                },
+                ensure_ascii=False,
+                sort_keys=True,
+            )
+            if row.display_breakdown != payload:
+                row.display_breakdown = payload
+                updated += 1
+        if updated:
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"刷新香港开奖展示字段失败: {e}")
+        return 0
+    return updated
+
+
+def backfill_draw_special_attributes():
+    """给升级前入库、还没有特码波色/单双的记录补上这两列，返回更新条数。"""
+    updated = 0
+    try:
+        for row in LotteryDraw.query.filter(LotteryDraw.special_color.is_(None)).all():
+            color, parity = LotteryDraw.special_number_attributes(row.special_number)
+            if color:
+                row.special_color, row.special_parity = color, parity
+                updated += 1
+        if updated:
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"回填开奖特码属性失败: {e}")
+        return 0
+    return updated
+
+
 def _get_draws_cache(cache_key):
     with _draws_api_cache_lock:
         cached = _draws_api_cache.get(cache_key)
         if cached:
             if time.time() - cached.get('created_at', 0) > _DRAWS_API_CACHE_TTL:
                 _draws_api_cache.pop(cache_key, None)
+                _draws_api_cache_stats.evicted()
+                _draws_api_cache_stats.miss()
                 return None
+            _draws_api_cache_stats.hit()
             return copy.deepcopy(cached['data'])
+    _draws_api_cache_stats.miss()
     return None
 
 
 def _set_draws_cache(cache_key, data):
     with _draws_api_cache_lock:
         if len(_draws_api_cache) > 128:
+            _draws_api_cache_stats.evicted(len(_draws_api_cache))
             _draws_api_cache.clear()
         _draws_api_cache[cache_key] = {
             'created_at': time.time(),
@@ -11880,7 +14067,11 @@ def _clear_draws_cache(region=None):
 
 def _clear_draw_dependent_caches(region=None):
     _clear_draws_cache(region)
+    _clear_latest_draw_marker_cache(region)
+    _clear_draw_statistics_cache()
+    _clear_markov_state_cache(region)
     _clear_ai_prediction_cache(region)
+    _clear_ai_prompt_context_cache(region)
     _clear_ml_prediction_cache(region)
     _clear_runtime_analysis_caches()
     try:
@@ -11937,7 +14128,7 @@ def _resolve_prediction_zodiac_year(year):
     return parsed_year
 
 
-def _get_prediction_data(region, year):
+def _get_prediction_data(region, year, allow_remote_sync=True):
     target_zodiac_year = _resolve_prediction_zodiac_year(year)
     candidate_years = [str(target_zodiac_year), str(target_zodiac_year + 1)]
 
@@ -11953,43 +14144,226 @@ def _get_prediction_data(region, year):
         except Exception as e:
             print(f"从数据库获取 {region} 地区 {candidate_year} 年数据失败: {e}")
 
-        if year_records:
-            draw_groups.append(year_records)
-            continue
+        if year_records:
+            draw_groups.append(year_records)
+            continue
+
+        # 预测阶段只主动补拉目标年份的数据；下一公历年的数据仅使用库内已有记录，
+        # 避免在年中请求尚未产生开奖的下一年接口。
+        if index == 0 and allow_remote_sync:
+            try:
+                remote_records = sync_draws_from_api(region, candidate_year, force=True)
+                if remote_records:
+                    draw_groups.append(remote_records)
+            except Exception as e:
+                print(f"同步 {region} 地区 {candidate_year} 年数据失败: {e}")
+
+    merged = _merge_draw_history_desc(*draw_groups)
+    filtered = _filter_draws_by_zodiac_year(merged, target_zodiac_year)
+    return filtered, target_zodiac_year
+
+
+def _latest_draw_cache_marker(region):
+    try:
+        record = (
+            LotteryDraw.query.filter_by(region=region)
+            .order_by(LotteryDraw.draw_date.desc(), LotteryDraw.draw_id.desc())
+            .first()
+        )
+    except Exception:
+        return None
+    if not record:
+        return None
+    return (
+        str(record.draw_id or "").strip(),
+        str(record.draw_date or "").strip(),
+        str(record.normal_numbers or "").strip(),
+        str(record.special_number or "").strip(),
+        str(record.special_zodiac or "").strip(),
+    )
+
+
+def _get_cached_latest_draw_marker(region):
+    normalized_region = str(region or "").strip().lower()
+    now = time.time()
+    with _latest_draw_marker_cache_lock:
+        cached = _latest_draw_marker_cache.get(normalized_region)
+        if cached and now - cached["cached_at"] <= _LATEST_DRAW_MARKER_CACHE_TTL_SECONDS:
+            _latest_draw_marker_cache_stats.hit()
+            return cached["marker"]
+    _latest_draw_marker_cache_stats.miss()
+    marker = _latest_draw_cache_marker(region)
+    if marker is not None:
+        with _latest_draw_marker_cache_lock:
+            _latest_draw_marker_cache[normalized_region] = {"cached_at": now, "marker": marker}
+    return marker
+
+
+def _clear_latest_draw_marker_cache(region=None):
+    normalized_region = str(region or "").strip().lower()
+    with _latest_draw_marker_cache_lock:
+        if normalized_region:
+            _latest_draw_marker_cache.pop(normalized_region, None)
+            _earliest_draw_date_cache.pop(normalized_region, None)
+        else:
+            _latest_draw_marker_cache.clear()
+            _earliest_draw_date_cache.clear()
+        _zodiac_settings_generation_cache.clear()
+        _hk_zodiac_mapping_signature_cache.clear()
+
+
+def _clear_zodiac_marker_cache(cache):
+    with _latest_draw_marker_cache_lock:
+        cache.clear()
+
+
+def _get_cached_zodiac_settings_generation():
+    from models import ZodiacSetting
+
+    now = time.time()
+    with _latest_draw_marker_cache_lock:
+        cached = _zodiac_settings_generation_cache.get("value")
+        if cached and now - cached["cached_at"] <= _LATEST_DRAW_MARKER_CACHE_TTL_SECONDS:
+            _zodiac_settings_generation_cache_stats.hit()
+            return cached["generation"]
+    _zodiac_settings_generation_cache_stats.miss()
+    generation = ZodiacSetting.get_settings_generation()
+    with _latest_draw_marker_cache_lock:
+        _zodiac_settings_generation_cache["value"] = {"cached_at": now, "generation": generation}
+    return generation
+
+
+def _draw_dependency_markers(region):
+    """响应内容依赖的开奖标记；香港记录的生肖由澳门数据兜底，因此同时依赖澳门最近一期。"""
+    normalized_region = str(region or "hk").strip().lower()
+    markers = [_get_cached_latest_draw_marker(normalized_region)]
+    if normalized_region == "hk":
+        markers.append(_get_cached_latest_draw_marker("macau"))
+    return markers, _get_cached_zodiac_settings_generation()
+
+
+def _draw_response_etag(region):
+    markers, zodiac_generation = _draw_dependency_markers(region)
+    if markers[0] is None:
+        return None
+    query_args = sorted(
+        (key, value)
+        for key, value in request.args.items(multi=True)
+        if key != "_"
+    )
+    fingerprint = json.dumps(
+        [
+            request.endpoint,
+            _DRAW_RESPONSE_ETAG_VERSION,
+            datetime.now().strftime("%Y-%m-%d"),
+            zodiac_generation,
+            markers,
+            query_args,
+        ],
+        ensure_ascii=True,
+    )
+    return hashlib.md5(fingerprint.encode("utf-8")).hexdigest()
+
+
+def _conditional_draw_response(view):
+    """按最近开奖标记和生肖设置代数生成 ETag；客户端持有的版本仍有效时直接返回 304，不再计算响应体。
+
+    响应被 gzip 压缩后 ETag 会降为弱 ETag，所以这里按弱比较匹配 If-None-Match。
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = _draw_response_etag(request.args.get("region", "hk"))
+        if etag and request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = app.make_response(view(*args, **kwargs))
+            if not etag or response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+    return wrapper
+
+
+def _with_content_etag(response):
+    # 下期开奖时间按时钟推算，不跟开奖标记走，直接用响应体摘要做 ETag。
+    response.headers["Cache-Control"] = "no-cache"
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def _build_draw_statistics_snapshot(region, data, zodiac_year):
+    latest = (data or [{}])[0]
+    return {
+        "region": region,
+        "zodiac_year": zodiac_year,
+        "draw_count": len(data or []),
+        "latest_period": str(latest.get("id") or ""),
+        "latest_date": str(latest.get("date") or ""),
+        "number_frequency": analyze_special_number_frequency(data),
+        "zodiac_frequency": dict(analyze_special_zodiac_frequency(data, region, zodiac_year)),
+        "color_frequency": dict(analyze_special_color_frequency(data, region)),
+        "parity_frequency": dict(analyze_special_parity_frequency(data)),
+    }
+
 
-        # 预测阶段只主动补拉目标年份的数据；下一公历年的数据仅使用库内已有记录，
-        # 避免在年中请求尚未产生开奖的下一年接口。
-        if index == 0:
-            try:
-                remote_records = sync_draws_from_api(region, candidate_year, force=True)
-                if remote_records:
-                    draw_groups.append(remote_records)
-            except Exception as e:
-                print(f"同步 {region} 地区 {candidate_year} 年数据失败: {e}")
+def _get_draw_statistics_snapshot(region, year, allow_remote_sync=True):
+    """按地区和农历年缓存的特码统计快照；开奖标记或生肖设置变化后自动重算。"""
+    zodiac_year = _resolve_prediction_zodiac_year(year)
+    cache_key = (str(region or "").strip().lower(), zodiac_year)
+    # 先取标记再加载数据：期间若有新开奖，快照只会比标记新，下次访问时重算。
+    markers = _draw_dependency_markers(region)
+    with _draw_statistics_cache_lock:
+        cached = _draw_statistics_cache.get(cache_key)
+        if cached and cached["markers"] == markers:
+            _draw_statistics_cache_stats.hit()
+            return copy.deepcopy(cached["snapshot"])
+    _draw_statistics_cache_stats.miss()
+    data, _ = _get_prediction_data(region, year, allow_remote_sync=allow_remote_sync)
+    snapshot = _build_draw_statistics_snapshot(region, data, zodiac_year)
+    if data:
+        with _draw_statistics_cache_lock:
+            if len(_draw_statistics_cache) >= _DRAW_STATISTICS_CACHE_MAX_ITEMS:
+                _draw_statistics_cache_stats.evicted(len(_draw_statistics_cache))
+                _draw_statistics_cache.clear()
+            _draw_statistics_cache[cache_key] = {"markers": markers, "snapshot": snapshot}
+    return copy.deepcopy(snapshot)
 
-    merged = _merge_draw_history_desc(*draw_groups)
-    filtered = _filter_draws_by_zodiac_year(merged, target_zodiac_year)
-    return filtered, target_zodiac_year
 
+def _clear_draw_statistics_cache(region=None):
+    # 香港快照的生肖依赖澳门数据：入库时整体清空；后台只清香港时保留澳门快照。
+    normalized_region = str(region or "").strip().lower()
+    with _draw_statistics_cache_lock:
+        if normalized_region != "hk":
+            _draw_statistics_cache.clear()
+            return
+        for key in [key for key in _draw_statistics_cache if key[0] == normalized_region]:
+            _draw_statistics_cache.pop(key, None)
+
+
+def _warm_draw_statistics_snapshots(region):
+    regions = ["hk", "macau"] if str(region or "").strip().lower() == "macau" else [region]
+    for item in regions:
+        try:
+            _get_draw_statistics_snapshot(item, str(datetime.now().year), allow_remote_sync=False)
+        except Exception as e:
+            print(f"预计算 {item} 地区统计快照失败: {e}")
 
-def _latest_draw_cache_marker(region):
-    try:
-        record = (
-            LotteryDraw.query.filter_by(region=region)
-            .order_by(LotteryDraw.draw_date.desc(), LotteryDraw.draw_id.desc())
-            .first()
-        )
-    except Exception:
-        return None
-    if not record:
-        return None
-    return (
-        str(record.draw_id or "").strip(),
-        str(record.draw_date or "").strip(),
-        str(record.normal_numbers or "").strip(),
-        str(record.special_number or "").strip(),
-        str(record.special_zodiac or "").strip(),
-    )
+
+def _refresh_draw_displays_after_save(region, draws):
+    from models import ZodiacSetting
+
+    normalized_region = str(region or "").strip().lower()
+    if normalized_region == "hk":
+        refresh_hk_draw_displays(draw_ids=[draw.get("id") for draw in draws])
+    elif normalized_region == "macau":
+        zodiac_years = {
+            ZodiacSetting.get_zodiac_year_for_date(draw.get("date"))
+            for draw in draws
+            if draw.get("date")
+        }
+        if zodiac_years:
+            refresh_hk_draw_displays(zodiac_years=zodiac_years)
 
 
 def save_draws_to_database(draws, region):
@@ -12005,9 +14379,12 @@ def save_draws_to_database(draws, region):
                 if settled:
                     print(f"已自动结算{settled}条手动下注记录，期号: {draw.get('id')}")
         
+        if count:
+            _refresh_draw_displays_after_save(region, draws)
         after_latest = _latest_draw_cache_marker(region)
         if count and before_latest != after_latest:
             _clear_draw_dependent_caches(region)
+            _warm_draw_statistics_snapshots(region)
         print(f"成功保存{count}条{region}地区的开奖记录到数据库")
     except Exception as e:
         print(f"保存开奖记录到数据库失败: {e}")
@@ -12024,13 +14401,21 @@ POSTPROCESS_BACKTEST_LIMIT = 120
 
 
 def _ai_backtest_enabled():
-    ai_config = get_ai_config()
-    api_key = str(ai_config.get("api_key") or "").strip()
-    return bool(api_key and "你的" not in api_key)
+    return _ai_completion_available(get_ai_config())
+
+
+def _ai_cassette_backtest_enabled():
+    # 逐期调用真实上游太慢也太贵：AI 回测默认只在回放模式下开放，
+    # 录制模式要额外设置 AI_CASSETTE_RECORD_BACKTEST=1 才会真的去请求上游。
+    mode = _ai_cassette_mode()
+    if mode == "replay":
+        return True
+    return mode == "record" and _AI_CASSETTE_RECORD_BACKTEST and _ai_backtest_enabled()
 
 
 def _filter_backtest_strategies(strategies):
-    return [strategy for strategy in (strategies or []) if strategy != "ai"]
+    allow_ai = _ai_cassette_backtest_enabled()
+    return [strategy for strategy in (strategies or []) if strategy != "ai" or allow_ai]
 
 
 def _backtest_draw_sort_key(draw):
@@ -12214,6 +14599,7 @@ def _apply_lunar_learning_scope_to_predictions(predictions, region, minimum_samp
     return scoped or fallback_predictions or list(predictions or [])
 
 
+@traced("ml.history")
 def _ensure_ml_prediction_history(data, region, minimum_draws=36, target_draws=240):
     cutoff_period = _current_backtest_cutoff_period()
     current_zodiac_year = _resolve_learning_scope_zodiac_year(
@@ -12400,17 +14786,18 @@ def _build_backtest_snapshot_payload(region, draws, strategies=None, min_history
             resolved_strategy = strategy
             try:
                 if strategy == "ai":
-                    result = predict_with_ai(
-                        history_desc,
-                        region,
-                        config_override={
-                            "sample_count": 1,
-                            "candidate_count": 2,
-                            "history_window": 10,
-                            "special_shortlist": 6,
-                            "normal_shortlist": 14,
-                        },
-                    )
+                    with _temporary_backtest_cutoff_period(target_draw.get("id")):
+                        result = predict_with_ai(
+                            history_desc,
+                            region,
+                            config_override={
+                                "sample_count": 1,
+                                "candidate_count": 2,
+                                "history_window": 10,
+                                "special_shortlist": 6,
+                                "normal_shortlist": 14,
+                            },
+                        )
                 else:
                     with _temporary_backtest_cutoff_period(target_draw.get("id")):
                         with _temporary_strict_backtest_strategy():
@@ -12877,7 +15264,7 @@ def _build_auto_optimize_candidates(strategy, config, level="balanced"):
 
 
 def _build_strategy_backtest_summary(region, strategy, draws=None, config_override=None, min_history=AUTO_BACKTEST_MIN_HISTORY, max_periods=AUTO_OPTIMIZE_BACKTEST_PERIODS):
-    if strategy == "ai":
+    if strategy == "ai" and not _ai_cassette_backtest_enabled():
         return {"total": 0, "top1_hit_rate": 0.0, "top6_hit_rate": 0.0, "zodiac_hit_rate": 0.0, "windows": [], "periods_evaluated": 0}
 
     source_draws = _normalize_backtest_draws(
@@ -12916,7 +15303,8 @@ def _build_strategy_backtest_summary(region, strategy, draws=None, config_overri
             history_desc = list(reversed(chronological[:idx]))
             try:
                 if strategy == "ai":
-                    result = predict_with_ai(history_desc, region, config_override=config_override)
+                    with _temporary_backtest_cutoff_period(target_draw.get("id")):
+                        result = predict_with_ai(history_desc, region, config_override=config_override)
                 else:
                     with _temporary_backtest_cutoff_period(target_draw.get("id")):
                         with _temporary_strict_backtest_strategy():
@@ -13169,6 +15557,7 @@ def sync_draws_from_api(region, year=None, force=False):
     return remote_draws
 
 @app.route('/api/draws')
+@_conditional_draw_response
 def draws_api():
     region = request.args.get('region', 'hk')
     year = request.args.get('year', str(datetime.now().year))
@@ -13181,6 +15570,14 @@ def draws_api():
     except (TypeError, ValueError):
         page_size = 50
     
+    cursor = (request.args.get('cursor') or '').strip()
+    cursor_values = None
+    if cursor:
+        try:
+            cursor_values = decode_cursor(cursor, len(_DRAW_KEYSET_COLUMNS))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
     print(f"API请求: 地区={region}, 年份={year}, 页码={page}, 每页数量={page_size}")
     
     # 处理"全部"年份的情况
@@ -13188,87 +15585,38 @@ def draws_api():
         year = str(datetime.now().year)
         print(f"年份为'全部'，使用当前年份: {year}")
     
-    cache_key = (region, str(year), page, page_size)
+    # 缓存键带上开奖标记，别的进程入库新开奖后这里不会再拿旧响应配新 ETag。
+    cache_key = (
+        region,
+        str(year),
+        cursor or page,
+        page_size,
+        json.dumps(_draw_dependency_markers(region), ensure_ascii=True),
+    )
     cached = _get_draws_cache(cache_key)
     if cached is not None:
-        return jsonify(cached)
+        return _draws_page_response(cached, page_size)
 
-    data = _load_draw_page_from_db(region, year, page, page_size)
-    if not data and page == 1:
-        data = get_yearly_data(region, year)[:page_size]
+    rows = _load_draw_rows_from_db(region, year, page, page_size, cursor_values=cursor_values)
+    if rows:
+        data = [(row, row.to_dict()) for row in rows]
+    elif page == 1 and cursor_values is None:
+        data = [(None, record) for record in get_yearly_data(region, year)[:page_size]]
+    else:
+        data = []
     print(f"获取到{len(data)}条数据")
-    
-    # 获取澳门数据，用于提取生肖信息（优先数据库）
-    macau_data = _load_draw_page_from_db('macau', year, 1, 80) if region == 'hk' else []
-    print(f"获取到{len(macau_data)}条澳门数据用于生肖映射")
-    
-    # 创建号码到生肖的映射（澳门数据作为兜底）
-    fallback_number_to_zodiac = {}
-    try:
-        for record in macau_data:
-            all_numbers = record.get('no', []) + [record.get('sno')]
-            zodiacs = record.get('raw_zodiac', '').split(',')
-            if len(all_numbers) == len(zodiacs):
-                for i, num in enumerate(all_numbers):
-                    if num:
-                        fallback_number_to_zodiac[num] = zodiacs[i]
-    except Exception as e:
-        print(f"获取澳门生肖映射失败: {e}")
 
-    zodiac_map_cache = {}
-    try:
-        from models import ZodiacSetting
-    except Exception:
-        ZodiacSetting = None
-    
     if region == 'hk':
-        for record in data:
-            mapping = fallback_number_to_zodiac
-            if ZodiacSetting:
-                zodiac_year = ZodiacSetting.get_zodiac_year_for_date(record.get('date'))
-                mapping = zodiac_map_cache.get(zodiac_year)
-                if mapping is None:
-                    mapping = ZodiacSetting.get_all_settings_for_year(zodiac_year) or {}
-                    zodiac_map_cache[zodiac_year] = mapping
-                if not mapping:
-                    mapping = fallback_number_to_zodiac
-
-            normalized_mapping = {str(key): value for key, value in mapping.items()}
-            sno = record.get('sno')
-            record['sno_zodiac'] = normalized_mapping.get(str(sno), '')
-            
-            normal_numbers = record.get('no', [])
-            normal_zodiacs = []
-            for num in normal_numbers:
-                normal_zodiacs.append(normalized_mapping.get(str(num), ''))
-            record['raw_zodiac'] = ','.join(normal_zodiacs + [normalized_mapping.get(str(sno), '')])
-            
-            details_breakdown = []
-            all_numbers = record.get('no', []) + [record.get('sno')]
-            for i, num_str in enumerate(all_numbers):
-                if not num_str: 
-                    continue
-                color_en = _get_hk_number_color(num_str)
-                details_breakdown.append({
-                    "position": f"平码 {i + 1}" if i < 6 else "特码", "number": num_str,
-                    "color_en": color_en, "color_zh": COLOR_MAP_EN_TO_ZH.get(color_en, ''),
-                    "zodiac": mapping.get(num_str, '')
-                })
-            record['details_breakdown'] = details_breakdown
+        zodiac_generation = _get_cached_zodiac_settings_generation()
+        zodiac_map_cache = {}
+        for row, record in data:
+            record.update(_hk_draw_display_for_row(row, record, zodiac_generation, zodiac_map_cache))
+    data = [record for _, record in data]
+    if region == 'hk':
         data = sorted(data, key=lambda x: x.get('date', ''), reverse=True)
-        
-        # 更新预测准确率
-        pass
-    else:
-        # 更新澳门预测准确率
-        pass
-    
-    # 分页处理
+
     _set_draws_cache(cache_key, data)
-    return jsonify(data)
-    
-    # 如果是第一页，返回前50条数据，否则返回分页数据
-    return jsonify(data)
+    return _draws_page_response(data, page_size)
 
 def update_prediction_accuracy(data, region, trigger_auto_predictions=True, tune_strategy_configs=True):
     """更新预测准确率 - 只比较特码和生肖"""
@@ -13303,6 +15651,7 @@ def update_prediction_accuracy(data, region, trigger_auto_predictions=True, tune
                 }
         
         user_hits = {}
+        settlement_counters = {}
         
         # 更新每条预测记录的准确率
         for pred in predictions:
@@ -13331,6 +15680,9 @@ def update_prediction_accuracy(data, region, trigger_auto_predictions=True, tune
             pred.actual_special_zodiac = result['special_zodiac']
             pred.accuracy_score = accuracy
             pred.is_result_updated = True
+            counter = settlement_counters.setdefault(pred.strategy, {"hits": 0, "total": 0})
+            counter["hits"] += special_hit
+            counter["total"] += 1
             
             # 如果预测成功（特码命中），收集到待发送列表以便发送合并通知邮件
             if special_hit == 1:
@@ -13340,6 +15692,8 @@ def update_prediction_accuracy(data, region, trigger_auto_predictions=True, tune
         
         # 提交更改
         db.session.commit()
+        if settlement_counters:
+            _record_prediction_settlements(region, settlement_counters)
 
         # 统一发送合并后的中奖邮件
         for user_id, hit_preds in user_hits.items():
@@ -13443,6 +15797,144 @@ def generate_auto_predictions(data, region):
         print(f"自动预测出错：{e}")
         db.session.rollback()
 
+PERIOD_PREDICTION_STORE_VERSION = 1
+
+
+def _period_prediction_draws_signature(data):
+    """Fingerprint of the draw rows the local strategies read, numbers included, so corrected draws count."""
+    return _runtime_json_signature([
+        [str(item.get("id") or "").strip(), item.get("no"), item.get("sno")]
+        for item in data or []
+    ])
+
+
+def _period_prediction_config_hash(region, data):
+    """Fingerprint everything a shared local prediction depends on, including the draw history it was built from."""
+    normalized_region = str(region or "").strip().lower()
+    config_keys = [_strategy_config_key(normalized_region, strategy) for strategy in LOCAL_STRATEGY_KEYS]
+    rows = SystemConfig.query.filter(SystemConfig.key.in_(config_keys)).all()
+    payload = {
+        "store_version": PERIOD_PREDICTION_STORE_VERSION,
+        "region": normalized_region,
+        "configs": {row.key: str(row.value or "") for row in rows},
+        "settlement_generation": get_prediction_settlement_generation(normalized_region),
+        "zodiac_generation": _get_cached_zodiac_settings_generation(),
+        "draws": _period_prediction_draws_signature(data),
+    }
+    return _runtime_json_signature(payload)
+
+
+def _load_period_prediction(region, period, strategy, data, config_hash=None):
+    normalized_region = str(region or "").strip().lower()
+    period = str(period or "").strip()
+    if not normalized_region or not period or strategy not in LOCAL_STRATEGY_KEYS:
+        return None
+    try:
+        config_hash = config_hash or _period_prediction_config_hash(normalized_region, data)
+        row = PeriodPrediction.query.filter_by(
+            region=normalized_region,
+            period=period,
+            strategy=strategy,
+            config_hash=config_hash,
+        ).first()
+    except Exception as e:
+        print(f"读取预计算预测失败 region={normalized_region}, period={period}, strategy={strategy}: {e}")
+        return None
+    if not row or not row.payload:
+        return None
+    try:
+        result = json.loads(row.payload)
+    except Exception:
+        return None
+    if not isinstance(result, dict) or result.get("error"):
+        return None
+    meta = dict(result.get("model_meta") or {})
+    meta["precomputed"] = True
+    meta["precomputed_at"] = row.created_at.isoformat(timespec="seconds") if row.created_at else ""
+    result["model_meta"] = meta
+    return result
+
+
+def _store_period_prediction(region, period, strategy, config_hash, result, elapsed_ms=0):
+    payload = json.dumps(result, ensure_ascii=False, default=str)
+    row = PeriodPrediction.query.filter_by(
+        region=region,
+        period=period,
+        strategy=strategy,
+        config_hash=config_hash,
+    ).first()
+    if row is None:
+        row = PeriodPrediction(
+            region=region,
+            period=period,
+            strategy=strategy,
+            config_hash=config_hash,
+        )
+        db.session.add(row)
+    row.payload = payload
+    row.elapsed_ms = int(elapsed_ms or 0)
+    row.created_at = datetime.now()
+    try:
+        db.session.commit()
+    except Exception as e:
+        # 其它 worker 已经写入了同一键，保留对方结果即可。
+        db.session.rollback()
+        duplicate_hint = str(e).lower()
+        if 'unique' not in duplicate_hint and 'duplicate' not in duplicate_hint:
+            raise
+
+
+def precompute_period_predictions(region, data, strategies=None):
+    """开奖后为下一期预先计算各本地策略的统一（非个性化）结果。"""
+    normalized_region = str(region or "").strip().lower()
+    if not data:
+        return 0
+    latest_draw = data[0]
+    next_period = _get_next_period(normalized_region, latest_draw.get('id', ''), latest_draw.get('date'))
+    if not next_period:
+        return 0
+
+    config_hash = _period_prediction_config_hash(normalized_region, data)
+    existing_strategies = {
+        row.strategy
+        for row in PeriodPrediction.query.filter_by(
+            region=normalized_region,
+            period=next_period,
+            config_hash=config_hash,
+        ).all()
+    }
+    stored = 0
+    pending = [
+        strategy
+        for strategy in (strategies or LOCAL_STRATEGY_KEYS)
+        if strategy in LOCAL_STRATEGY_KEYS and strategy not in existing_strategies
+    ]
+    started_at = time.time()
+    # pending 为空时不能交给 iter_strategy_predictions，它会把空列表当成“全部策略”。
+    for strategy, result in (iter_strategy_predictions(data, normalized_region, pending) if pending else ()):
+        elapsed_ms = int((time.time() - started_at) * 1000)
+        started_at = time.time()
+        if not isinstance(result, dict) or result.get('error'):
+            continue
+        try:
+            _store_period_prediction(normalized_region, next_period, strategy, config_hash, result, elapsed_ms=elapsed_ms)
+            stored += 1
+        except Exception as e:
+            db.session.rollback()
+            print(f"保存预计算预测失败 region={normalized_region}, period={next_period}, strategy={strategy}: {e}")
+
+    try:
+        PeriodPrediction.query.filter(
+            PeriodPrediction.region == normalized_region,
+            PeriodPrediction.period != next_period,
+        ).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"清理过期预计算预测失败 region={normalized_region}: {e}")
+    return stored
+
+
 def generate_prediction_for_user(user, region, period, strategy, data):
     """为指定用户生成预测（排除 AI 策略）"""
     try:
@@ -13453,7 +15945,11 @@ def generate_prediction_for_user(user, region, period, strategy, data):
         variation_key = None
         if _personalized_predictions_enabled():
             variation_key = f"user:{user.id}|region:{region}|period:{period}|strategy:{strategy}"
-        result = get_local_recommendations(strategy, data, region, variation_key=variation_key)
+        result = None
+        if variation_key is None:
+            result = _load_period_prediction(region, period, strategy, data)
+        if result is None:
+            result = get_local_recommendations(strategy, data, region, variation_key=variation_key)
         result = _ensure_period_unique_special(
             result,
             strategy,
@@ -13496,13 +15992,269 @@ def generate_prediction_for_user(user, region, period, strategy, data):
                 .order_by(PredictionRecord.id.desc())
                 .first()
             )
-            if existing:
-                print(f"检测到自动预测重复记录，已复用现有记录：user={user.username}, region={region}, period={period}, strategy={strategy}")
-                return existing
-        print(f"为用户 {user.username} 生成预测时出错：{e}")
-        db.session.rollback()
+            if existing:
+                print(f"检测到自动预测重复记录，已复用现有记录：user={user.username}, region={region}, period={period}, strategy={strategy}")
+                return existing
+        print(f"为用户 {user.username} 生成预测时出错：{e}")
+        db.session.rollback()
+        return None
+
+def _build_existing_prediction_result(
+    existing,
+    requested_strategy,
+    resolved_strategy,
+    data,
+    region,
+    current_period,
+    user_id=None,
+    prediction_zodiac_year=None,
+):
+    # 返回已存在的预测结果
+    sno_zodiac = existing.special_zodiac
+    # 不再在本地计算生肖，所有地区都使用澳门API返回的生肖数据
+
+    result = {
+        "normal": existing.normal_numbers.split(','),
+        "special": {
+            "number": existing.special_number,
+            "sno_zodiac": sno_zodiac
+        }
+    }
+    existing_meta = _deserialize_prediction_metadata(
+        getattr(existing, "prediction_metadata", "")
+    )
+    refreshed_text = _hydrate_prediction_recommendation_text(
+        resolved_strategy,
+        existing.prediction_text,
+        data,
+        region,
+        special_number=existing.special_number,
+        normal_numbers=existing.normal_numbers,
+        existing_meta=existing_meta,
+    )
+    if refreshed_text:
+        result["recommendation_text"] = refreshed_text
+    result["model_meta"] = _hydrate_prediction_model_meta(
+        resolved_strategy,
+        existing_meta,
+        data,
+        region,
+    )
+    result = _ensure_period_unique_special(
+        result,
+        resolved_strategy,
+        region,
+        current_period,
+        user_id=user_id,
+        prediction_zodiac_year=prediction_zodiac_year,
+    )
+    adjusted_special = str((result.get("special") or {}).get("number") or "").strip()
+    original_special = str(existing.special_number or "").strip()
+    if adjusted_special and adjusted_special != original_special:
+        refreshed_text = _refresh_special_recommendation_text(
+            resolved_strategy,
+            result.get("recommendation_text", ""),
+            adjusted_special,
+            result.get("normal", []),
+            region=region,
+        )
+        if refreshed_text:
+            result["recommendation_text"] = refreshed_text
+        result["model_meta"] = dict(result.get("model_meta") or {})
+        existing.special_number = adjusted_special
+        existing.special_zodiac = (result.get("special") or {}).get("sno_zodiac", "")
+        existing.prediction_metadata = _serialize_prediction_metadata(result.get("model_meta"))
+        existing.prediction_text = _decorate_recommendation_text(
+            requested_strategy,
+            resolved_strategy,
+            result.get("recommendation_text", ""),
+        )
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+    return result
+
+
+def _save_batch_strategy_prediction(user_id, region, strategy, period, result, data, prediction_zodiac_year):
+    try:
+        prediction = PredictionRecord(
+            user_id=user_id,
+            region=region,
+            strategy=strategy,
+            period=period,
+            normal_numbers=','.join(map(str, result.get('normal', []))),
+            special_number=str(result.get('special', {}).get('number', '')),
+            special_zodiac=result.get('special', {}).get('sno_zodiac', ''),
+            prediction_metadata=_serialize_prediction_metadata(result.get('model_meta')),
+            prediction_text=_decorate_recommendation_text(strategy, strategy, result.get('recommendation_text', '')),
+        )
+        db.session.add(prediction)
+        db.session.commit()
+        result["saved"] = True
+        return result
+    except Exception as e:
+        db.session.rollback()
+        duplicate_hint = str(e).lower()
+        if 'unique' in duplicate_hint or 'duplicate' in duplicate_hint:
+            existing = (
+                PredictionRecord.query.filter_by(
+                    user_id=user_id,
+                    region=region,
+                    period=period,
+                    strategy=strategy,
+                )
+                .order_by(PredictionRecord.id.desc())
+                .first()
+            )
+            if existing:
+                result = _build_existing_prediction_result(
+                    existing,
+                    strategy,
+                    strategy,
+                    data,
+                    region,
+                    period,
+                    user_id=user_id,
+                    prediction_zodiac_year=prediction_zodiac_year,
+                )
+                result["saved"] = True
+                result["duplicate_ignored"] = True
+                return result
+        print(f"保存批量预测记录失败 user={user_id}, region={region}, period={period}, strategy={strategy}: {e}")
+        result["saved"] = False
+        result["save_error"] = str(e)
+        return result
+
+
+def _stream_batch_strategy_predictions(user_id, region, strategies, data, current_period, prediction_zodiac_year):
+    """/api/predict?strategies=a,b,c：共享一次分析，逐个策略通过 SSE 推送结果。"""
+
+    def _sse_event(payload):
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    def _finish(strategy, result):
+        result.update({
+            "type": "result",
+            "region": region,
+            "strategy": strategy,
+            "requested_strategy": strategy,
+            "period": current_period,
+            "prediction_zodiac_year": prediction_zodiac_year,
+        })
+        return _sse_event(_attach_prediction_display_copy(result, strategy, strategy))
+
+    def generate_batch():
+        personalized = _personalized_predictions_enabled()
+        stored_config_hash = None
+        pending = []
+        variation_keys = {}
+        for strategy in strategies:
+            if strategy not in LOCAL_STRATEGY_KEYS:
+                yield _sse_event({
+                    "type": "error",
+                    "strategy": strategy,
+                    "error": f"批量预测仅支持本地策略：{strategy}",
+                })
+                continue
+            existing = PredictionRecord.query.filter_by(
+                user_id=user_id,
+                region=region,
+                period=current_period,
+                strategy=strategy,
+            ).first()
+            if existing:
+                result = _build_existing_prediction_result(
+                    existing,
+                    strategy,
+                    strategy,
+                    data,
+                    region,
+                    current_period,
+                    user_id=user_id,
+                    prediction_zodiac_year=prediction_zodiac_year,
+                )
+                result["saved"] = True
+                yield _finish(strategy, result)
+                continue
+            if personalized:
+                variation_keys[strategy] = f"user:{user_id}|region:{region}|period:{current_period}|strategy:{strategy}"
+            else:
+                if stored_config_hash is None:
+                    stored_config_hash = _period_prediction_config_hash(region, data)
+                stored = _load_period_prediction(region, current_period, strategy, data, config_hash=stored_config_hash)
+                if stored is not None:
+                    stored = _ensure_period_unique_special(
+                        stored,
+                        strategy,
+                        region,
+                        current_period,
+                        user_id=user_id,
+                        prediction_zodiac_year=prediction_zodiac_year,
+                    )
+                    yield _finish(strategy, _save_batch_strategy_prediction(
+                        user_id, region, strategy, current_period, stored, data, prediction_zodiac_year
+                    ))
+                    continue
+            pending.append(strategy)
+
+        for strategy, result in iter_strategy_predictions(data, region, pending, variation_keys=variation_keys):
+            if result.get("error"):
+                yield _sse_event({"type": "error", "strategy": strategy, "error": result.get("error")})
+                continue
+            result = _ensure_period_unique_special(
+                result,
+                strategy,
+                region,
+                current_period,
+                user_id=user_id,
+                prediction_zodiac_year=prediction_zodiac_year,
+            )
+            yield _finish(strategy, _save_batch_strategy_prediction(
+                user_id, region, strategy, current_period, result, data, prediction_zodiac_year
+            ))
+
+        yield _sse_event({
+            "type": "done",
+            "region": region,
+            "period": current_period,
+            "strategies": list(strategies),
+        })
+
+    return Response(
+        stream_with_context(generate_batch()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _resolve_next_period_from_marker(region, prediction_zodiac_year):
+    """由缓存的最近一期开奖推算下一期；最近一期不在目标生肖年内时返回 None，交给完整历史推算。"""
+    from models import ZodiacSetting
+
+    marker = _get_cached_latest_draw_marker(region)
+    if not marker or not marker[0]:
+        return None
+    latest_period, latest_date = marker[0], marker[1]
+    try:
+        if ZodiacSetting.get_zodiac_year_for_date(latest_date) != prediction_zodiac_year:
+            return None
+        return _get_next_period(region, latest_period, latest_date)
+    except (TypeError, ValueError) as e:
+        print(f"根据最近一期标记推算期号失败: {e}")
         return None
 
+
+def _existing_prediction_needs_history(strategy, existing):
+    # 只有机器学习记录会用历史开奖重算诊断信息；保存时已带齐的记录无需再算。
+    if strategy != "ml":
+        return False
+    existing_meta = _deserialize_prediction_metadata(getattr(existing, "prediction_metadata", ""))
+    if not isinstance(existing_meta, dict):
+        return True
+    return existing_meta.get("samples") is None or existing_meta.get("special_probability") is None
+
+
 @app.route('/api/predict')
 def unified_predict_api():
     user, auth_error = _require_active_session_json()
@@ -13512,132 +16264,113 @@ def unified_predict_api():
     # 预测按当前农历生肖年取数；生肖映射仍由 /api/get_zodiacs 单独处理。
     region, strategy, year = request.args.get('region', 'hk'), request.args.get('strategy', 'balanced'), request.args.get('year', str(datetime.now().year))
     stream_response = request.args.get('stream') == '1'
+    batch_strategies = _dedupe_keep_order(_parse_csv_list(request.args.get('strategies')))
 
     def _sse_event(payload):
         return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
 
-    data, prediction_zodiac_year = _get_prediction_data(region, year)
-    if not data: return jsonify({"error": f"无法加载{year}年的数据"}), 404
     resolved_strategy = strategy
+    prediction_zodiac_year = _resolve_prediction_zodiac_year(year)
     
     # 检查用户是否登录和激活（对于需要保存记录的功能）
     user_id = user.id
     is_active = True
-    
-    # 获取下一期期数（使用最近一期的下一期）
-    if data:
-        try:
-            latest_period = data[0].get('id', '')
-            current_period = _get_next_period(region, latest_period, data[0].get('date'))
-        except (IndexError, ValueError) as e:
-            print(f"计算下一期期数时出错: {e}")
-            current_period = _default_period(region)
-    else:
-        current_period = _default_period(region)
-    
-    # 检查用户是否已经为当前期和当前策略生成过预测
-    if user_id and is_active:
-        existing = PredictionRecord.query.filter_by(
+
+    loaded_history = {}
+
+    def _load_history():
+        # 历史开奖只在真正需要时加载一次：生成新预测，或补齐旧记录的机器学习诊断信息。
+        if "data" not in loaded_history:
+            loaded_history["data"], _ = _get_prediction_data(region, year)
+        return loaded_history["data"]
+
+    def _find_existing(period):
+        if not (user_id and is_active and period):
+            return None
+        return PredictionRecord.query.filter_by(
             user_id=user_id,
             region=region,
-            period=current_period,
+            period=period,
             strategy=resolved_strategy  # 添加策略作为过滤条件
         ).first()
-        
-        if existing:
-            # 返回已存在的预测结果
-            sno_zodiac = existing.special_zodiac
-            # 不再在本地计算生肖，所有地区都使用澳门API返回的生肖数据
-            
-            result = {
-                "normal": existing.normal_numbers.split(','),
-                "special": {
-                    "number": existing.special_number,
-                    "sno_zodiac": sno_zodiac
-                }
+
+    def _respond_existing(existing, period, data):
+        result = _build_existing_prediction_result(
+            existing,
+            strategy,
+            resolved_strategy,
+            data,
+            region,
+            period,
+            user_id=user_id,
+            prediction_zodiac_year=prediction_zodiac_year,
+        )
+        result["strategy"] = resolved_strategy
+        result["requested_strategy"] = strategy
+        result["prediction_zodiac_year"] = prediction_zodiac_year
+        result = _attach_prediction_display_copy(result, strategy, resolved_strategy)
+        if stream_response and resolved_strategy == 'ai':
+            payload = {
+                "type": "done",
+                "region": region,
+                "strategy": resolved_strategy,
+                "requested_strategy": strategy,
+                "period": period,
+                "saved": True,
+                **result
             }
-            existing_meta = _deserialize_prediction_metadata(
-                getattr(existing, "prediction_metadata", "")
-            )
-            refreshed_text = _hydrate_prediction_recommendation_text(
-                resolved_strategy,
-                existing.prediction_text,
-                data,
-                region,
-                special_number=existing.special_number,
-                normal_numbers=existing.normal_numbers,
-                existing_meta=existing_meta,
-            )
-            if refreshed_text:
-                result["recommendation_text"] = refreshed_text
-            result["model_meta"] = _hydrate_prediction_model_meta(
-                resolved_strategy,
-                existing_meta,
-                data,
-                region,
-            )
-            result = _ensure_period_unique_special(
-                result,
-                resolved_strategy,
-                region,
-                current_period,
-                user_id=user_id,
-                prediction_zodiac_year=prediction_zodiac_year,
+            def generate_existing():
+                yield _sse_event(payload)
+            return Response(
+                stream_with_context(generate_existing()),
+                mimetype='text/event-stream',
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
             )
-            adjusted_special = str((result.get("special") or {}).get("number") or "").strip()
-            original_special = str(existing.special_number or "").strip()
-            if adjusted_special and adjusted_special != original_special:
-                refreshed_text = _refresh_special_recommendation_text(
-                    resolved_strategy,
-                    result.get("recommendation_text", ""),
-                    adjusted_special,
-                    result.get("normal", []),
-                    region=region,
-                )
-                if refreshed_text:
-                    result["recommendation_text"] = refreshed_text
-                result["model_meta"] = dict(result.get("model_meta") or {})
-                existing.special_number = adjusted_special
-                existing.special_zodiac = (result.get("special") or {}).get("sno_zodiac", "")
-                existing.prediction_metadata = _serialize_prediction_metadata(result.get("model_meta"))
-                existing.prediction_text = _decorate_recommendation_text(
-                    strategy,
-                    resolved_strategy,
-                    result.get("recommendation_text", ""),
-                )
-                try:
-                    db.session.commit()
-                except Exception:
-                    db.session.rollback()
-            result["strategy"] = resolved_strategy
-            result["requested_strategy"] = strategy
-            result["prediction_zodiac_year"] = prediction_zodiac_year
-            result = _attach_prediction_display_copy(result, strategy, resolved_strategy)
-            if stream_response and resolved_strategy == 'ai':
-                payload = {
-                    "type": "done",
-                    "region": region,
-                    "strategy": resolved_strategy,
-                    "requested_strategy": strategy,
-                    "period": current_period,
-                    "saved": True,
-                    **result
-                }
-                def generate_existing():
-                    yield _sse_event(payload)
-                return Response(
-                    stream_with_context(generate_existing()),
-                    mimetype='text/event-stream',
-                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
-                )
-            return jsonify(result)
+        return jsonify(result)
+
+    # 先用缓存的最近一期标记推算下一期，重复访问直接命中已有记录，不必加载整年开奖。
+    current_period = None
+    if not batch_strategies:
+        current_period = _resolve_next_period_from_marker(region, prediction_zodiac_year)
+        existing = _find_existing(current_period)
+        if existing:
+            data = _load_history() if _existing_prediction_needs_history(resolved_strategy, existing) else []
+            return _respond_existing(existing, current_period, data)
+
+    data = _load_history()
+    if not data: return jsonify({"error": f"无法加载{year}年的数据"}), 404
+    
+    # 获取下一期期数（使用最近一期的下一期）
+    marker_period = current_period
+    try:
+        latest_period = data[0].get('id', '')
+        current_period = _get_next_period(region, latest_period, data[0].get('date'))
+    except (IndexError, ValueError) as e:
+        print(f"计算下一期期数时出错: {e}")
+        current_period = _default_period(region)
+
+    if batch_strategies:
+        return _stream_batch_strategy_predictions(
+            user_id,
+            region,
+            batch_strategies,
+            data,
+            current_period,
+            prediction_zodiac_year,
+        )
+    
+    # 缓存的标记与实际历史推算出的期号不一致时（标记过期或年份不同），按实际期号再查一次
+    if current_period != marker_period:
+        existing = _find_existing(current_period)
+        if existing:
+            return _respond_existing(existing, current_period, data)
     
     # 生成新的预测
     if resolved_strategy == 'ai':
         if stream_response:
             def generate_stream():
                 ai_config = get_ai_config()
-                if not ai_config['api_key'] or "你的" in ai_config['api_key']:
+                if not _ai_completion_available(ai_config):
                     yield _sse_event({"type": "error", "error": "AI API Key 未配置"})
                     return
                 tuned = _load_strategy_config("ai", region)
@@ -13645,18 +16378,34 @@ def unified_predict_api():
                 temperature = float(tuned.get("temperature") or 0.35)
                 sample_count = _clamp(int(tuned.get("sample_count") or 3), 1, 5)
                 candidate_count = _clamp(int(tuned.get("candidate_count") or 3), 2, 5)
-                shortlist_context = _build_ai_shortlist_context(data, region, config=tuned)
-                gate_profile = dict(shortlist_context.get("gate_profile") or {})
-                prompt = _build_ai_prompt_v4(
+                shortlist_context, prompt = _get_ai_prompt_context(
                     data,
                     region,
-                    shortlist_context,
-                    history_window=history_window,
-                    candidate_count=candidate_count,
+                    tuned,
+                    history_window,
+                    candidate_count,
                 )
+                gate_profile = dict(shortlist_context.get("gate_profile") or {})
                 full_text = ""
+                stream_key = "stream:" + _build_ai_prediction_cache_key(
+                    region,
+                    data,
+                    tuned,
+                    ai_config,
+                    prompt,
+                    temperature,
+                    1,
+                    candidate_count,
+                )
                 try:
-                    for chunk in _iter_ai_stream(ai_config, prompt, temperature=temperature):
+                    broadcast, is_leader = _attach_ai_stream(stream_key, ai_config, prompt, temperature=temperature)
+                    if not is_leader:
+                        yield _sse_event({
+                            "type": "status",
+                            "stage": "attach",
+                            "message": "同期 AI 预测正在生成，已接入同一路输出..."
+                        })
+                    for chunk in broadcast.iter_chunks(idle_timeout=_AI_HTTP_READ_TIMEOUT_SECONDS):
                         full_text += chunk
                         yield _sse_event({
                             "type": "content",
@@ -13790,7 +16539,11 @@ def unified_predict_api():
         if user_id and is_active and _personalized_predictions_enabled():
             variation_key = f"user:{user_id}|region:{region}|period:{current_period}|strategy:{resolved_strategy}"
         try:
-            result = get_local_recommendations(resolved_strategy, data, region, variation_key=variation_key)
+            result = None
+            if variation_key is None:
+                result = _load_period_prediction(region, current_period, resolved_strategy, data)
+            if result is None:
+                result = get_local_recommendations(resolved_strategy, data, region, variation_key=variation_key)
             if user_id and is_active:
                 result = _ensure_period_unique_special(
                     result,
@@ -13901,6 +16654,13 @@ def _run_draw_postprocess_for_region(region, current_year, source="manual-postpr
                 _log_draw_update("未获取到可用于自动预测的数据", source=source, region=region)
                 return
 
+            markov_started_at = time.time()
+            refresh_markov_state(region, prediction_data)
+            _log_draw_update(f"马尔可夫状态已推进 elapsed={round(time.time() - markov_started_at, 2)}s", source=source, region=region)
+            precompute_started_at = time.time()
+            precomputed = precompute_period_predictions(region, prediction_data)
+            precompute_elapsed = round(time.time() - precompute_started_at, 2)
+            _log_draw_update(f"下一期策略结果已预计算 count={precomputed} elapsed={precompute_elapsed}s", source=source, region=region)
             _log_draw_update(f"开始生成自动预测 draw_count={len(prediction_data)}", source=source, region=region)
             generate_auto_predictions(prediction_data, region)
             _log_draw_update("自动预测已完成", source=source, region=region)
@@ -13909,6 +16669,10 @@ def _run_draw_postprocess_for_region(region, current_year, source="manual-postpr
             update_strategy_configs(region, strategies=POSTPROCESS_TUNING_STRATEGIES)
             tuning_elapsed = round(time.time() - tuning_started_at, 2)
             _log_draw_update(f"本地策略学习参数已刷新 elapsed={tuning_elapsed}s", source=source, region=region)
+            # 调参会改变配置指纹，按新参数补齐预计算结果（未变化的策略会直接跳过）。
+            precomputed = precompute_period_predictions(region, prediction_data)
+            if precomputed:
+                _log_draw_update(f"调参后已补充预计算 count={precomputed}", source=source, region=region)
             _log_draw_update("开始刷新回测快照", source=source, region=region)
             backtest_started_at = time.time()
             refresh_auto_backtest_snapshot(
@@ -14021,22 +16785,30 @@ def update_data_api():
         }), 500
 
 @app.route('/api/number_frequency')
+@_conditional_draw_response
 def number_frequency_api():
     region, year = request.args.get('region', 'hk'), request.args.get('year', str(datetime.now().year))
-    data, _ = _get_prediction_data(region, year)
-    return jsonify(analyze_special_number_frequency(data))
+    return jsonify(_get_draw_statistics_snapshot(region, year)["number_frequency"])
 
 @app.route('/api/special_zodiac_frequency')
+@_conditional_draw_response
 def special_zodiac_frequency_api():
     region, year = request.args.get('region', 'hk'), request.args.get('year', str(datetime.now().year))
-    data, prediction_zodiac_year = _get_prediction_data(region, year)
-    return jsonify(analyze_special_zodiac_frequency(data, region, prediction_zodiac_year))
+    return jsonify(_get_draw_statistics_snapshot(region, year)["zodiac_frequency"])
 
 @app.route('/api/special_color_frequency')
+@_conditional_draw_response
 def special_color_frequency_api():
     region, year = request.args.get('region', 'hk'), request.args.get('year', str(datetime.now().year))
-    data, _ = _get_prediction_data(region, year)
-    return jsonify(analyze_special_color_frequency(data, region))
+    return jsonify(_get_draw_statistics_snapshot(region, year)["color_frequency"])
+
+
+@app.route('/api/stats')
+@_conditional_draw_response
+def draw_statistics_api():
+    """特码号码、生肖、波色、单双统计合并返回，免去分别请求三个频率接口。"""
+    region, year = request.args.get('region', 'hk'), request.args.get('year', str(datetime.now().year))
+    return jsonify(_get_draw_statistics_snapshot(region, year))
 
 @app.route('/api/get_zodiacs')
 def get_zodiacs_api():
@@ -14080,8 +16852,254 @@ def get_zodiacs_api():
         'special_zodiac': special_zodiac
     })
 
+_DRAW_SEARCH_DEFAULT_PAGE_SIZE = 50
+_DRAW_SEARCH_MAX_PAGE_SIZE = 200
+_DRAW_SEARCH_COLORS = {'red': 'red', 'blue': 'blue', 'green': 'green', '红': 'red', '蓝': 'blue', '绿': 'green'}
+_DRAW_SEARCH_PARITIES = {'odd': 'odd', 'even': 'even', '单': 'odd', '双': 'even'}
+_DRAW_SEARCH_ZODIACS = {**{zodiac: zodiac for zodiac in ZODIAC_TRAD_TO_SIMP.values()}, **ZODIAC_TRAD_TO_SIMP}
+
+
+def _split_search_values(raw):
+    return [item.strip() for item in str(raw or '').replace('，', ',').split(',') if item.strip()]
+
+
+def _parse_search_numbers(raw, label):
+    numbers = []
+    for item in _split_search_values(raw):
+        if not item.isdigit() or not 1 <= int(item) <= 49:
+            raise ValueError(f"{label}必须是1-49之间的号码")
+        numbers.append(int(item))
+    return numbers
+
+
+def _parse_search_date(raw, label):
+    value = str(raw or '').strip()
+    if not value:
+        return ''
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"{label}格式应为YYYY-MM-DD")
+
+
+def _parse_draw_search_criteria(args):
+    """解析开奖检索条件；取值非法时抛出 ValueError。"""
+    region = str(args.get('region') or 'hk').strip().lower()
+    if region not in ('hk', 'macau'):
+        raise ValueError("region 无效")
+
+    years = []
+    for item in _split_search_values(args.get('years') or args.get('year')):
+        if item == 'all':
+            continue
+        if len(item) != 4 or not item.isdigit():
+            raise ValueError("年份格式应为YYYY")
+        years.append(int(item))
+
+    zodiacs = []
+    for item in _split_search_values(args.get('zodiac')):
+        for char in item:
+            zodiac = _DRAW_SEARCH_ZODIACS.get(char)
+            if not zodiac:
+                raise ValueError(f"未知生肖: {char}")
+            if zodiac not in zodiacs:
+                zodiacs.append(zodiac)
+
+    colors = []
+    for item in _split_search_values(args.get('color')):
+        color = _DRAW_SEARCH_COLORS.get(item.lower().rstrip('波'))
+        if not color:
+            raise ValueError(f"未知波色: {item}")
+        colors.append(color)
+
+    parities = []
+    for item in _split_search_values(args.get('parity')):
+        parity = _DRAW_SEARCH_PARITIES.get(item.lower())
+        if not parity:
+            raise ValueError(f"未知单双: {item}")
+        parities.append(parity)
+
+    return {
+        'region': region,
+        'years': sorted(set(years)),
+        'special': _parse_search_numbers(args.get('special'), '特码'),
+        'numbers': _parse_search_numbers(args.get('number'), '号码'),
+        'zodiacs': zodiacs,
+        'colors': sorted(set(colors)),
+        'parities': sorted(set(parities)),
+        'start_date': _parse_search_date(args.get('start_date'), '开始日期'),
+        'end_date': _parse_search_date(args.get('end_date'), '结束日期'),
+        'start_period': str(args.get('start_period') or '').strip()[:20],
+        'end_period': str(args.get('end_period') or '').strip()[:20],
+    }
+
+
+def _draw_number_variants(numbers):
+    # 库里号码一般补零（"07"），个别来源不补零，两种写法都匹配
+    variants = []
+    for number in numbers:
+        for text in (f"{number:02d}", str(number)):
+            if text not in variants:
+                variants.append(text)
+    return variants
+
+
+def _get_cached_earliest_draw_date(region):
+    """地区最早一期的开奖日期，按最新开奖标记缓存，没有开奖记录时返回 None。"""
+    normalized_region = str(region or "").strip().lower()
+    marker = _get_cached_latest_draw_marker(normalized_region)
+    with _latest_draw_marker_cache_lock:
+        cached = _earliest_draw_date_cache.get(normalized_region)
+    if cached is not None and cached["marker"] == marker:
+        _earliest_draw_date_cache_stats.hit()
+        return cached["draw_date"]
+    _earliest_draw_date_cache_stats.miss()
+    draw_date = (
+        db.session.query(db.func.min(LotteryDraw.draw_date))
+        .filter(LotteryDraw.region == normalized_region)
+        .scalar()
+    )
+    with _latest_draw_marker_cache_lock:
+        _earliest_draw_date_cache[normalized_region] = {"marker": marker, "draw_date": draw_date}
+    return draw_date
+
+
+def _hk_special_zodiac_year_range(criteria):
+    """香港生肖检索要覆盖的农历年区间，由年份、日期条件推出，上限是当前生肖年。
+
+    公历某年的一二月可能还属于上一个生肖年，所以按年份检索时从最早年份的前一年算起。
+    没有年份和日期下限时从最早一期开奖所在的生肖年算起；没有设置的年份按默认规则换算。
+    """
+    from models import ZodiacSetting
+
+    current_year = ZodiacSetting.get_zodiac_year_for_date(datetime.now())
+    lower_bounds = []
+    upper_bounds = []
+    if criteria['years']:
+        lower_bounds.append(criteria['years'][0] - 1)
+        upper_bounds.append(criteria['years'][-1])
+    if criteria['start_date']:
+        lower_bounds.append(ZodiacSetting.get_zodiac_year_for_date(criteria['start_date']))
+    if criteria['end_date']:
+        upper_bounds.append(ZodiacSetting.get_zodiac_year_for_date(criteria['end_date']))
+    if not lower_bounds:
+        first_date = _get_cached_earliest_draw_date(criteria['region'])
+        if not first_date:
+            return current_year + 1, current_year
+        lower_bounds.append(ZodiacSetting.get_zodiac_year_for_date(first_date))
+    upper_bounds.append(current_year)
+    return max(lower_bounds), min(upper_bounds)
+
+
+def _hk_special_zodiac_filter(criteria):
+    """香港特码生肖按所在农历年的生肖设置换算：每个生肖年一段日期区间 + 对应号码集合。"""
+    from models import ZodiacSetting
+
+    zodiacs = criteria['zodiacs']
+    first_year, last_year = _hk_special_zodiac_year_range(criteria)
+    clauses = []
+    for zodiac_year in range(first_year, last_year + 1):
+        mapping = ZodiacSetting.get_all_settings_for_year(zodiac_year) or {}
+        numbers = sorted(number for number, zodiac in mapping.items() if zodiac in zodiacs)
+        if not numbers:
+            continue
+        clauses.append(db.and_(
+            LotteryDraw.draw_date >= ZodiacSetting.get_lunar_new_year_date(zodiac_year).strftime('%Y-%m-%d'),
+            LotteryDraw.draw_date < ZodiacSetting.get_lunar_new_year_date(zodiac_year + 1).strftime('%Y-%m-%d'),
+            LotteryDraw.special_number.in_(_draw_number_variants(numbers)),
+        ))
+    return db.or_(*clauses) if clauses else db.false()
+
+
+def _build_draw_search_query(criteria):
+    """把检索条件下推成一条 SQL；特码、波色、单双走 (region, 列, draw_date) 复合索引。
+
+    任意号码（number）是对拼接后的号码串做 LIKE '%,07,%' 匹配，用不上索引，
+    只能在 region 和其余条件收窄后的范围内逐行扫描；不带其他条件时相当于扫完该地区全部开奖。
+    """
+    region = criteria['region']
+    query = LotteryDraw.query.filter(LotteryDraw.region == region)
+    if criteria['years']:
+        query = query.filter(db.or_(*[
+            db.and_(LotteryDraw.draw_date >= f"{year}-01-01", LotteryDraw.draw_date < f"{year + 1}-01-01")
+            for year in criteria['years']
+        ]))
+    if criteria['start_date']:
+        query = query.filter(LotteryDraw.draw_date >= criteria['start_date'])
+    if criteria['end_date']:
+        query = query.filter(LotteryDraw.draw_date <= criteria['end_date'])
+    if criteria['start_period']:
+        query = query.filter(LotteryDraw.draw_id >= criteria['start_period'])
+    if criteria['end_period']:
+        query = query.filter(LotteryDraw.draw_id <= criteria['end_period'])
+    if criteria['special']:
+        query = query.filter(LotteryDraw.special_number.in_(_draw_number_variants(criteria['special'])))
+    if criteria['colors']:
+        query = query.filter(LotteryDraw.special_color.in_(criteria['colors']))
+    if criteria['parities']:
+        query = query.filter(LotteryDraw.special_parity.in_(criteria['parities']))
+    if criteria['numbers']:
+        all_numbers = db.literal(',') + LotteryDraw.normal_numbers + db.literal(',') + LotteryDraw.special_number + db.literal(',')
+        query = query.filter(db.or_(*[
+            all_numbers.like(f"%,{variant},%")
+            for variant in _draw_number_variants(criteria['numbers'])
+        ]))
+    if criteria['zodiacs']:
+        if region == 'hk':
+            query = query.filter(_hk_special_zodiac_filter(criteria))
+        else:
+            query = query.filter(LotteryDraw.special_zodiac.in_(criteria['zodiacs']))
+    return query.order_by(*[column.desc() for column in _DRAW_KEYSET_COLUMNS])
+
+
+def _iter_draw_search_records(region, rows):
+    zodiac_generation = _get_cached_zodiac_settings_generation() if region == 'hk' else None
+    zodiac_map_cache = {}
+    for row in rows:
+        record = row.to_dict()
+        if region == 'hk':
+            record.update(_hk_draw_display_for_row(row, record, zodiac_generation, zodiac_map_cache))
+        yield record
+
+
+@app.route('/api/draws/search')
+def draw_search_api():
+    """多条件检索开奖记录。
+
+    条件：special / number（逗号分隔号码）、zodiac、color、parity、start_date / end_date、
+    start_period / end_period、years（逗号分隔，可跨年）；按开奖日期倒序分页，
+    用 cursor 续取下一页。每页的记录逐条写出：{"items": [...], "next_cursor": ...}。
+    """
+    try:
+        criteria = _parse_draw_search_criteria(request.args)
+        page_size = int(request.args.get('pageSize') or _DRAW_SEARCH_DEFAULT_PAGE_SIZE)
+        page_size = max(1, min(page_size, _DRAW_SEARCH_MAX_PAGE_SIZE))
+        cursor = (request.args.get('cursor') or '').strip()
+        cursor_values = decode_cursor(cursor, len(_DRAW_KEYSET_COLUMNS)) if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    query = _build_draw_search_query(criteria)
+    if cursor_values is not None:
+        query = query.filter(keyset_before(_DRAW_KEYSET_COLUMNS, cursor_values))
+    # 查询在视图里跑完再写出：生成器运行时请求的 teardown 已经执行过，
+    # 在里面再查库会另借一个连接且不会归还
+    records = list(_iter_draw_search_records(criteria['region'], query.limit(page_size).all()))
+    next_cursor = None
+    if len(records) >= page_size:
+        next_cursor = encode_cursor(records[-1].get("date"), records[-1].get("id"))
+
+    def generate():
+        yield '{"items":'
+        yield from iter_json_array(records, dumps=app.json.dumps)
+        yield ',"next_cursor":' + app.json.dumps(next_cursor) + '}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
 @app.route('/api/search_draws')
 def search_draws_api():
+    """旧版单关键字检索：纯数字按特码精确匹配，否则按特码生肖匹配，只查一个年份。"""
     region = request.args.get('region', 'hk')
     year = request.args.get('year', str(datetime.now().year))
     term = request.args.get('term', '').strip().lower()
@@ -14090,18 +17108,19 @@ def search_draws_api():
     if not term:
         return jsonify([])
 
-    data, results = get_yearly_data(region, year), []
-    number_to_zodiac = _get_number_to_zodiac_map(year) if region == 'hk' else {}
-    for record in data:
-        if region == 'hk':
-            sno_zodiac_display = number_to_zodiac.get(str(record.get('sno', '')), record.get('sno_zodiac', ''))
-        else:
-            sno_zodiac_display = record.get('sno_zodiac', '')
-        if term == record.get('sno', '') or term in sno_zodiac_display.lower():
-            if 'details_breakdown' not in record and region == 'hk':
-                record['sno_zodiac'] = sno_zodiac_display
-            results.append(record)
-    return jsonify(results)
+    args = {'region': region, 'years': year}
+    if term.isdigit():
+        args['special'] = term
+    else:
+        zodiacs = [char for char in term if char in _DRAW_SEARCH_ZODIACS]
+        if not zodiacs:
+            return jsonify([])
+        args['zodiac'] = ''.join(zodiacs)
+    try:
+        criteria = _parse_draw_search_criteria(args)
+    except ValueError:
+        return jsonify([])
+    return jsonify(list(_iter_draw_search_records(criteria['region'], _build_draw_search_query(criteria).all())))
 
 @app.route('/chat')
 def chat_page():
@@ -14165,6 +17184,237 @@ def chat_page():
                            macau_results=macau_latest_10,
                            ball_colors=json.dumps(ball_colors))
 
+_AI_CHAT_SYSTEM_PROMPT = "你是一个精通香港和澳门六合彩数据分析的AI助手，知识渊博，回答友好。请根据用户的提问，提供相关的历史知识、数据规律或普遍性建议。不要提供具体的投资建议。"
+
+
+def _begin_ai_chat_metric():
+    with _ai_chat_metrics_lock:
+        active = int(_ai_chat_metrics.get("active", 0) or 0) + 1
+        _ai_chat_metrics["active"] = active
+        _ai_chat_metrics["max_active"] = max(int(_ai_chat_metrics.get("max_active", 0) or 0), active)
+
+
+def _finish_ai_chat_metric(mode, started_at, first_chunk_at=None, chunks=0, error=None, disconnected=False):
+    """记录一次聊天占用工作线程的时长和首字节时间（流式为首个增量，阻塞式为整段回复）。"""
+    finished_at = time.perf_counter()
+    occupancy_ms = round((finished_at - started_at) * 1000.0, 1)
+    ttfb_ms = round(((first_chunk_at or finished_at) - started_at) * 1000.0, 1)
+    with _ai_chat_metrics_lock:
+        _ai_chat_metrics["active"] = max(0, int(_ai_chat_metrics.get("active", 0) or 0) - 1)
+        modes = _ai_chat_metrics.setdefault("modes", {})
+        item = modes.setdefault(mode, {
+            "requests": 0,
+            "errors": 0,
+            "disconnects": 0,
+            "ttfb_ms_total": 0.0,
+            "ttfb_ms_max": 0.0,
+            "occupancy_ms_total": 0.0,
+            "occupancy_ms_max": 0.0,
+        })
+        item["requests"] += 1
+        if error is not None:
+            item["errors"] += 1
+        if disconnected:
+            item["disconnects"] += 1
+        item["ttfb_ms_total"] += ttfb_ms
+        item["ttfb_ms_max"] = max(item["ttfb_ms_max"], ttfb_ms)
+        item["occupancy_ms_total"] += occupancy_ms
+        item["occupancy_ms_max"] = max(item["occupancy_ms_max"], occupancy_ms)
+        _ai_chat_recent_calls.appendleft({
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "mode": mode,
+            "ttfb_ms": ttfb_ms,
+            "occupancy_ms": occupancy_ms,
+            "chunks": int(chunks or 0),
+            "error": str(error)[:200] if error is not None else "",
+            "disconnected": bool(disconnected),
+        })
+
+
+def get_ai_chat_metrics():
+    with _ai_chat_metrics_lock:
+        modes = {}
+        for mode, item in dict(_ai_chat_metrics.get("modes") or {}).items():
+            requests_count = max(1, int(item.get("requests", 0) or 0))
+            modes[mode] = {
+                **item,
+                "ttfb_ms_total": round(item["ttfb_ms_total"], 1),
+                "occupancy_ms_total": round(item["occupancy_ms_total"], 1),
+                "avg_ttfb_ms": round(item["ttfb_ms_total"] / requests_count, 1),
+                "avg_occupancy_ms": round(item["occupancy_ms_total"] / requests_count, 1),
+            }
+        return {
+            "active": int(_ai_chat_metrics.get("active", 0) or 0),
+            "max_active": int(_ai_chat_metrics.get("max_active", 0) or 0),
+            "modes": modes,
+            "recent_calls": list(_ai_chat_recent_calls),
+        }
+
+
+def _ai_metric_samples():
+    samples = []
+    for host, item in get_ai_http_metrics()["hosts"].items():
+        labels = {"host": host}
+        samples.extend([
+            ("ai_http_requests_total", "counter", labels, item["requests"]),
+            ("ai_http_errors_total", "counter", labels, item["errors"]),
+            ("ai_http_retries_total", "counter", labels, item["retries"]),
+            ("ai_http_reused_connections_total", "counter", labels, item["reused_connections"]),
+            ("ai_http_new_connections_total", "counter", labels, item["new_connections"]),
+            ("ai_http_seconds_total", "counter", labels, round(item["total_ms"] / 1000.0, 6)),
+            ("ai_http_seconds_max", "max", labels, round(item["max_ms"] / 1000.0, 6)),
+        ])
+    chat_metrics = get_ai_chat_metrics()
+    samples.append(("ai_chat_active", "gauge", {}, chat_metrics["active"]))
+    samples.append(("ai_chat_max_active", "max", {}, chat_metrics["max_active"]))
+    for mode, item in chat_metrics["modes"].items():
+        labels = {"mode": mode}
+        samples.extend([
+            ("ai_chat_requests_total", "counter", labels, item["requests"]),
+            ("ai_chat_errors_total", "counter", labels, item["errors"]),
+            ("ai_chat_disconnects_total", "counter", labels, item["disconnects"]),
+            ("ai_chat_ttfb_seconds_total", "counter", labels, round(item["ttfb_ms_total"] / 1000.0, 6)),
+            ("ai_chat_ttfb_seconds_max", "max", labels, round(item["ttfb_ms_max"] / 1000.0, 6)),
+            ("ai_chat_occupancy_seconds_total", "counter", labels, round(item["occupancy_ms_total"] / 1000.0, 6)),
+        ])
+    return samples
+
+
+request_metrics.add_collector(_ai_metric_samples)
+
+
+def _prediction_stage_metric_samples():
+    samples = []
+    for row in stage_stats.rows():
+        labels = {"stage": row["stage"]}
+        samples.extend([
+            ("prediction_stage_calls_total", "counter", labels, row["calls"]),
+            ("prediction_stage_seconds_total", "counter", labels, row["total_seconds"]),
+            ("prediction_stage_seconds_max", "max", labels, round(row["max_ms"] / 1000.0, 6)),
+        ])
+    return samples
+
+
+request_metrics.add_collector(_prediction_stage_metric_samples)
+request_metrics.add_collector(cache_registry.metric_samples)
+
+
+_CACHE_FLUSH_LOG_KEY = "cache_flush_log"
+_CACHE_FLUSH_LOG_MAX_ITEMS = 20
+# 其他 worker 最迟这么久之后跟着执行后台发起的清缓存。
+_CACHE_FLUSH_POLL_SECONDS = 5
+_cache_flush_poll_lock = threading.Lock()
+_cache_flush_poll_state = {"checked_at": 0.0, "seq": None}
+
+
+def _parse_cache_flush_log(raw):
+    try:
+        entries = json.loads(raw or "[]")
+    except (TypeError, ValueError):
+        return []
+    return [item for item in entries if isinstance(item, dict)] if isinstance(entries, list) else []
+
+
+def _load_cache_flush_log():
+    return _parse_cache_flush_log(SystemConfig.get_config(_CACHE_FLUSH_LOG_KEY, "[]"))
+
+
+def _append_cache_flush_log(name, region, max_attempts=10):
+    """追加一条清缓存记录并返回分到的 seq。
+
+    只有记录行仍是本次读到的内容时才覆盖，否则重读重试，
+    两个管理员同时清缓存也不会算出同一个 seq、互相覆盖掉对方的记录。
+    """
+    for attempt in range(max(1, int(max_attempts))):
+        if attempt:
+            time.sleep(random.uniform(0.01, 0.05) * attempt)
+        current = db.session.query(SystemConfig.id, SystemConfig.value).filter_by(key=_CACHE_FLUSH_LOG_KEY).first()
+        entries = _parse_cache_flush_log(current.value if current else "[]")
+        seq = max((int(item.get("seq") or 0) for item in entries), default=0) + 1
+        entries.append({"seq": seq, "cache": name or "", "region": region or "", "at": int(time.time())})
+        payload = json.dumps(entries[-_CACHE_FLUSH_LOG_MAX_ITEMS:], ensure_ascii=False)
+        try:
+            if current is None:
+                db.session.add(SystemConfig(key=_CACHE_FLUSH_LOG_KEY, value=payload, description="后台清缓存记录，各 worker 据此同步清空"))
+                updated = 1
+            else:
+                updated = (
+                    SystemConfig.query
+                    .filter(SystemConfig.id == current.id, SystemConfig.value == current.value)
+                    .update({"value": payload, "updated_at": datetime.now()}, synchronize_session=False)
+                )
+            db.session.commit()
+        except IntegrityError:
+            # 另一个进程抢先插入了记录行，重读后再试。
+            db.session.rollback()
+            continue
+        if updated:
+            return seq
+    raise RuntimeError(f"清缓存记录并发写入冲突，已重试 {max_attempts} 次")
+
+
+def flush_caches_everywhere(name=None, region=None):
+    """本进程立即清空指定缓存，并记到 SystemConfig，其他 worker 下次请求时跟着清。
+
+    name 为空表示全部缓存，region 为空表示不分地区；返回本进程各缓存清掉的条目数。
+    未知缓存名抛 KeyError，按地区清不分地区的缓存抛 ValueError。
+    """
+    removed = cache_registry.flush(name, region)
+    seq = _append_cache_flush_log(name, region)
+    with _cache_flush_poll_lock:
+        # 前面还有没同步的记录时不前移，留给轮询一起补上（重复清一次无害）。
+        if _cache_flush_poll_state["seq"] in (None, seq - 1):
+            _cache_flush_poll_state["seq"] = seq
+    return removed
+
+
+@app.before_request
+def _apply_broadcast_cache_flushes():
+    if request.endpoint == "static":
+        return
+    now = time.time()
+    with _cache_flush_poll_lock:
+        if now - _cache_flush_poll_state["checked_at"] < _CACHE_FLUSH_POLL_SECONDS:
+            return
+        _cache_flush_poll_state["checked_at"] = now
+    try:
+        entries = _load_cache_flush_log()
+    except Exception as e:
+        db.session.rollback()
+        print(f"读取清缓存记录失败: {e}")
+        return
+    latest = max((int(item.get("seq") or 0) for item in entries), default=0)
+    with _cache_flush_poll_lock:
+        seen = _cache_flush_poll_state["seq"]
+        _cache_flush_poll_state["seq"] = latest if seen is None else max(seen, latest)
+    # 刚启动的 worker 缓存都是新建的，不用补执行启动前的记录。
+    if seen is None:
+        return
+    for item in sorted(entries, key=lambda entry: int(entry.get("seq") or 0)):
+        if int(item.get("seq") or 0) <= seen:
+            continue
+        try:
+            cache_registry.flush(item.get("cache") or None, item.get("region") or None)
+        except (KeyError, ValueError) as e:
+            print(f"同步清缓存失败 {item}: {e}")
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 抓取入口：带 Authorization: Bearer <METRICS_TOKEN> 或管理员登录态才能访问。"""
+    supplied = (request.headers.get("Authorization") or "").strip()
+    token_ok = bool(_METRICS_TOKEN) and hmac.compare_digest(supplied, f"Bearer {_METRICS_TOKEN}")
+    if not token_ok:
+        _, auth_error = _require_admin_session_json()
+        if auth_error:
+            return auth_error
+    return Response(
+        request_metrics.render_prometheus(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+        headers={"Cache-Control": "no-store"},
+    )
+
+
 @app.route('/api/chat', methods=['POST'])
 def handle_chat():
     _, auth_error = _require_active_session_json()
@@ -14172,24 +17422,72 @@ def handle_chat():
         return auth_error
 
     ai_config = get_ai_config()
-    if not ai_config['api_key'] or "你的" in ai_config['api_key']:
+    if not _ai_completion_available(ai_config):
         return jsonify({"reply": "错误：管理员尚未配置AI API Key，无法使用聊天功能。"}), 400
-    user_message = (request.get_json(silent=True) or {}).get("message")
+    request_payload = request.get_json(silent=True) or {}
+    user_message = request_payload.get("message")
     if not user_message:
         return jsonify({"reply": "错误：未能获取到您发送的消息。"}), 400
-    system_prompt = "你是一个精通香港和澳门六合彩数据分析的AI助手，知识渊博，回答友好。请根据用户的提问，提供相关的历史知识、数据规律或普遍性建议。不要提供具体的投资建议。"
-    payload = {"model": ai_config['model'], "messages": [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_message}], "temperature": 0.7}
-    headers = {"Authorization": f"Bearer {ai_config['api_key']}", "Content-Type": "application/json"}
+    started_at = time.perf_counter()
+    stream_response = request.args.get('stream') == '1' or bool(request_payload.get("stream"))
+
+    if stream_response:
+        def generate_chat_stream():
+            first_chunk_at = None
+            chunks = 0
+            error = None
+            completed = False
+            reply = ""
+            try:
+                # 必须在生成器内计数：客户端在首次迭代前断开时生成器体和 finally 都不会执行。
+                _begin_ai_chat_metric()
+                for chunk in _iter_ai_stream(ai_config, user_message, temperature=0.7, system_prompt=_AI_CHAT_SYSTEM_PROMPT):
+                    if first_chunk_at is None:
+                        first_chunk_at = time.perf_counter()
+                    chunks += 1
+                    reply += chunk
+                    yield f"data: {json.dumps({'type': 'content', 'content': chunk}, ensure_ascii=False)}\n\n"
+                completed = True
+                yield f"data: {json.dumps({'type': 'done', 'reply': reply}, ensure_ascii=False)}\n\n"
+            except Exception as e:
+                error = e
+                completed = True
+                print(f"Error streaming AI chat API: {e}")
+                yield f"data: {json.dumps({'type': 'error', 'error': '抱歉，调用AI时遇到错误，请稍后再试。'}, ensure_ascii=False)}\n\n"
+            finally:
+                # 客户端中途断开时生成器被关闭，同样计入本次占用时长。
+                _finish_ai_chat_metric(
+                    "stream",
+                    started_at,
+                    first_chunk_at=first_chunk_at,
+                    chunks=chunks,
+                    error=error,
+                    disconnected=not completed,
+                )
+
+        return Response(
+            stream_with_context(generate_chat_stream()),
+            mimetype='text/event-stream',
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    _begin_ai_chat_metric()
+    error = None
     try:
-        response = requests.post(ai_config['api_url'], json=payload, headers=headers, timeout=60)
-        response.raise_for_status()
-        if not response.encoding or response.encoding.lower() in ("iso-8859-1", "latin-1"):
-            response.encoding = "utf-8"
-        ai_reply = response.json()['choices'][0]['message']['content']
+        ai_reply = _call_ai_completion(
+            ai_config,
+            user_message,
+            temperature=0.7,
+            deadline=started_at + _AI_REQUEST_DEADLINE_SECONDS,
+            system_prompt=_AI_CHAT_SYSTEM_PROMPT,
+        )
         return jsonify({"reply": ai_reply})
     except Exception as e:
+        error = e
         print(f"Error calling AI chat API: {e}")
         return jsonify({"reply": f"抱歉，调用AI时遇到错误，请稍后再试。"}), 500
+    finally:
+        _finish_ai_chat_metric("blocking", started_at, error=error)
 
 def send_winning_notification_email(user, prediction, region):
     """发送预测命中通知邮件"""
@@ -14613,6 +17911,8 @@ def cleanup_expired_data_job():
     with app.app_context():
         try:
             deleted_counts = cleanup_expired_data()
+            if deleted_counts.get("prediction_records"):
+                invalidate_prediction_settlement_state()
             if any(deleted_counts.values()):
                 print(f"数据保留清理完成：{deleted_counts}")
         except Exception as e:
@@ -14736,6 +18036,19 @@ try:
 except Exception as e:
     print(f"离线回测快照预热失败: {e}")
 
+# 旧库升级后补齐开奖的特码属性和香港展示字段；多进程启动时排队执行，后面的进程只会看到已回填的记录。
+with _startup_schema_lock():
+    try:
+        with app.app_context():
+            _backfilled_draw_attributes = backfill_draw_special_attributes()
+            _backfilled_draw_displays = refresh_hk_draw_displays(only_stale=True)
+        if _backfilled_draw_attributes and _should_log_startup():
+            print(f"已回填{_backfilled_draw_attributes}条开奖特码波色/单双")
+        if _backfilled_draw_displays and _should_log_startup():
+            print(f"已回填{_backfilled_draw_displays}条香港开奖展示字段")
+    except Exception as e:
+        print(f"回填开奖物化字段失败: {e}")
+
 if __name__ == '__main__':
     # 初始化数据库
     init_database()
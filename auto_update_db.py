@@ -150,6 +150,22 @@ def _update_mysql_database():
                     connection.execute(text("ALTER TABLE prediction_record ADD COLUMN prediction_metadata MEDIUMTEXT"))
                     changes.append("Added prediction_record.prediction_metadata")
 
+            if _mysql_table_exists(connection, "lottery_draws"):
+                if not _mysql_column_exists(connection, "lottery_draws", "display_breakdown"):
+                    connection.execute(text("ALTER TABLE lottery_draws ADD COLUMN display_breakdown MEDIUMTEXT"))
+                    changes.append("Added lottery_draws.display_breakdown")
+                for column_name in ("special_color", "special_parity"):
+                    if not _mysql_column_exists(connection, "lottery_draws", column_name):
+                        connection.execute(text(f"ALTER TABLE lottery_draws ADD COLUMN {column_name} VARCHAR(10)"))
+                        changes.append(f"Added lottery_draws.{column_name}")
+                for column_name in ("special_number", "special_color", "special_parity"):
+                    index_name = f"ix_lottery_draws_region_{column_name}_draw_date"
+                    if not _mysql_index_exists(connection, "lottery_draws", index_name):
+                        connection.execute(text(
+                            f"CREATE INDEX {index_name} ON lottery_draws (region, {column_name}, draw_date)"
+                        ))
+                        changes.append(f"Created {index_name}")
+
             if _mysql_table_exists(connection, "manual_bet_records"):
                 if not _mysql_column_exists(connection, "manual_bet_records", "bettor_name"):
                     connection.execute(text("ALTER TABLE manual_bet_records ADD COLUMN bettor_name VARCHAR(50)"))
@@ -183,6 +199,14 @@ def _update_mysql_database():
                 ))
                 changes.append("Created ix_macau_collected_created_at")
 
+            if _mysql_table_exists(connection, "manual_bet_records") and not _mysql_index_exists(
+                connection, "manual_bet_records", "ix_manual_bet_records_created_at"
+            ):
+                connection.execute(text(
+                    "CREATE INDEX ix_manual_bet_records_created_at ON manual_bet_records (created_at)"
+                ))
+                changes.append("Created ix_manual_bet_records_created_at")
+
         if changes:
             print("MySQL/MariaDB database schema updated:")
             for change in changes:
@@ -379,6 +403,9 @@ def update_database():
                 special_zodiac VARCHAR(10),
                 raw_zodiac VARCHAR(100),
                 raw_wave VARCHAR(100),
+                special_color VARCHAR(10),
+                special_parity VARCHAR(10),
+                display_breakdown TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 UNIQUE(region, draw_id)
@@ -387,6 +414,26 @@ def update_database():
             print("✓ lottery_draws 表创建成功")
         else:
             print("lottery_draws 表已存在")
+
+        if not check_column_exists(cursor, 'lottery_draws', 'display_breakdown'):
+            print("Adding lottery_draws.display_breakdown column...")
+            cursor.execute('''
+                ALTER TABLE lottery_draws ADD COLUMN display_breakdown TEXT
+            ''')
+            print("lottery_draws.display_breakdown column added")
+        else:
+            print("lottery_draws.display_breakdown column already exists")
+
+        for column_name in ('special_color', 'special_parity'):
+            if not check_column_exists(cursor, 'lottery_draws', column_name):
+                print(f"Adding lottery_draws.{column_name} column...")
+                cursor.execute(f"ALTER TABLE lottery_draws ADD COLUMN {column_name} VARCHAR(10)")
+                print(f"lottery_draws.{column_name} column added")
+        for column_name in ('special_number', 'special_color', 'special_parity'):
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS ix_lottery_draws_region_{column_name}_draw_date "
+                f"ON lottery_draws (region, {column_name}, draw_date)"
+            )
             
         if not check_table_exists(cursor, 'macau_collected_data'):
             print("Creating macau_collected_data table...")
@@ -492,6 +539,65 @@ def update_database():
         else:
             print("backtest_runs table already exists")
 
+        if not check_table_exists(cursor, 'period_predictions'):
+            print("Creating period_predictions table...")
+            cursor.execute('''
+            CREATE TABLE period_predictions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                region VARCHAR(10) NOT NULL,
+                period VARCHAR(20) NOT NULL,
+                strategy VARCHAR(20) NOT NULL,
+                config_hash VARCHAR(32) NOT NULL,
+                payload TEXT,
+                elapsed_ms INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                CONSTRAINT uq_period_predictions_key UNIQUE (region, period, strategy, config_hash)
+            )
+            ''')
+            cursor.execute('''
+                CREATE INDEX ix_period_predictions_region_period
+                ON period_predictions (region, period)
+            ''')
+            print("period_predictions table created")
+        else:
+            print("period_predictions table already exists")
+
+        if not check_table_exists(cursor, 'markov_states'):
+            print("Creating markov_states table...")
+            cursor.execute('''
+            CREATE TABLE markov_states (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                region VARCHAR(10) NOT NULL,
+                config_hash VARCHAR(32) NOT NULL,
+                period VARCHAR(20),
+                payload TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                CONSTRAINT uq_markov_states_key UNIQUE (region, config_hash)
+            )
+            ''')
+            print("markov_states table created")
+        else:
+            print("markov_states table already exists")
+
+        if not check_table_exists(cursor, 'ai_prediction_cache'):
+            print("Creating ai_prediction_cache table...")
+            cursor.execute('''
+            CREATE TABLE ai_prediction_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cache_key VARCHAR(32) NOT NULL UNIQUE,
+                region VARCHAR(10) NOT NULL,
+                latest_period VARCHAR(20),
+                payload TEXT,
+                hit_count INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_hit_at TIMESTAMP
+            )
+            ''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS ix_ai_prediction_cache_region_period ON ai_prediction_cache (region, latest_period)")
+            print("ai_prediction_cache table created")
+        else:
+            print("ai_prediction_cache table already exists")
+
         if not check_table_exists(cursor, 'user_notification'):
             print("Creating user_notification table...")
             cursor.execute('''
@@ -612,6 +718,7 @@ def update_database():
                     ALTER TABLE manual_bet_records ADD COLUMN bettor_name VARCHAR(50)
                 ''')
                 print("manual_bet_records.bettor_name 字段添加成功")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_manual_bet_records_created_at ON manual_bet_records (created_at)")
         
         # 验证更新结果
         print("\n验证更新结果:")
@@ -0,0 +1,228 @@
+"""Registry of the in-process caches so they can be inspected and flushed in one place.
+
+Each cache registers once at import time with callables that expose its entries and
+clear it, and gets back a ``CacheStats`` that the cache's own get/set code bumps on
+hits, misses and evictions. The registry never owns the data: entry counts and sizes
+are read from the live containers when someone asks, so registering costs nothing on
+the hot path beyond the counter updates.
+"""
+
+import sys
+import threading
+import time
+import types
+from collections import Counter, deque
+
+# Upper bound on objects visited per cache when estimating memory, so a huge cache
+# cannot stall the admin page; estimates that hit it are flagged as truncated.
+DEFAULT_SIZE_BUDGET = 200000
+
+
+class CacheStats:
+    """Hit/miss/eviction counters for one cache."""
+
+    __slots__ = ('hits', 'misses', 'evictions', 'flushes', 'last_flush_at', '_lock')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.last_flush_at = None
+        self._lock = threading.Lock()
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def evicted(self, count=1):
+        if count:
+            with self._lock:
+                self.evictions += int(count)
+
+    def _flushed(self, now):
+        with self._lock:
+            self.flushes += 1
+            self.last_flush_at = now
+
+
+class _RegisteredCache:
+    __slots__ = ('name', 'label', 'items', 'clear', 'group_of', 'group_label', 'regional', 'stats')
+
+    def __init__(self, name, label, items, clear, group_of, group_label, regional):
+        self.name = name
+        self.label = label
+        self.items = items
+        self.clear = clear
+        self.group_of = group_of
+        self.group_label = group_label
+        self.regional = regional
+        self.stats = CacheStats()
+
+    def snapshot_items(self):
+        # The owning code mutates these dicts from other threads; retry if one
+        # changes size while we copy it.
+        for _ in range(3):
+            try:
+                return list(self.items())
+            except RuntimeError:
+                continue
+        return []
+
+
+class CacheRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._caches = {}
+
+    def register(self, name, label, items, clear, group_of=None, group_label='region', regional=False):
+        """Register a cache and return its ``CacheStats``.
+
+        ``items()`` returns the live ``(key, value)`` pairs, ``clear(region)`` empties
+        the cache (``region`` is None for everything; only ``regional`` caches are
+        ever asked to clear a single region). ``group_of(key, value)`` labels entries
+        for the breakdown shown next to the totals, ``group_label`` names that column.
+        Registering the same name again replaces the earlier entry (module reloads).
+        """
+        cache = _RegisteredCache(name, label, items, clear, group_of, group_label, regional)
+        with self._lock:
+            self._caches[name] = cache
+        return cache.stats
+
+    def names(self):
+        with self._lock:
+            return list(self._caches)
+
+    def _get(self, name):
+        with self._lock:
+            cache = self._caches.get(name)
+        if cache is None:
+            raise KeyError(name)
+        return cache
+
+    def _all(self):
+        with self._lock:
+            return list(self._caches.values())
+
+    def describe(self, name, include_bytes=True, size_budget=DEFAULT_SIZE_BUDGET):
+        cache = self._get(name)
+        items = cache.snapshot_items()
+        stats = cache.stats
+        lookups = stats.hits + stats.misses
+        groups = Counter()
+        if cache.group_of is not None:
+            for key, value in items:
+                try:
+                    group = cache.group_of(key, value)
+                except Exception:
+                    group = None
+                groups[str(group or '-')] += 1
+        row = {
+            'name': cache.name,
+            'label': cache.label,
+            'entries': len(items),
+            'hits': stats.hits,
+            'misses': stats.misses,
+            'hit_rate': round(stats.hits / lookups * 100, 1) if lookups else None,
+            'evictions': stats.evictions,
+            'flushes': stats.flushes,
+            'last_flush_at': stats.last_flush_at,
+            'regional': cache.regional,
+            'group_label': cache.group_label if cache.group_of is not None else None,
+            'groups': dict(sorted(groups.items())),
+        }
+        if include_bytes:
+            size, truncated = approximate_size((part for pair in items for part in pair), size_budget)
+            row['approx_bytes'] = size
+            row['bytes_truncated'] = truncated
+        return row
+
+    def rows(self, include_bytes=True, size_budget=DEFAULT_SIZE_BUDGET):
+        return [self.describe(cache.name, include_bytes, size_budget) for cache in self._all()]
+
+    def flush(self, name=None, region=None):
+        """Clear one cache or all of them, optionally only entries of ``region``.
+
+        Returns ``{cache_name: removed_entries}``. A region flush skips caches that are
+        not split by region, and flushing a named non-regional cache by region raises
+        ValueError.
+        """
+        region = str(region or '').strip().lower() or None
+        if name:
+            caches = [self._get(name)]
+            if region and not caches[0].regional:
+                raise ValueError(f'cache {name} is not split by region')
+        else:
+            caches = [cache for cache in self._all() if cache.regional or not region]
+        removed = {}
+        now = time.time()
+        for cache in caches:
+            before = len(cache.snapshot_items())
+            cache.clear(region)
+            removed[cache.name] = max(0, before - len(cache.snapshot_items()))
+            cache.stats._flushed(now)
+        return removed
+
+    def metric_samples(self):
+        """Counter/gauge samples in the ``RequestMetrics.add_collector`` format (no sizing)."""
+        samples = []
+        for cache in self._all():
+            labels = {'cache': cache.name}
+            stats = cache.stats
+            samples.extend([
+                ('cache_hits_total', 'counter', labels, stats.hits),
+                ('cache_misses_total', 'counter', labels, stats.misses),
+                ('cache_evictions_total', 'counter', labels, stats.evictions),
+                ('cache_entries', 'gauge', labels, len(cache.snapshot_items())),
+            ])
+        return samples
+
+
+def approximate_size(roots, budget=DEFAULT_SIZE_BUDGET):
+    """Deep ``sys.getsizeof`` of the objects in ``roots``, counting shared objects once.
+
+    Returns ``(bytes, truncated)``; ``truncated`` is true when more than ``budget``
+    objects would have to be visited and the estimate is a lower bound. Classes,
+    modules and functions are counted but not descended into.
+    """
+    seen = set()
+    stack = list(roots)
+    total = 0
+    visited = 0
+    while stack:
+        obj = stack.pop()
+        marker = id(obj)
+        if marker in seen:
+            continue
+        seen.add(marker)
+        visited += 1
+        if visited > budget:
+            return total, True
+        try:
+            total += sys.getsizeof(obj)
+        except TypeError:
+            continue
+        if isinstance(obj, _LEAF_TYPES) or obj is None:
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.append(vars(obj))
+        elif hasattr(obj, '__slots__'):
+            stack.extend(getattr(obj, slot) for slot in obj.__slots__ if hasattr(obj, slot))
+    return total, False
+
+
+_LEAF_TYPES = (
+    str, bytes, bytearray, int, float, complex, bool, type,
+    types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+)
+
+cache_registry = CacheRegistry()
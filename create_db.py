@@ -234,6 +234,56 @@ ON backtest_runs (created_at)
 """)
 
 
+# 下一期预计算结果表
+cursor.execute("""
+CREATE TABLE period_predictions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    region VARCHAR(10) NOT NULL,
+    period VARCHAR(20) NOT NULL,
+    strategy VARCHAR(20) NOT NULL,
+    config_hash VARCHAR(32) NOT NULL,
+    payload TEXT,
+    elapsed_ms INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uq_period_predictions_key UNIQUE (region, period, strategy, config_hash)
+)
+""")
+
+cursor.execute("""
+CREATE INDEX IF NOT EXISTS ix_period_predictions_region_period
+ON period_predictions (region, period)
+""")
+
+
+# 马尔可夫增量状态表
+cursor.execute("""
+CREATE TABLE markov_states (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    region VARCHAR(10) NOT NULL,
+    config_hash VARCHAR(32) NOT NULL,
+    period VARCHAR(20),
+    payload TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uq_markov_states_key UNIQUE (region, config_hash)
+)
+""")
+
+# AI 预测结果共享缓存表
+cursor.execute("""
+CREATE TABLE ai_prediction_cache (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cache_key VARCHAR(32) NOT NULL UNIQUE,
+    region VARCHAR(10) NOT NULL,
+    latest_period VARCHAR(20),
+    payload TEXT,
+    hit_count INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP
+)
+""")
+cursor.execute("CREATE INDEX ix_ai_prediction_cache_region_period ON ai_prediction_cache (region, latest_period)")
+
+
 # 邀请码表
 cursor.execute("""
 CREATE TABLE invite_code (
@@ -346,6 +396,11 @@ CREATE INDEX IF NOT EXISTS ix_manual_bet_records_region_period_profit
 ON manual_bet_records (region, period, total_profit)
 """)
 
+cursor.execute("""
+CREATE INDEX IF NOT EXISTS ix_manual_bet_records_created_at
+ON manual_bet_records (created_at)
+""")
+
 cursor.execute("""
 CREATE INDEX IF NOT EXISTS ix_manual_bet_records_user_region_period_profit_created_at
 ON manual_bet_records (user_id, region, period, total_profit, created_at)
@@ -364,6 +419,9 @@ CREATE TABLE lottery_draws (
     special_zodiac VARCHAR(10),
     raw_zodiac VARCHAR(100),
     raw_wave VARCHAR(100),
+    special_color VARCHAR(10),
+    special_parity VARCHAR(10),
+    display_breakdown TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(region, draw_id)
@@ -375,6 +433,21 @@ CREATE INDEX IF NOT EXISTS ix_lottery_draws_region_draw_date_draw_id
 ON lottery_draws (region, draw_date, draw_id)
 """)
 
+cursor.execute("""
+CREATE INDEX IF NOT EXISTS ix_lottery_draws_region_special_number_draw_date
+ON lottery_draws (region, special_number, draw_date)
+""")
+
+cursor.execute("""
+CREATE INDEX IF NOT EXISTS ix_lottery_draws_region_special_color_draw_date
+ON lottery_draws (region, special_color, draw_date)
+""")
+
+cursor.execute("""
+CREATE INDEX IF NOT EXISTS ix_lottery_draws_region_special_parity_draw_date
+ON lottery_draws (region, special_parity, draw_date)
+""")
+
 cursor.execute("""
 CREATE TABLE macau_collected_data (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Gunicorn 运行配置。
+
+默认使用 gthread：每个进程开一个线程池，长时间的 SSE 推送（/api/predict?stream=1、
+/api/chat?stream=1）只占一个线程，不会把整个进程堵住，短请求仍由其他线程处理。
+可以用 GUNICORN_WORKER_CLASS=gevent 切换到协程模式（需要另外安装 gevent），
+适合大量并发流式连接；但预测计算是纯 CPU 的，协程模式下会阻塞同进程的其他连接，
+因此默认仍是 gthread。
+"""
+
+import glob
+import importlib.util
+import os
+
+
+def _env_int(name, default, minimum=1):
+    try:
+        return max(minimum, int(os.environ.get(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = _env_int("GUNICORN_WORKERS", 2)
+threads = _env_int("GUNICORN_THREADS", 8)
+worker_connections = _env_int("GUNICORN_WORKER_CONNECTIONS", 200)
+timeout = _env_int("GUNICORN_TIMEOUT", 300)
+keepalive = _env_int("GUNICORN_KEEPALIVE", 5)
+
+worker_class = (os.environ.get("GUNICORN_WORKER_CLASS") or "gthread").strip().lower()
+if worker_class not in {"sync", "gthread", "gevent"}:
+    print(f"未知的 GUNICORN_WORKER_CLASS={worker_class}，改用 gthread")
+    worker_class = "gthread"
+if worker_class == "gevent" and importlib.util.find_spec("gevent") is None:
+    print("未安装 gevent，改用 gthread")
+    worker_class = "gthread"
+if worker_class == "sync":
+    # threads > 1 时 gunicorn 会把 sync 自动换成 gthread
+    threads = 1
+
+
+def on_starting(server):
+    # 每个 worker 把请求指标写在 METRICS_DIR/<pid>.json，主进程启动时清掉上次运行留下的快照
+    metrics_dir = os.environ.get("METRICS_DIR") or os.path.join(os.getcwd(), "data", "metrics")
+    for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -16,6 +16,7 @@ class ApiClient {
   late final Dio _dio;
   bool _initialized = false;
   String _csrfToken = '';
+  final Map<String, _ConditionalEntry> _conditionalCache = {};
 
   Future<void> init() async {
     if (_initialized) return;
@@ -57,6 +58,32 @@ class ApiClient {
     );
   }
 
+  /// 带 ETag 的 GET：服务端返回 304 时复用上次的响应体。
+  Future<dynamic> _getConditional(String path,
+      {required Map<String, dynamic> queryParameters}) async {
+    final key = Uri(
+      path: path,
+      queryParameters:
+          queryParameters.map((key, value) => MapEntry(key, '$value')),
+    ).toString();
+    final cached = _conditionalCache[key];
+    final response = await _dio.get(
+      path,
+      queryParameters: queryParameters,
+      options: cached == null
+          ? null
+          : Options(headers: {'If-None-Match': cached.etag}),
+    );
+    if (response.statusCode == 304 && cached != null) {
+      return cached.data;
+    }
+    final etag = response.headers.value('etag') ?? '';
+    if (response.statusCode == 200 && etag.isNotEmpty) {
+      _conditionalCache[key] = _ConditionalEntry(etag, response.data);
+    }
+    return response.data;
+  }
+
   Options? _csrfOptions() {
     if (_csrfToken.isEmpty) return null;
     return Options(headers: {'X-CSRF-Token': _csrfToken});
@@ -287,10 +314,13 @@ class ApiClient {
     bool includeDetails = true,
     bool includeTotal = true,
     String? year,
+    String? cursor,
   }) async {
     final response = await get('/api/mobile/predictions', queryParameters: {
       'page': page.toString(),
       'page_size': pageSize.toString(),
+      // 上一页响应里的 next_cursor；带上后服务端按游标续读，page 只用于展示
+      if (cursor != null && cursor.isNotEmpty) 'cursor': cursor,
       if (region != null && region.isNotEmpty) 'region': region,
       if (strategy != null && strategy.isNotEmpty) 'strategy': strategy,
       if (result != null && result.isNotEmpty) 'result': result,
@@ -320,15 +350,15 @@ class ApiClient {
     required String region,
     required String year,
   }) async {
-    final response = await get('/api/draws', queryParameters: {
+    final data = await _getConditional('/api/draws', queryParameters: {
       'region': region,
       'year': year,
     });
-    if (response.data is List) {
-      return response.data as List<dynamic>;
+    if (data is List) {
+      return data;
     }
-    if (response.data is String && (response.data as String).isNotEmpty) {
-      final decoded = jsonDecode(response.data as String);
+    if (data is String && data.isNotEmpty) {
+      final decoded = jsonDecode(data);
       if (decoded is List) {
         return decoded;
       }
@@ -339,10 +369,10 @@ class ApiClient {
   Future<Map<String, dynamic>> nextDrawTime({
     required String region,
   }) async {
-    final response = await get('/api/next_draw_time', queryParameters: {
+    final data = await _getConditional('/api/next_draw_time', queryParameters: {
       'region': region,
     });
-    return _ensureJsonMap(response.data);
+    return _ensureJsonMap(data);
   }
 
   Future<Map<String, dynamic>> updateDrawData({
@@ -521,3 +551,10 @@ class ApiClient {
     return payloadLines.join('\n').trim();
   }
 }
+
+class _ConditionalEntry {
+  _ConditionalEntry(this.etag, this.data);
+
+  final String etag;
+  final dynamic data;
+}
@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from sqlalchemy.dialects.mysql import MEDIUMTEXT
 import uuid
 import hashlib
+from cache_registry import cache_registry
 
 db = SQLAlchemy()
 LargeText = db.Text().with_variant(MEDIUMTEXT(), 'mysql').with_variant(MEDIUMTEXT(), 'mariadb')
@@ -311,6 +312,65 @@ class BacktestRun(db.Model):
     def __repr__(self):
         return f'<BacktestRun {self.id}:{self.name}>'
 
+
+class PeriodPrediction(db.Model):
+    """开奖后预先计算的下一期策略结果，供 /api/predict 直接读取"""
+    __tablename__ = 'period_predictions'
+    __table_args__ = (
+        db.UniqueConstraint('region', 'period', 'strategy', 'config_hash', name='uq_period_predictions_key'),
+        db.Index('ix_period_predictions_region_period', 'region', 'period'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    region = db.Column(db.String(10), nullable=False)
+    period = db.Column(db.String(20), nullable=False)
+    strategy = db.Column(db.String(20), nullable=False)
+    config_hash = db.Column(db.String(32), nullable=False)
+    payload = db.Column(LargeText)
+    elapsed_ms = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f'<PeriodPrediction {self.region}-{self.period}-{self.strategy}>'
+
+
+class MarkovState(db.Model):
+    """按地区和参数指纹持久化的衰减马尔可夫转移计数，开奖后增量推进"""
+    __tablename__ = 'markov_states'
+    __table_args__ = (
+        db.UniqueConstraint('region', 'config_hash', name='uq_markov_states_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    region = db.Column(db.String(10), nullable=False)
+    config_hash = db.Column(db.String(32), nullable=False)
+    period = db.Column(db.String(20))
+    payload = db.Column(LargeText)
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f'<MarkovState {self.region}-{self.period}>'
+
+
+class AIPredictionCache(db.Model):
+    """跨 worker 共享的 AI 预测结果缓存，键与进程内缓存一致，最新期号推进后淘汰"""
+    __tablename__ = 'ai_prediction_cache'
+    __table_args__ = (
+        db.Index('ix_ai_prediction_cache_region_period', 'region', 'latest_period'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    cache_key = db.Column(db.String(32), unique=True, nullable=False)
+    region = db.Column(db.String(10), nullable=False)
+    latest_period = db.Column(db.String(20))
+    payload = db.Column(LargeText)
+    hit_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    last_hit_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<AIPredictionCache {self.region}-{self.latest_period}>'
+
 class InviteCode(db.Model):
     """邀请码模型"""
     __table_args__ = (
@@ -507,6 +567,37 @@ class ZodiacSetting(db.Model):
         2034: datetime(2034, 2, 19).date(),
         2035: datetime(2035, 2, 8).date(),
     }
+    _SETTINGS_GENERATION_KEY = 'zodiac_settings_generation'
+
+    @staticmethod
+    def get_settings_generation():
+        """生肖设置的修改代数，各进程据此判断按生肖映射生成的响应是否过期"""
+        try:
+            return int(SystemConfig.get_config(ZodiacSetting._SETTINGS_GENERATION_KEY, '0') or 0)
+        except (TypeError, ValueError):
+            return 0
+
+    @staticmethod
+    def bump_settings_generation():
+        """生肖设置变更后调用，递增修改代数"""
+        generation = ZodiacSetting.get_settings_generation() + 1
+        SystemConfig.set_config(ZodiacSetting._SETTINGS_GENERATION_KEY, str(generation), '生肖设置修改代数')
+        return generation
+
+    @staticmethod
+    def get_lunar_new_year_date(year):
+        """指定生肖年的农历正月初一（公历日期），与 get_zodiac_year_for_date 的分界一致"""
+        try:
+            from lunardate import LunarDate
+        except Exception:
+            LunarDate = None
+
+        if LunarDate is not None:
+            try:
+                return LunarDate(int(year), 1, 1).toSolarDate()
+            except Exception:
+                pass
+        return ZodiacSetting._LUNAR_NEW_YEAR_DATES.get(int(year)) or datetime(int(year), 2, 4).date()
 
     @staticmethod
     def get_zodiac_year_for_date(value):
@@ -563,7 +654,9 @@ class ZodiacSetting(db.Model):
 
         cached = ZodiacSetting._macau_zodiac_cache.get(year)
         if cached:
+            _macau_zodiac_cache_stats.hit()
             return cached
+        _macau_zodiac_cache_stats.miss()
 
         try:
             import requests
@@ -633,7 +726,9 @@ class ZodiacSetting(db.Model):
 
         cached = ZodiacSetting._macau_year_match_cache.get(year)
         if cached is not None:
+            _macau_year_match_cache_stats.hit()
             return cached
+        _macau_year_match_cache_stats.miss()
         mapping = ZodiacSetting._get_macau_zodiac_mapping(year)
         if len(mapping) < 49:
             ZodiacSetting._macau_year_match_cache[year] = mapping
@@ -760,6 +855,7 @@ class ZodiacSetting(db.Model):
             
             db.session.commit()
             ZodiacSetting._macau_year_match_cache.clear()
+            ZodiacSetting.bump_settings_generation()
             return True, "生肖设置更新成功"
         except Exception as e:
             db.session.rollback()
@@ -851,11 +947,38 @@ class ZodiacSetting(db.Model):
         
         return table
 
+
+def _clear_macau_zodiac_cache(cache, region=None):
+    if not region or region == 'macau':
+        cache.clear()
+
+
+_macau_zodiac_cache_stats = cache_registry.register(
+    'macau_zodiac',
+    '澳门号码生肖（接口）',
+    items=lambda: ZodiacSetting._macau_zodiac_cache.items(),
+    clear=lambda region: _clear_macau_zodiac_cache(ZodiacSetting._macau_zodiac_cache, region),
+    group_of=lambda year, mapping: year,
+    group_label='year',
+    regional=True,
+)
+_macau_year_match_cache_stats = cache_registry.register(
+    'macau_year_match',
+    '澳门年份生肖匹配',
+    items=lambda: ZodiacSetting._macau_year_match_cache.items(),
+    clear=lambda region: _clear_macau_zodiac_cache(ZodiacSetting._macau_year_match_cache, region),
+    group_of=lambda year, mapping: year,
+    group_label='year',
+    regional=True,
+)
+
+
 class ManualBetRecord(db.Model):
     __tablename__ = 'manual_bet_records'
     __table_args__ = (
         db.Index('ix_manual_bet_records_user_region_created_at', 'user_id', 'region', 'created_at'),
         db.Index('ix_manual_bet_records_region_period_profit', 'region', 'period', 'total_profit'),
+        db.Index('ix_manual_bet_records_created_at', 'created_at'),
         db.Index(
             'ix_manual_bet_records_user_region_period_profit_created_at',
             'user_id',
@@ -913,6 +1036,9 @@ class LotteryDraw(db.Model):
     special_zodiac = db.Column(db.String(10))  # 特码生肖
     raw_zodiac = db.Column(db.String(100))  # 所有号码的生肖，逗号分隔
     raw_wave = db.Column(db.String(100))  # 波色信息
+    special_color = db.Column(db.String(10))  # 特码波色 red/blue/green，入库时计算，供检索走索引
+    special_parity = db.Column(db.String(10))  # 特码单双 odd/even
+    display_breakdown = db.Column(LargeText)  # 香港记录入库时预先算好的生肖/波色展示字段（JSON）
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     
@@ -920,7 +1046,13 @@ class LotteryDraw(db.Model):
     __table_args__ = (
         db.UniqueConstraint('region', 'draw_id', name='uix_region_draw_id'),
         db.Index('ix_lottery_draws_region_draw_date_draw_id', 'region', 'draw_date', 'draw_id'),
+        db.Index('ix_lottery_draws_region_special_number_draw_date', 'region', 'special_number', 'draw_date'),
+        db.Index('ix_lottery_draws_region_special_color_draw_date', 'region', 'special_color', 'draw_date'),
+        db.Index('ix_lottery_draws_region_special_parity_draw_date', 'region', 'special_parity', 'draw_date'),
     )
+    _RED_BALLS = {1, 2, 7, 8, 12, 13, 18, 19, 23, 24, 29, 30, 34, 35, 40, 45, 46}
+    _BLUE_BALLS = {3, 4, 9, 10, 14, 15, 20, 25, 26, 31, 36, 37, 41, 42, 47, 48}
+    _GREEN_BALLS = {5, 6, 11, 16, 17, 21, 22, 27, 28, 32, 33, 38, 39, 43, 44, 49}
     
     def to_dict(self):
         """将记录转换为字典，方便API返回"""
@@ -934,6 +1066,23 @@ class LotteryDraw(db.Model):
             "raw_wave": self.raw_wave
         }
     
+    @staticmethod
+    def special_number_attributes(special_number):
+        """特码的 (波色, 单双)，号码无效时返回 (None, None)"""
+        try:
+            number = int(special_number)
+        except (TypeError, ValueError):
+            return None, None
+        if number in LotteryDraw._RED_BALLS:
+            color = 'red'
+        elif number in LotteryDraw._BLUE_BALLS:
+            color = 'blue'
+        elif number in LotteryDraw._GREEN_BALLS:
+            color = 'green'
+        else:
+            return None, None
+        return color, ('odd' if number % 2 else 'even')
+
     @staticmethod
     def save_draw(region, draw_data):
         """保存开奖记录到数据库"""
@@ -992,6 +1141,7 @@ class LotteryDraw(db.Model):
                 existing.special_zodiac = special_zodiac
                 existing.raw_zodiac = raw_zodiac
                 existing.raw_wave = draw_data.get('raw_wave', '')
+                existing.special_color, existing.special_parity = LotteryDraw.special_number_attributes(special_number)
                 existing.updated_at = datetime.now()
             else:
                 # 创建新记录
@@ -1005,6 +1155,7 @@ class LotteryDraw(db.Model):
                     raw_zodiac=raw_zodiac,
                     raw_wave=draw_data.get('raw_wave', '')
                 )
+                new_draw.special_color, new_draw.special_parity = LotteryDraw.special_number_attributes(special_number)
                 db.session.add(new_draw)
             
             db.session.commit()
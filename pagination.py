@@ -0,0 +1,83 @@
+"""Keyset (cursor) pagination helpers shared by the draw and prediction listings."""
+
+import base64
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+from sqlalchemy import tuple_
+
+
+def encode_cursor(*values):
+    """Pack the sort-key values of the last row on a page into an opaque URL-safe token."""
+    payload = [
+        {'$dt': value.isoformat()} if isinstance(value, datetime) else value
+        for value in values
+    ]
+    raw = json.dumps(payload, ensure_ascii=True, separators=(',', ':')).encode('ascii')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, arity):
+    """Unpack a token from encode_cursor(); raise ValueError when it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(str(token) + '=' * (-len(str(token)) % 4))
+        payload = json.loads(raw.decode('ascii'))
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('分页游标无效') from e
+    if not isinstance(payload, list) or len(payload) != arity:
+        raise ValueError('分页游标无效')
+    values = []
+    for value in payload:
+        if isinstance(value, dict):
+            try:
+                value = datetime.fromisoformat(value['$dt'])
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError('分页游标无效') from e
+        elif value is not None and not isinstance(value, (str, int, float)):
+            raise ValueError('分页游标无效')
+        values.append(value)
+    return tuple(values)
+
+
+def keyset_before(columns, values):
+    """Filter for rows that come after ``values`` when ordered by ``columns`` descending.
+
+    Uses a row-value comparison so SQLite (3.15+) and MySQL turn it into a range seek on
+    the composite index. Sort keys are expected to be non-NULL.
+    """
+    return tuple_(*columns) < tuple_(*values)
+
+
+def row_cursor(row, columns):
+    return encode_cursor(*[getattr(row, column.key) for column in columns])
+
+
+def paginate_keyset(query, columns, page, per_page, total, cursor=''):
+    """Page ``query`` ordered by ``columns`` descending.
+
+    With a cursor the page is read with an index seek from the previous page's last row;
+    without one it falls back to OFFSET so page-number links keep working. ``page`` is
+    only used for display when a cursor is given. The result mirrors Flask-SQLAlchemy's
+    Pagination plus ``next_cursor``.
+    """
+    pages = max(1, (total + per_page - 1) // per_page)
+    current_page = min(max(page, 1), pages)
+    ordered = query.order_by(*[column.desc() for column in columns])
+    if cursor:
+        items = ordered.filter(keyset_before(columns, decode_cursor(cursor, len(columns)))).limit(per_page).all()
+    else:
+        items = ordered.offset((current_page - 1) * per_page).limit(per_page).all()
+    has_next = current_page < pages and len(items) == per_page
+    return SimpleNamespace(
+        items=items,
+        page=current_page,
+        per_page=per_page,
+        total=total,
+        pages=pages,
+        has_prev=current_page > 1,
+        has_next=has_next,
+        prev_num=current_page - 1 if current_page > 1 else None,
+        next_num=current_page + 1 if has_next else None,
+        next_cursor=row_cursor(items[-1], columns) if has_next else None,
+    )
@@ -0,0 +1,216 @@
+"""Sliding-window rate limiting with O(1) state per key.
+
+Each key keeps the hit count of the current fixed window and of the previous one; the
+previous count is weighted by how much of it still overlaps the sliding window. Two
+backends share that algorithm:
+
+* ``MemoryRateLimiter`` keeps keys in an LRU map bounded by ``max_keys`` and drops keys
+  whose windows have fully expired, so memory no longer grows with the number of IPs.
+* ``SQLiteRateLimiter`` stores the counters in a small SQLite file so every gunicorn
+  worker on the host sees the same counts; it falls back to an in-process limiter if
+  the file cannot be used.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_KEYS = 10000
+# How many shared-store hits between sweeps of expired rows.
+_SQLITE_SWEEP_INTERVAL = 1000
+
+
+def _slide(state, limit, window_seconds, now):
+    """Apply one hit to ``state`` and return ``(limited, new_state)``.
+
+    ``state`` is ``(window_index, previous_count, current_count)`` or ``None``. Rejected
+    hits are not counted, so a client that keeps retrying is let back in as soon as its
+    earlier hits age out.
+    """
+    position = now / window_seconds
+    window_index = int(position)
+    previous_count = current_count = 0
+    if state is not None:
+        stored_index, stored_previous, stored_current = state
+        if stored_index == window_index:
+            previous_count, current_count = stored_previous, stored_current
+        elif stored_index == window_index - 1:
+            previous_count = stored_current
+    estimated = previous_count * (1.0 - (position - window_index)) + current_count
+    if estimated + 1 > limit:
+        return True, (window_index, previous_count, current_count)
+    return False, (window_index, previous_count, current_count + 1)
+
+
+def _expires_at(state, window_seconds):
+    # Once two whole windows have passed the key counts as zero again.
+    return (state[0] + 2) * window_seconds
+
+
+class MemoryRateLimiter:
+    """Per-process limiter; keys live in an LRU map capped at ``max_keys``."""
+
+    backend = 'memory'
+
+    def __init__(self, max_keys=DEFAULT_MAX_KEYS):
+        self.max_keys = max(1, int(max_keys))
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def hit(self, key, limit, window_seconds, now=None):
+        """Record a hit for ``key`` and return True when it is over ``limit`` per window."""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            limited, state = _slide(entry[0] if entry else None, limit, window_seconds, now)
+            self._entries[key] = (state, _expires_at(state, window_seconds))
+            self._evict(now)
+        return limited
+
+    def _evict(self, now):
+        entries = self._entries
+        while len(entries) > self.max_keys:
+            entries.popitem(last=False)
+        # Least recently used keys sit at the front; drop expired ones until a live key shows up.
+        while entries:
+            key, (_, expires_at) = next(iter(entries.items()))
+            if expires_at > now:
+                break
+            del entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteRateLimiter:
+    """Limiter whose counters live in a SQLite file shared by all workers on the host."""
+
+    backend = 'sqlite'
+
+    def __init__(self, path, max_keys=DEFAULT_MAX_KEYS, timeout=2.0):
+        self.path = path
+        self.max_keys = max(1, int(max_keys))
+        self.timeout = timeout
+        self._local = threading.local()
+        self._fallback = MemoryRateLimiter(max_keys)
+        self._hits = 0
+        self._hits_lock = threading.Lock()
+        self._failed = False
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and getattr(self._local, 'pid', None) == os.getpid():
+            return conn
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        # Counters are throwaway state, so skip fsync.
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS rate_limits ('
+            'key TEXT PRIMARY KEY, '
+            'window_index INTEGER NOT NULL, '
+            'previous_count INTEGER NOT NULL, '
+            'current_count INTEGER NOT NULL, '
+            'expires_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_rate_limits_expires_at ON rate_limits (expires_at)')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def hit(self, key, limit, window_seconds, now=None):
+        """Record a hit for ``key`` and return True when it is over ``limit`` per window."""
+        now = time.time() if now is None else now
+        try:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    'SELECT window_index, previous_count, current_count FROM rate_limits WHERE key = ?',
+                    (key,),
+                ).fetchone()
+                limited, state = _slide(row, limit, window_seconds, now)
+                conn.execute(
+                    'INSERT OR REPLACE INTO rate_limits '
+                    '(key, window_index, previous_count, current_count, expires_at) VALUES (?, ?, ?, ?, ?)',
+                    (key, state[0], state[1], state[2], _expires_at(state, window_seconds)),
+                )
+                if self._due_for_sweep():
+                    self._sweep(conn, now)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            if not self._failed:
+                self._failed = True
+                print(f"共享限流存储不可用，改用进程内计数: {e}")
+            return self._fallback.hit(key, limit, window_seconds, now)
+        return limited
+
+    def _due_for_sweep(self):
+        with self._hits_lock:
+            self._hits += 1
+            return self._hits % _SQLITE_SWEEP_INTERVAL == 0
+
+    def _sweep(self, conn, now):
+        conn.execute('DELETE FROM rate_limits WHERE expires_at <= ?', (now,))
+        overflow = conn.execute('SELECT COUNT(*) FROM rate_limits').fetchone()[0] - self.max_keys
+        if overflow > 0:
+            conn.execute(
+                'DELETE FROM rate_limits WHERE key IN '
+                '(SELECT key FROM rate_limits ORDER BY expires_at ASC LIMIT ?)',
+                (overflow,),
+            )
+
+    def __len__(self):
+        try:
+            return self._connection().execute('SELECT COUNT(*) FROM rate_limits').fetchone()[0]
+        except sqlite3.Error:
+            return len(self._fallback)
+
+    def clear(self):
+        self._fallback.clear()
+        try:
+            self._connection().execute('DELETE FROM rate_limits')
+        except sqlite3.Error:
+            pass
+
+
+def create_rate_limiter(backend='sqlite', path=None, max_keys=DEFAULT_MAX_KEYS):
+    backend = str(backend or 'sqlite').strip().lower()
+    if backend == 'memory':
+        return MemoryRateLimiter(max_keys)
+    if backend != 'sqlite':
+        print(f"未知的 RATE_LIMIT_BACKEND={backend}，改用 sqlite")
+    return SQLiteRateLimiter(path or os.path.join(os.getcwd(), 'data', 'rate_limits.db'), max_keys)
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Process-wide limiter configured from RATE_LIMIT_BACKEND / RATE_LIMIT_SQLITE_PATH / RATE_LIMIT_MAX_KEYS."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                try:
+                    max_keys = int(os.environ.get('RATE_LIMIT_MAX_KEYS', DEFAULT_MAX_KEYS))
+                except (TypeError, ValueError):
+                    max_keys = DEFAULT_MAX_KEYS
+                _rate_limiter = create_rate_limiter(
+                    os.environ.get('RATE_LIMIT_BACKEND', 'sqlite'),
+                    os.environ.get('RATE_LIMIT_SQLITE_PATH') or None,
+                    max_keys,
+                )
+    return _rate_limiter
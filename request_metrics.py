@@ -0,0 +1,425 @@
+"""Per-endpoint request metrics: latency histograms, status counts, SQL queries and payload sizes.
+
+Each worker keeps its own counters and every few seconds writes them to
+``<metrics_dir>/<pid>.json``. Readers merge every file, so the admin page and the
+Prometheus endpoint report the totals of all gunicorn workers rather than whichever
+worker happened to serve the request. Files of exited workers are kept so counters
+never go backwards; gunicorn.conf.py clears the directory when the master starts.
+"""
+
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_SELECT_COLUMNS_PATTERN = re.compile(r'^SELECT .+? FROM ', re.IGNORECASE)
+_current_request = contextvars.ContextVar('request_metrics_current', default=None)
+_engine_events_installed = False
+
+
+class _RequestTracker:
+    __slots__ = ('started_at', 'queries', 'db_seconds', 'statements')
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements = {}
+
+    def record_query(self, statement, seconds):
+        self.queries += 1
+        self.db_seconds += seconds
+        item = self.statements.get(statement)
+        if item is None:
+            self.statements[statement] = [1, seconds]
+        else:
+            item[0] += 1
+            item[1] += seconds
+
+    def top_statements(self, limit):
+        return sorted(self.statements.items(), key=lambda entry: entry[1][1], reverse=True)[:limit]
+
+
+class _CountingStream:
+    """Count the bytes of a streamed body as they are sent; close() reaches the original iterable."""
+
+    def __init__(self, response):
+        self._source = response.response
+        self._chunks = response.iter_encoded()
+        self.bytes = 0
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            self.bytes += len(chunk)
+            yield chunk
+
+    def close(self):
+        close = getattr(self._source, 'close', None)
+        if close is not None:
+            close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current_request.get() is not None:
+        context._request_metrics_started_at = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    tracker = _current_request.get()
+    started_at = getattr(context, '_request_metrics_started_at', None)
+    if tracker is not None and started_at is not None:
+        tracker.record_query(statement, time.perf_counter() - started_at)
+
+
+def _new_endpoint_stats():
+    return {
+        'requests': 0,
+        'status': {},
+        'latency_buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+        'latency_ms_sum': 0.0,
+        'latency_ms_max': 0.0,
+        'db_queries_sum': 0,
+        'db_queries_max': 0,
+        'db_repeat_max': 0,
+        'db_ms_sum': 0.0,
+        'db_ms_max': 0.0,
+        'bytes_sum': 0,
+        'bytes_max': 0,
+        'slow': 0,
+    }
+
+
+def _merge_endpoint_stats(target, source):
+    for key, value in source.items():
+        if key == 'status':
+            for status, count in value.items():
+                target['status'][status] = target['status'].get(status, 0) + count
+        elif key == 'latency_buckets':
+            target[key] = [left + right for left, right in zip(target[key], value)]
+        elif key.endswith('_max'):
+            target[key] = max(target.get(key, 0), value)
+        else:
+            target[key] = target.get(key, 0) + value
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def estimate_percentile(stats, ratio):
+    """Upper bound of the histogram bucket holding the ``ratio`` quantile, capped at the observed max."""
+    total = stats.get('requests', 0)
+    if not total:
+        return 0.0
+    target = ratio * total
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS_MS + (None,), stats['latency_buckets']):
+        cumulative += count
+        if cumulative >= target:
+            break
+    maximum = stats.get('latency_ms_max', 0.0)
+    return round(float(min(bound, maximum) if bound is not None else maximum), 1)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + '}'
+
+
+class RequestMetrics:
+    """Collects metrics for every request of a Flask app and every SQL statement they run."""
+
+    def __init__(self, metrics_dir=None, flush_seconds=5.0, slow_ms=1000.0, top_queries=5, namespace='app'):
+        self.metrics_dir = metrics_dir
+        self.flush_seconds = max(0.0, float(flush_seconds))
+        self.slow_ms = max(0.0, float(slow_ms))
+        self.top_queries = max(0, int(top_queries))
+        self.namespace = namespace
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._endpoints = {}
+        self._collectors = []
+        self._last_flush = 0.0
+        self._flush_failed = False
+
+    def init_app(self, app):
+        """Register the hooks; call before any other before_request so their time is included."""
+        global _engine_events_installed
+        if not _engine_events_installed:
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            _engine_events_installed = True
+        app.before_request(self._start_request)
+        app.after_request(self._finish_response)
+
+    def add_collector(self, collector):
+        """Register a callable returning ``[(name, kind, labels, value), ...]``.
+
+        ``kind`` decides how workers are merged: ``counter`` sums every worker,
+        ``gauge`` sums live workers only and ``max`` keeps the largest value.
+        """
+        self._collectors.append(collector)
+
+    def _start_request(self):
+        _current_request.set(_RequestTracker())
+
+    def _finish_response(self, response):
+        tracker = _current_request.get()
+        if tracker is None:
+            return response
+        method = request.method
+        endpoint = request.endpoint or '<unmatched>'
+        path = request.path
+        if response.is_streamed:
+            counter = _CountingStream(response)
+            response.response = counter
+            payload_size = lambda: counter.bytes  # noqa: E731
+        else:
+            size = response.calculate_content_length() or 0
+            payload_size = lambda: size  # noqa: E731
+        status = response.status_code
+
+        def _on_close():
+            _current_request.set(None)
+            self._record(tracker, method, endpoint, path, status, payload_size())
+
+        response.call_on_close(_on_close)
+        return response
+
+    def _record(self, tracker, method, endpoint, path, status, payload_bytes):
+        latency_ms = (time.perf_counter() - tracker.started_at) * 1000.0
+        db_ms = tracker.db_seconds * 1000.0
+        repeat_max = max((item[0] for item in tracker.statements.values()), default=0)
+        slow = bool(self.slow_ms) and latency_ms >= self.slow_ms
+        bucket = len(LATENCY_BUCKETS_MS)
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                bucket = index
+                break
+        with self._lock:
+            stats = self._endpoints.get(f'{method} {endpoint}')
+            if stats is None:
+                stats = self._endpoints[f'{method} {endpoint}'] = _new_endpoint_stats()
+            stats['requests'] += 1
+            stats['status'][str(status)] = stats['status'].get(str(status), 0) + 1
+            stats['latency_buckets'][bucket] += 1
+            stats['latency_ms_sum'] += latency_ms
+            stats['latency_ms_max'] = max(stats['latency_ms_max'], latency_ms)
+            stats['db_queries_sum'] += tracker.queries
+            stats['db_queries_max'] = max(stats['db_queries_max'], tracker.queries)
+            stats['db_repeat_max'] = max(stats['db_repeat_max'], repeat_max)
+            stats['db_ms_sum'] += db_ms
+            stats['db_ms_max'] = max(stats['db_ms_max'], db_ms)
+            stats['bytes_sum'] += payload_bytes
+            stats['bytes_max'] = max(stats['bytes_max'], payload_bytes)
+            if slow:
+                stats['slow'] += 1
+        if slow:
+            self._log_slow_request(tracker, method, path, status, latency_ms, db_ms)
+        self._maybe_flush()
+
+    def _log_slow_request(self, tracker, method, path, status, latency_ms, db_ms):
+        lines = [f"慢请求: {method} {path} -> {status} 耗时 {latency_ms:.0f}ms，SQL {tracker.queries} 条共 {db_ms:.0f}ms"]
+        for statement, (count, seconds) in tracker.top_statements(self.top_queries):
+            # The column list is long and uninformative; collapse it so FROM / WHERE survive the cut.
+            text = _SELECT_COLUMNS_PATTERN.sub('SELECT ... FROM ', ' '.join(str(statement).split()), count=1)
+            lines.append(f"  {seconds * 1000.0:.1f}ms x{count}: {text[:300]}")
+        print('\n'.join(lines))
+
+    def snapshot(self):
+        """This worker's counters plus its collector samples."""
+        with self._lock:
+            endpoints = {
+                key: {**stats, 'status': dict(stats['status']), 'latency_buckets': list(stats['latency_buckets'])}
+                for key, stats in self._endpoints.items()
+            }
+        samples = []
+        for collector in self._collectors:
+            try:
+                samples.extend([list(item) for item in collector()])
+            except Exception as e:
+                print(f"收集指标失败: {e}")
+        return {
+            'pid': os.getpid(),
+            'started_at': self.started_at,
+            'updated_at': time.time(),
+            'endpoints': endpoints,
+            'samples': samples,
+        }
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.metrics_dir, f'{pid}.json')
+
+    def _maybe_flush(self, force=False):
+        if not self.metrics_dir or self._flush_failed:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_seconds:
+            return
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_flush = now
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            path = self._snapshot_path(os.getpid())
+            temp_path = f'{path}.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temp_path, path)
+        except OSError as e:
+            self._flush_failed = True
+            print(f"写入请求指标快照失败，只统计本进程: {e}")
+        finally:
+            self._flush_lock.release()
+
+    def _load_snapshots(self):
+        self._maybe_flush(force=True)
+        snapshots = [self.snapshot()]
+        if not self.metrics_dir or self._flush_failed:
+            return snapshots
+        try:
+            names = os.listdir(self.metrics_dir)
+        except OSError:
+            return snapshots
+        own_pid = os.getpid()
+        for name in names:
+            if not name.endswith('.json') or name == f'{own_pid}.json':
+                continue
+            try:
+                with open(os.path.join(self.metrics_dir, name), 'r', encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def merged_snapshot(self):
+        """Totals across all workers that have written a snapshot, including exited ones."""
+        endpoints = {}
+        samples = {}
+        workers = []
+        for snapshot in self._load_snapshots():
+            pid = snapshot.get('pid')
+            alive = pid == os.getpid() or (isinstance(pid, int) and _pid_alive(pid))
+            workers.append({'pid': pid, 'alive': alive, 'updated_at': snapshot.get('updated_at')})
+            for key, stats in (snapshot.get('endpoints') or {}).items():
+                target = endpoints.setdefault(key, _new_endpoint_stats())
+                _merge_endpoint_stats(target, stats)
+            for name, kind, labels, value in snapshot.get('samples') or []:
+                if kind == 'gauge' and not alive:
+                    continue
+                sample_key = (name, kind, tuple(sorted((labels or {}).items())))
+                if kind == 'max':
+                    samples[sample_key] = max(samples.get(sample_key, value), value)
+                else:
+                    samples[sample_key] = samples.get(sample_key, 0) + value
+        return {
+            'workers': sorted(workers, key=lambda item: str(item['pid'])),
+            'endpoints': endpoints,
+            'samples': [
+                {'name': name, 'kind': kind, 'labels': dict(labels), 'value': value}
+                for (name, kind, labels), value in sorted(samples.items())
+            ],
+        }
+
+    def endpoint_rows(self, merged=None):
+        """One summary row per endpoint, slowest total time first."""
+        merged = merged or self.merged_snapshot()
+        rows = []
+        for key, stats in merged['endpoints'].items():
+            method, endpoint = key.split(' ', 1)
+            count = max(1, stats['requests'])
+            errors = sum(value for status, value in stats['status'].items() if status.startswith('5'))
+            rows.append({
+                'method': method,
+                'endpoint': endpoint,
+                'requests': stats['requests'],
+                'status': dict(sorted(stats['status'].items())),
+                'error_rate': round(errors / count, 4),
+                'avg_ms': round(stats['latency_ms_sum'] / count, 1),
+                'p50_ms': estimate_percentile(stats, 0.5),
+                'p95_ms': estimate_percentile(stats, 0.95),
+                'max_ms': round(stats['latency_ms_max'], 1),
+                'total_ms': round(stats['latency_ms_sum'], 1),
+                'avg_queries': round(stats['db_queries_sum'] / count, 1),
+                'max_queries': stats['db_queries_max'],
+                'max_repeated_query': stats['db_repeat_max'],
+                'avg_db_ms': round(stats['db_ms_sum'] / count, 1),
+                'avg_bytes': int(stats['bytes_sum'] / count),
+                'max_bytes': stats['bytes_max'],
+                'slow': stats['slow'],
+            })
+        rows.sort(key=lambda row: row['total_ms'], reverse=True)
+        return rows
+
+    def render_prometheus(self, merged=None):
+        """Prometheus text exposition (format 0.0.4) of the merged metrics."""
+        merged = merged or self.merged_snapshot()
+        ns = self.namespace
+        endpoints = sorted(merged['endpoints'].items())
+        lines = []
+
+        def _header(name, kind, help_text):
+            lines.append(f'# HELP {ns}_{name} {help_text}')
+            lines.append(f'# TYPE {ns}_{name} {kind}')
+
+        _header('http_requests_total', 'counter', 'Requests by endpoint and status.')
+        for key, stats in endpoints:
+            method, endpoint = key.split(' ', 1)
+            for status, count in sorted(stats['status'].items()):
+                labels = _format_labels({'method': method, 'endpoint': endpoint, 'status': status})
+                lines.append(f'{ns}_http_requests_total{labels} {count}')
+
+        _header('http_request_duration_seconds', 'histogram', 'Request latency until the body is fully sent.')
+        for key, stats in endpoints:
+            method, endpoint = key.split(' ', 1)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS_MS + (None,), stats['latency_buckets']):
+                cumulative += count
+                le = '+Inf' if bound is None else repr(bound / 1000.0)
+                labels = _format_labels({'method': method, 'endpoint': endpoint, 'le': le})
+                lines.append(f'{ns}_http_request_duration_seconds_bucket{labels} {cumulative}')
+            labels = _format_labels({'method': method, 'endpoint': endpoint})
+            lines.append(f"{ns}_http_request_duration_seconds_sum{labels} {stats['latency_ms_sum'] / 1000.0:.6f}")
+            lines.append(f"{ns}_http_request_duration_seconds_count{labels} {stats['requests']}")
+
+        for name, field, scale, help_text in (
+            ('http_db_queries_total', 'db_queries_sum', 1, 'SQL statements executed while serving requests.'),
+            ('http_db_seconds_total', 'db_ms_sum', 1000.0, 'Time spent in SQL statements while serving requests.'),
+            ('http_response_bytes_total', 'bytes_sum', 1, 'Response body bytes sent.'),
+            ('http_slow_requests_total', 'slow', 1, 'Requests slower than the slow-request threshold.'),
+        ):
+            _header(name, 'counter', help_text)
+            for key, stats in endpoints:
+                method, endpoint = key.split(' ', 1)
+                labels = _format_labels({'method': method, 'endpoint': endpoint})
+                value = stats[field] / scale if scale != 1 else stats[field]
+                lines.append(f'{ns}_{name}{labels} {value:.6f}' if scale != 1 else f'{ns}_{name}{labels} {value}')
+
+        declared = set()
+        for sample in merged['samples']:
+            name = sample['name']
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {ns}_{name} {'counter' if sample['kind'] == 'counter' else 'gauge'}")
+            lines.append(f"{ns}_{name}{_format_labels(sample['labels'])} {sample['value']}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,85 @@
+"""Response helpers: gzip for large bodies and incremental JSON encoding for big lists."""
+
+import gzip
+import json
+import zlib
+
+COMPRESSIBLE_MIMETYPES = frozenset({
+    'application/json',
+    'application/javascript',
+    'image/svg+xml',
+    'text/css',
+    'text/csv',
+    'text/html',
+    'text/javascript',
+    'text/plain',
+})
+
+
+class _GzipStream:
+    """Compress a streamed body chunk by chunk and close the original iterable when done."""
+
+    def __init__(self, response, level):
+        self._source = response.response
+        self._chunks = response.iter_encoded()
+        self._level = level
+
+    def __iter__(self):
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in self._chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def close(self):
+        # stream_with_context pops its request context (and returns the DB connection) on close().
+        close = getattr(self._source, 'close', None)
+        if close is not None:
+            close()
+
+
+def compress_response(request, response, min_size=1024, level=6):
+    """Gzip ``response`` in place when the client accepts it.
+
+    Buffered bodies are compressed only from ``min_size`` bytes; streamed bodies are
+    always compressed on the fly. SSE, files sent with ``direct_passthrough`` and
+    responses that already carry a Content-Encoding are left alone. A strong ETag is
+    downgraded to a weak one because the bytes on the wire no longer match it.
+    """
+    if request.method == 'HEAD' or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (
+        not 200 <= response.status_code < 300
+        or response.status_code in (204, 206)
+        or response.direct_passthrough
+        or 'Content-Encoding' in response.headers
+        or request.accept_encodings['gzip'] <= 0
+    ):
+        return response
+
+    if response.is_streamed:
+        response.response = _GzipStream(response, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(gzip.compress(data, compresslevel=level, mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def iter_json_array(items, dumps=None, separator=','):
+    """Yield a JSON array one element at a time instead of building the whole document."""
+    dumps = dumps or (lambda item: json.dumps(item, ensure_ascii=False))
+    yield '['
+    first = True
+    for item in items:
+        yield ('' if first else separator) + dumps(item)
+        first = False
+    yield ']'
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""录制/回放 AI 补全并离线跑 AI 回测。
+
+record 模式照常请求上游（或 --stub 启动的本地桩服务），把每次补全按请求指纹写入录制目录；
+replay 模式只读录制目录，不访问网络，可用 --latency-ms 模拟上游耗时。
+replay 会连续跑两遍并比较结果，确认回放是确定性的。
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+for path in (ROOT_DIR, SCRIPT_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Record or replay AI completions and run the AI backtest offline.")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("--region", default="hk", choices=["hk", "macau"])
+    parser.add_argument("--periods", type=int, default=24, help="number of most recent periods to backtest")
+    parser.add_argument("--cassette-dir", default="", help="defaults to data/ai_cassettes")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="synthetic latency per replayed completion")
+    parser.add_argument("--stub", action="store_true", help="record against the local stub server instead of the configured API")
+    return parser.parse_args()
+
+
+def _run_backtest(app_module, region, periods):
+    app_module._clear_runtime_analysis_caches()
+    started_at = time.perf_counter()
+    summary = app_module._build_strategy_backtest_summary(region, "ai", max_periods=periods)
+    return summary, time.perf_counter() - started_at
+
+
+def main():
+    args = _parse_args()
+    os.environ["AI_CASSETTE_MODE"] = args.mode
+    if args.mode == "record":
+        # 录制回测会逐期请求上游，应用默认不允许，由本脚本显式打开。
+        os.environ["AI_CASSETTE_RECORD_BACKTEST"] = "1"
+    os.environ["AI_CASSETTE_REPLAY_LATENCY_MS"] = str(max(0.0, args.latency_ms))
+    if args.cassette_dir:
+        os.environ["AI_CASSETTE_DIR"] = os.path.abspath(args.cassette_dir)
+
+    try:
+        import app as app_module
+    except ModuleNotFoundError as exc:
+        missing = getattr(exc, "name", "") or str(exc)
+        print(json.dumps({"error": f"Missing dependency: {missing}"}, ensure_ascii=False, indent=2))
+        raise SystemExit(1)
+
+    stub_server = None
+    if args.mode == "record" and args.stub:
+        from ai_stub_server import start_stub_server
+
+        stub_server, stub_url = start_stub_server(delay=0.05, seed=11)
+        stub_config = {"api_url": stub_url, "api_key": "stub", "model": "stub-model"}
+        app_module.get_ai_config = lambda: dict(stub_config)
+
+    report = {
+        "mode": args.mode,
+        "region": args.region,
+        "cassette_dir": app_module._AI_CASSETTE_DIR,
+    }
+    try:
+        with app_module.app.app_context():
+            if not app_module._ai_cassette_backtest_enabled():
+                report["error"] = "AI API Key 未配置，无法录制"
+                print(json.dumps(report, ensure_ascii=False, indent=2))
+                raise SystemExit(1)
+            summary, elapsed = _run_backtest(app_module, args.region, args.periods)
+            report["elapsed_seconds"] = round(elapsed, 2)
+            report["summary"] = summary
+            if args.mode == "replay":
+                repeat_summary, repeat_elapsed = _run_backtest(app_module, args.region, args.periods)
+                report["repeat_elapsed_seconds"] = round(repeat_elapsed, 2)
+                report["deterministic"] = repeat_summary == summary
+    finally:
+        if stub_server is not None:
+            stub_server.shutdown()
+
+    try:
+        report["cassette_entries"] = len([
+            name for name in os.listdir(app_module._AI_CASSETTE_DIR) if name.endswith(".json")
+        ])
+    except OSError:
+        report["cassette_entries"] = 0
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.mode == "replay" and not report.get("deterministic"):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
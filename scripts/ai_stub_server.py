@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""本地 OpenAI 兼容补全接口桩，用于在没有真实 AI 服务时验证采样并发与延迟预算。
+
+用法:
+    python scripts/ai_stub_server.py --port 18080 --delay 3 --jitter 1
+然后在后台把 AI 接口地址设为 http://127.0.0.1:18080/v1/chat/completions。
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _build_candidates(rng):
+    candidates = []
+    for _ in range(3):
+        numbers = rng.sample(range(1, 50), 7)
+        candidates.append({
+            "special": numbers[0],
+            "normal": sorted(numbers[1:]),
+            "confidence": round(rng.uniform(0.35, 0.7), 2),
+            "why": "stub",
+        })
+    return json.dumps({"candidates": candidates}, ensure_ascii=False)
+
+
+def make_handler(delay=0.0, jitter=0.0, seed=None, stats=None, error_rate=0.0, chunk_interval=0.0):
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    stats = stats if stats is not None else {}
+    stats.setdefault("requests", 0)
+    stats.setdefault("in_flight", 0)
+    stats.setdefault("max_in_flight", 0)
+    stats_lock = threading.Lock()
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            return
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                payload = {}
+            with stats_lock:
+                stats["requests"] += 1
+                stats["in_flight"] += 1
+                stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+            try:
+                with rng_lock:
+                    wait_seconds = max(0.0, float(delay) + rng.uniform(-float(jitter), float(jitter)))
+                    content = _build_candidates(rng)
+                    fail = rng.random() < float(error_rate or 0.0)
+                time.sleep(wait_seconds)
+                if fail:
+                    self._write_error(503)
+                    return
+                if payload.get("stream"):
+                    self._write_stream(content)
+                else:
+                    # 非流式回复同样要等整段“生成”完，耗时与流式逐块输出一致。
+                    if chunk_interval:
+                        time.sleep(float(chunk_interval) * len(range(0, len(content), 24)))
+                    self._write_json({
+                        "id": "stub",
+                        "object": "chat.completion",
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    })
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                with stats_lock:
+                    stats["in_flight"] -= 1
+
+        def _write_json(self, body):
+            raw = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def _write_error(self, status):
+            raw = json.dumps({"error": {"message": "stub overloaded"}}).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def _write_stream(self, content):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            step = 24
+            for start in range(0, len(content), step):
+                chunk = {"choices": [{"index": 0, "delta": {"content": content[start:start + step]}}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                if chunk_interval:
+                    time.sleep(float(chunk_interval))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return StubHandler
+
+
+def start_stub_server(host="127.0.0.1", port=0, delay=0.0, jitter=0.0, seed=None, stats=None, error_rate=0.0, chunk_interval=0.0):
+    """在后台线程启动桩服务，返回 (server, base_url)。"""
+    server = ThreadingHTTPServer((host, port), make_handler(delay=delay, jitter=jitter, seed=seed, stats=stats, error_rate=error_rate, chunk_interval=chunk_interval))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="ai-stub-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1/chat/completions"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub for AI sampling checks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--delay", type=float, default=3.0, help="seconds before each completion returns")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- jitter added to --delay")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--chunk-interval", type=float, default=0.0, help="seconds between streamed chunks")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(delay=args.delay, jitter=args.jitter, seed=args.seed, error_rate=args.error_rate, chunk_interval=args.chunk_interval))
+    server.daemon_threads = True
+    print(f"AI stub listening on http://{args.host}:{args.port}/v1/chat/completions delay={args.delay}s jitter={args.jitter}s")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
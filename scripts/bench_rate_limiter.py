@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""限流器微基准：单次检查的开销、大量不同 IP 下的内存占用，以及跨进程额度是否共享。
+
+对比三种实现：
+1. legacy：旧版按键保存时间戳列表、每次检查重建列表的写法（仅用于对照）；
+2. memory：rate_limiter.MemoryRateLimiter，带 LRU 上限的滑动窗口计数；
+3. sqlite：rate_limiter.SQLiteRateLimiter，计数放在临时目录下的 SQLite 文件里。
+最后用多个进程同时打同一个键，检查 sqlite 后端放行的总次数不超过配置的额度。
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from rate_limiter import MemoryRateLimiter, SQLiteRateLimiter  # noqa: E402
+
+# 足够长的窗口，测试期间不会跨窗口
+_WINDOW_SECONDS = 10 ** 6
+
+
+class LegacyRateLimiter:
+    def __init__(self):
+        self._entries = {}
+
+    def hit(self, key, limit, window_seconds):
+        now = time.time()
+        bucket = [item for item in self._entries.get(key, []) if now - item < window_seconds]
+        if len(bucket) >= limit:
+            self._entries[key] = bucket
+            return True
+        bucket.append(now)
+        self._entries[key] = bucket
+        return False
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Micro-benchmark the rate limiter backends.")
+    parser.add_argument("--hits", type=int, default=20000, help="checks per measurement")
+    parser.add_argument("--limit", type=int, default=30, help="allowed hits per window")
+    parser.add_argument("--distinct-keys", type=int, default=50000, help="distinct client keys for the memory test")
+    parser.add_argument("--max-keys", type=int, default=10000, help="LRU cap of the new limiter")
+    parser.add_argument("--processes", type=int, default=4, help="worker processes for the shared-limit check")
+    return parser.parse_args()
+
+
+def _per_hit_us(limiter, keys, limit, hits):
+    started_at = time.perf_counter()
+    for index in range(hits):
+        limiter.hit(keys[index % len(keys)], limit, _WINDOW_SECONDS)
+    return round((time.perf_counter() - started_at) / hits * 1e6, 2)
+
+
+def _retained_kib(factory, distinct_keys, limit):
+    tracemalloc.start()
+    limiter = factory()
+    for index in range(distinct_keys):
+        limiter.hit(f"login:ip:10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}", limit, _WINDOW_SECONDS)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return round(current / 1024.0, 1), len(getattr(limiter, "_entries", {}))
+
+
+def _hammer(path, limit, attempts, results):
+    limiter = SQLiteRateLimiter(path)
+    allowed = sum(0 if limiter.hit("shared:login", limit, _WINDOW_SECONDS) else 1 for _ in range(attempts))
+    results.put(allowed)
+
+
+def _shared_limit_check(path, limit, processes):
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=_hammer, args=(path, limit, limit * 2, results))
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    allowed = [results.get(timeout=120) for _ in workers]
+    for worker in workers:
+        worker.join()
+    return {"processes": processes, "limit": limit, "allowed_per_process": allowed, "allowed_total": sum(allowed)}
+
+
+def main():
+    args = _parse_args()
+    work_dir = tempfile.mkdtemp(prefix="rate-limiter-bench-")
+    sqlite_path = os.path.join(work_dir, "rate_limits.db")
+    report = {"hits": args.hits, "limit": args.limit}
+    try:
+        hot_key = ["login:ip:203.0.113.7"]
+        many_keys = [f"login:ip:198.51.{index >> 8 & 255}.{index & 255}" for index in range(1000)]
+        report["per_hit_us"] = {
+            "legacy_hot_key": _per_hit_us(LegacyRateLimiter(), hot_key, args.limit, args.hits),
+            "memory_hot_key": _per_hit_us(MemoryRateLimiter(args.max_keys), hot_key, args.limit, args.hits),
+            "sqlite_hot_key": _per_hit_us(SQLiteRateLimiter(sqlite_path, args.max_keys), hot_key, args.limit, args.hits),
+            "legacy_1000_keys": _per_hit_us(LegacyRateLimiter(), many_keys, args.limit, args.hits),
+            "memory_1000_keys": _per_hit_us(MemoryRateLimiter(args.max_keys), many_keys, args.limit, args.hits),
+            "sqlite_1000_keys": _per_hit_us(SQLiteRateLimiter(sqlite_path, args.max_keys), many_keys, args.limit, args.hits),
+        }
+        legacy_kib, legacy_keys = _retained_kib(LegacyRateLimiter, args.distinct_keys, args.limit)
+        memory_kib, memory_keys = _retained_kib(lambda: MemoryRateLimiter(args.max_keys), args.distinct_keys, args.limit)
+        report["retained_after_distinct_keys"] = {
+            "distinct_keys": args.distinct_keys,
+            "legacy": {"kib": legacy_kib, "keys": legacy_keys},
+            "memory": {"kib": memory_kib, "keys": memory_keys},
+        }
+
+        shared_path = os.path.join(work_dir, "shared.db")
+        report["shared_limit"] = _shared_limit_check(shared_path, args.limit, args.processes)
+        report["ok"] = (
+            report["shared_limit"]["allowed_total"] == args.limit
+            and memory_keys <= args.max_keys
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if not report["ok"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""用本地桩服务验证 AI 多采样的并发与延迟预算。
+
+检查两件事:
+1. 每次补全耗时 delay 秒时，N 个采样的总耗时接近 delay 而不是 N * delay；
+2. delay 超过预算时，收集在预算到期后立即返回，不会等到慢请求结束。
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+for path in (ROOT_DIR, SCRIPT_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+try:
+    import app as app_module
+    from ai_stub_server import start_stub_server
+except ModuleNotFoundError as exc:
+    missing = getattr(exc, "name", "") or str(exc)
+    print(json.dumps({"error": f"Missing dependency: {missing}"}, ensure_ascii=False, indent=2))
+    raise SystemExit(1)
+
+
+def _run_case(api_url, samples, budget):
+    ai_config = {"api_url": api_url, "api_key": "stub", "model": "stub-model"}
+    temperatures = app_module._build_ai_sampling_temperatures(0.35, samples)
+    started_at = time.perf_counter()
+    responses = app_module._collect_ai_completions(
+        ai_config,
+        "stub prompt",
+        temperatures,
+        region="hk",
+        deadline=started_at + budget,
+    )
+    return responses, time.perf_counter() - started_at
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify concurrent AI sampling against the latency budget.")
+    parser.add_argument("--samples", type=int, default=4)
+    parser.add_argument("--delay", type=float, default=2.0)
+    parser.add_argument("--budget", type=float, default=6.0)
+    args = parser.parse_args()
+
+    stats = {}
+    fast_server, fast_url = start_stub_server(delay=args.delay, seed=7, stats=stats)
+    slow_server, slow_url = start_stub_server(delay=args.budget * 2, seed=7)
+    report = {"samples": args.samples, "delay": args.delay, "budget": args.budget}
+    ok = True
+    try:
+        with app_module.app.app_context():
+            responses, elapsed = _run_case(fast_url, args.samples, args.budget)
+            expected_waves = -(-args.samples // app_module._AI_SAMPLE_MAX_WORKERS)
+            report["concurrent"] = {
+                "responses": len(responses),
+                "elapsed": round(elapsed, 2),
+                "serial_estimate": round(args.samples * args.delay, 2),
+                "max_in_flight": stats.get("max_in_flight", 0),
+            }
+            ok &= len(responses) == args.samples and elapsed < expected_waves * args.delay + 1.0
+
+            responses, elapsed = _run_case(slow_url, args.samples, args.budget)
+            report["over_budget"] = {"responses": len(responses), "elapsed": round(elapsed, 2)}
+            ok &= not responses and elapsed < args.budget + 1.0
+    finally:
+        fast_server.shutdown()
+        slow_server.shutdown()
+
+    report["ok"] = bool(ok)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
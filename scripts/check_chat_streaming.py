@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""用本地桩服务对比 /api/chat 阻塞模式与 SSE 流式模式。
+
+并发发起 N 个聊天请求，分别记录客户端看到的首字节时间和整段耗时，
+并输出服务端 get_ai_chat_metrics() 统计的首字节时间与工作线程占用时长。
+流式模式的首字节时间应接近上游首个增量到达的时间，而不是整段回复完成的时间。
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+for path in (ROOT_DIR, SCRIPT_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+try:
+    import app as app_module
+    from ai_stub_server import start_stub_server
+    from models import User
+except ModuleNotFoundError as exc:
+    missing = getattr(exc, "name", "") or str(exc)
+    print(json.dumps({"error": f"Missing dependency: {missing}"}, ensure_ascii=False, indent=2))
+    raise SystemExit(1)
+
+
+def _resolve_user_id(user_id):
+    if user_id:
+        return user_id
+    with app_module.app.app_context():
+        for user in User.query.order_by(User.id.asc()).all():
+            user.check_and_update_activation_status()
+            if user.is_active:
+                return user.id
+    return None
+
+
+def _chat_once(user_id, stream, results, index):
+    client = app_module.app.test_client()
+    with client.session_transaction() as session_state:
+        session_state["user_id"] = user_id
+        session_state["_csrf_token"] = "chat-streaming-check"
+    started_at = time.perf_counter()
+    first_byte_at = None
+    body = b""
+    response = client.post(
+        "/api/chat?stream=1" if stream else "/api/chat",
+        json={"message": f"第{index}个问题：最近的号码分布有什么特点？"},
+        headers={"X-CSRFToken": "chat-streaming-check"},
+        buffered=False,
+    )
+    for chunk in response.response:
+        if first_byte_at is None and chunk:
+            first_byte_at = time.perf_counter()
+        body += chunk if isinstance(chunk, bytes) else chunk.encode("utf-8")
+    response.close()
+    finished_at = time.perf_counter()
+    results[index] = {
+        "status": response.status_code,
+        "ttfb_ms": round(((first_byte_at or finished_at) - started_at) * 1000.0, 1),
+        "elapsed_ms": round((finished_at - started_at) * 1000.0, 1),
+        "bytes": len(body),
+    }
+
+
+def _run_mode(user_id, stream, concurrency):
+    results = [None] * concurrency
+    threads = [
+        threading.Thread(target=_chat_once, args=(user_id, stream, results, index), daemon=True)
+        for index in range(concurrency)
+    ]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+    ttfbs = sorted(item["ttfb_ms"] for item in results)
+    return {
+        "wall_seconds": round(elapsed, 2),
+        "statuses": sorted({item["status"] for item in results}),
+        "ttfb_ms_median": ttfbs[len(ttfbs) // 2],
+        "ttfb_ms_max": ttfbs[-1],
+        "elapsed_ms_max": max(item["elapsed_ms"] for item in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare blocking and streaming /api/chat against a local stub.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--delay", type=float, default=0.3, help="stub latency before the first chunk")
+    parser.add_argument("--chunk-interval", type=float, default=0.1, help="stub latency between chunks")
+    parser.add_argument("--user-id", type=int, default=0, help="active user for the session, defaults to the first one")
+    args = parser.parse_args()
+
+    user_id = _resolve_user_id(args.user_id)
+    if not user_id:
+        print(json.dumps({"error": "没有可用的已激活用户"}, ensure_ascii=False, indent=2))
+        raise SystemExit(1)
+
+    server, stub_url = start_stub_server(delay=args.delay, seed=5, chunk_interval=args.chunk_interval)
+    stub_config = {"api_url": stub_url, "api_key": "stub", "model": "stub-model"}
+    app_module.get_ai_config = lambda: dict(stub_config)
+    report = {"concurrency": args.concurrency, "delay": args.delay, "chunk_interval": args.chunk_interval}
+    try:
+        report["blocking"] = _run_mode(user_id, False, args.concurrency)
+        report["stream"] = _run_mode(user_id, True, args.concurrency)
+    finally:
+        server.shutdown()
+    report["server_metrics"] = {
+        key: value for key, value in app_module.get_ai_chat_metrics().items() if key != "recent_calls"
+    }
+    report["ok"] = (
+        report["blocking"]["statuses"] == [200]
+        and report["stream"]["statuses"] == [200]
+        and report["stream"]["ttfb_ms_median"] < report["blocking"]["ttfb_ms_median"]
+    )
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if not report["ok"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
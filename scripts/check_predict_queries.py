@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""统计 /api/predict 每次请求执行的 SQL 条数与耗时。
+
+在临时目录里复制一份数据库后导入应用，对每个策略先请求一次（生成并保存预测），
+再重复请求若干次（命中已有记录），分别输出首次与重复访问的 SQL 条数和耗时。
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Count SQL statements issued per /api/predict request.")
+    parser.add_argument("--db", default=os.path.join(ROOT_DIR, "data", "lottery_system.db"))
+    parser.add_argument("--region", default="hk", choices=["hk", "macau"])
+    parser.add_argument("--strategies", default="hot,balanced,ml")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--user-id", type=int, default=0, help="active user for the session, defaults to the first one")
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+    if not os.path.exists(args.db):
+        print(json.dumps({"error": f"数据库不存在: {args.db}"}, ensure_ascii=False, indent=2))
+        raise SystemExit(1)
+
+    work_dir = tempfile.mkdtemp(prefix="predict-queries-")
+    os.makedirs(os.path.join(work_dir, "data"))
+    shutil.copyfile(args.db, os.path.join(work_dir, "data", "lottery_system.db"))
+    os.chdir(work_dir)
+    os.environ["ENABLE_SCHEDULER"] = "0"
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+
+    try:
+        import app as app_module
+        from models import User, db
+        from sqlalchemy import event
+    except ModuleNotFoundError as exc:
+        missing = getattr(exc, "name", "") or str(exc)
+        print(json.dumps({"error": f"Missing dependency: {missing}"}, ensure_ascii=False, indent=2))
+        raise SystemExit(1)
+
+    statements = []
+    with app_module.app.app_context():
+        event.listen(db.engine, "before_cursor_execute", lambda *event_args: statements.append(1))
+        user_id = args.user_id
+        if not user_id:
+            for user in User.query.order_by(User.is_admin.desc(), User.id.asc()).all():
+                user.check_and_update_activation_status()
+                if user.is_active:
+                    user_id = user.id
+                    break
+    if not user_id:
+        print(json.dumps({"error": "没有可用的已激活用户"}, ensure_ascii=False, indent=2))
+        raise SystemExit(1)
+
+    client = app_module.app.test_client()
+    with client.session_transaction() as session_state:
+        session_state["user_id"] = user_id
+
+    def _request(strategy):
+        statements.clear()
+        started_at = time.perf_counter()
+        response = client.get("/api/predict", query_string={"region": args.region, "strategy": strategy})
+        elapsed_ms = (time.perf_counter() - started_at) * 1000.0
+        payload = response.get_json(silent=True) or {}
+        return {
+            "status": response.status_code,
+            "queries": len(statements),
+            "elapsed_ms": round(elapsed_ms, 1),
+            "special": str((payload.get("special") or {}).get("number") or ""),
+            "digest": hashlib.md5(json.dumps(payload, ensure_ascii=True, sort_keys=True).encode("utf-8")).hexdigest()[:12],
+        }
+
+    report = {"region": args.region, "strategies": {}}
+    try:
+        for strategy in [item.strip() for item in args.strategies.split(",") if item.strip()]:
+            first = _request(strategy)
+            repeats = [_request(strategy) for _ in range(max(1, args.repeats))]
+            report["strategies"][strategy] = {
+                "first": first,
+                "repeat_queries": [item["queries"] for item in repeats],
+                "repeat_elapsed_ms": [item["elapsed_ms"] for item in repeats],
+                "repeat_digest": repeats[0]["digest"],
+                "repeat_stable": all(item["digest"] == repeats[0]["digest"] for item in repeats),
+            }
+    finally:
+        os.chdir(ROOT_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""用真实的 gunicorn 进程验证长连接 SSE 推送不会拖慢短请求。
+
+在临时目录里复制一份数据库，把 AI 接口指向本地桩服务，按 gunicorn.conf.py 启动应用：
+1. 先在空闲状态下连续请求 /api/draws，得到短请求的基线延迟；
+2. 再同时打开 N 个 /api/chat?stream=1 流式连接，在它们推送期间重复短请求。
+gthread/gevent 模式下第二阶段的短请求延迟应与基线同一量级；
+用 --worker-class sync 运行可以看到流式连接占满 worker 后短请求被排队。
+"""
+
+import argparse
+import json
+import os
+import secrets
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+
+from ai_stub_server import start_stub_server  # noqa: E402
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Load-test concurrent SSE streams against short API requests.")
+    parser.add_argument("--worker-class", default="gthread", choices=["sync", "gthread", "gevent"])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--streams", type=int, default=12, help="concurrent /api/chat?stream=1 connections")
+    parser.add_argument("--short-requests", type=int, default=30, help="short requests per phase")
+    parser.add_argument("--delay", type=float, default=0.3, help="stub latency before the first chunk")
+    parser.add_argument("--chunk-interval", type=float, default=0.3, help="stub latency between chunks")
+    parser.add_argument("--db", default=os.path.join(ROOT_DIR, "data", "lottery_system.db"))
+    parser.add_argument("--max-p95-ms", type=float, default=500.0, help="allowed short-request p95 while streaming")
+    return parser.parse_args()
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _prepare_database(source_db, work_dir, stub_url):
+    data_dir = os.path.join(work_dir, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    target_db = os.path.join(data_dir, "lottery_system.db")
+    shutil.copyfile(source_db, target_db)
+    now_text = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with sqlite3.connect(target_db) as conn:
+        for key, value in (("ai_api_url", stub_url), ("ai_api_key", "stub"), ("ai_model", "stub-model")):
+            conn.execute("DELETE FROM system_config WHERE key = ?", (key,))
+            conn.execute(
+                "INSERT INTO system_config (key, value, description, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, "stream concurrency check", now_text, now_text),
+            )
+        row = conn.execute(
+            "SELECT id FROM user WHERE is_active = 1 AND (activation_expires_at IS NULL OR activation_expires_at > ?) "
+            "ORDER BY is_admin DESC, id ASC LIMIT 1",
+            (now_text,),
+        ).fetchone()
+        year_row = conn.execute("SELECT MAX(substr(draw_date, 1, 4)) FROM lottery_draws WHERE region = 'hk'").fetchone()
+    return (row[0] if row else None), (year_row[0] if year_row and year_row[0] else str(datetime.now().year))
+
+
+def _session_cookie(secret_key, user_id, csrf_token):
+    from flask import Flask
+
+    signer_app = Flask("stream-concurrency-check")
+    signer_app.secret_key = secret_key
+    serializer = signer_app.session_interface.get_signing_serializer(signer_app)
+    return serializer.dumps({"user_id": user_id, "_csrf_token": csrf_token})
+
+
+def _start_server(args, work_dir, port, secret_key):
+    env = dict(os.environ)
+    env.update({
+        "ENABLE_SCHEDULER": "0",
+        "SECRET_KEY": secret_key,
+        "PYTHONPATH": ROOT_DIR + os.pathsep + env.get("PYTHONPATH", ""),
+        "GUNICORN_BIND": f"127.0.0.1:{port}",
+        "GUNICORN_WORKER_CLASS": args.worker_class,
+        "GUNICORN_WORKERS": str(args.workers),
+        "GUNICORN_THREADS": str(args.threads),
+    })
+    log_file = open(os.path.join(work_dir, "gunicorn.log"), "w", encoding="utf-8")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT_DIR, "gunicorn.conf.py"), "app:app"],
+        cwd=work_dir,
+        env=env,
+        stdout=log_file,
+        stderr=subprocess.STDOUT,
+    )
+    return process, log_file
+
+
+def _wait_ready(base_url, process, timeout_seconds=180):
+    deadline = time.time() + timeout_seconds
+    while time.time() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            requests.get(f"{base_url}/auth/login", timeout=2)
+            return True
+        except requests.RequestException:
+            time.sleep(0.5)
+    return False
+
+
+def _percentile(values, ratio):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round((len(ordered) - 1) * ratio)))]
+
+
+def _short_request_phase(base_url, cookies, year, count):
+    latencies = []
+    statuses = set()
+    with requests.Session() as http:
+        http.cookies.update(cookies)
+        for index in range(count):
+            started_at = time.perf_counter()
+            response = http.get(
+                f"{base_url}/api/draws",
+                params={"region": "hk", "year": year, "page": 1 + index % 3, "pageSize": 20},
+                timeout=120,
+            )
+            latencies.append((time.perf_counter() - started_at) * 1000.0)
+            statuses.add(response.status_code)
+    return {
+        "statuses": sorted(statuses),
+        "p50_ms": round(_percentile(latencies, 0.5), 1),
+        "p95_ms": round(_percentile(latencies, 0.95), 1),
+        "max_ms": round(max(latencies), 1),
+    }
+
+
+def _open_stream(base_url, cookies, csrf_token, index, results, first_byte_barrier):
+    started_at = time.perf_counter()
+    first_byte_at = None
+    item = {"status": None, "events": 0, "done": False}
+    try:
+        with requests.post(
+            f"{base_url}/api/chat",
+            params={"stream": "1"},
+            json={"message": f"第{index}个并发流式问题"},
+            headers={"X-CSRFToken": csrf_token},
+            cookies=cookies,
+            stream=True,
+            timeout=300,
+        ) as response:
+            item["status"] = response.status_code
+            for line in response.iter_lines(chunk_size=1, decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                if first_byte_at is None:
+                    first_byte_at = time.perf_counter()
+                    first_byte_barrier.release()
+                item["events"] += 1
+                payload = json.loads(line[5:].strip())
+                if payload.get("type") == "done":
+                    item["done"] = True
+    except requests.RequestException as exc:
+        item["error"] = str(exc)
+    finally:
+        if first_byte_at is None:
+            first_byte_barrier.release()
+    finished_at = time.perf_counter()
+    item["ttfb_ms"] = round(((first_byte_at or finished_at) - started_at) * 1000.0, 1)
+    item["elapsed_ms"] = round((finished_at - started_at) * 1000.0, 1)
+    item["finished_at"] = finished_at
+    results[index] = item
+
+
+def main():
+    args = _parse_args()
+    if not os.path.exists(args.db):
+        print(json.dumps({"error": f"数据库不存在: {args.db}"}, ensure_ascii=False, indent=2))
+        raise SystemExit(1)
+
+    stub_server, stub_url = start_stub_server(delay=args.delay, seed=9, chunk_interval=args.chunk_interval)
+    work_dir = tempfile.mkdtemp(prefix="stream-concurrency-")
+    process = log_file = None
+    report = {
+        "worker_class": args.worker_class,
+        "workers": args.workers,
+        "threads": args.threads,
+        "streams": args.streams,
+    }
+    try:
+        user_id, year = _prepare_database(args.db, work_dir, stub_url)
+        if not user_id:
+            report["error"] = "没有可用的已激活用户"
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+            raise SystemExit(1)
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        secret_key = secrets.token_hex(32)
+        csrf_token = secrets.token_hex(16)
+        cookies = {"session": _session_cookie(secret_key, user_id, csrf_token)}
+        process, log_file = _start_server(args, work_dir, port, secret_key)
+        if not _wait_ready(base_url, process):
+            report["error"] = f"gunicorn 启动失败，日志见 {os.path.join(work_dir, 'gunicorn.log')}"
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+            raise SystemExit(1)
+
+        # 预热：每个 worker 各自加载一遍开奖数据缓存
+        _short_request_phase(base_url, cookies, year, args.workers * 2)
+        report["idle"] = _short_request_phase(base_url, cookies, year, args.short_requests)
+
+        results = [None] * args.streams
+        first_byte_barrier = threading.Semaphore(0)
+        stream_threads = [
+            threading.Thread(
+                target=_open_stream,
+                args=(base_url, cookies, csrf_token, index, results, first_byte_barrier),
+                daemon=True,
+            )
+            for index in range(args.streams)
+        ]
+        for thread in stream_threads:
+            thread.start()
+        # 等所有流都开始推送后再测短请求；sync 模式下排不上的流不会推送，最多等 5 秒
+        waited_until = time.perf_counter() + 5.0
+        for _ in range(args.streams):
+            if not first_byte_barrier.acquire(timeout=max(0.0, waited_until - time.perf_counter())):
+                break
+        measured_at = time.perf_counter()
+        report["streaming"] = _short_request_phase(base_url, cookies, year, args.short_requests)
+        measured_until = time.perf_counter()
+        for thread in stream_threads:
+            thread.join()
+
+        report["streaming"]["streams_still_open_after_phase"] = sum(
+            1 for item in results if item and item["finished_at"] > measured_until
+        )
+        report["stream_results"] = {
+            "statuses": sorted({item["status"] for item in results if item}),
+            "completed": sum(1 for item in results if item and item["done"]),
+            "ttfb_ms_p50": _percentile([item["ttfb_ms"] for item in results if item], 0.5),
+            "ttfb_ms_max": max(item["ttfb_ms"] for item in results if item),
+            "elapsed_ms_max": max(item["elapsed_ms"] for item in results if item),
+            "phase_started_after_ms": round((measured_at - min(
+                item["finished_at"] - item["elapsed_ms"] / 1000.0 for item in results if item
+            )) * 1000.0, 1),
+        }
+        report["ok"] = (
+            report["idle"]["statuses"] == [200]
+            and report["streaming"]["statuses"] == [200]
+            and report["stream_results"]["completed"] == args.streams
+            and report["streaming"]["p95_ms"] <= args.max_p95_ms
+        )
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=20)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if log_file is not None:
+            log_file.close()
+        stub_server.shutdown()
+        if report.get("ok"):
+            shutil.rmtree(work_dir, ignore_errors=True)
+        else:
+            report["work_dir"] = work_dir
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if not report["ok"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ let currentPage = 1;
 const pageSize = 20;
 let allDraws = []; // 存储所有获取到的数据
 let hasMoreData = true; // 标记是否还有更多数据可加载
+let nextDrawsCursor = null; // 服务端 X-Next-Cursor：指向 allDraws 最后一条之后，翻页时按游标续取
 let currentSearchTerm = '';
 let isSearchActive = false;
 
@@ -51,7 +52,7 @@ function updateLoadMoreButton() {
     const loadMoreBtn = document.getElementById('loadMoreBtn');
     if (!loadMoreBtn) return;
 
-    const hasMore = allDraws.length > currentPage * pageSize;
+    const hasMore = allDraws.length > currentPage * pageSize || (!isSearchActive && Boolean(nextDrawsCursor));
     loadMoreBtn.style.display = hasMore ? 'inline-block' : 'none';
     loadMoreBtn.disabled = false;
 }
@@ -420,17 +421,17 @@ function fetchDraws() {
     
     console.log(`正在获取开奖记录: 地区=${region}, 年份=${year}`);
     
-    // 添加当前时间戳，避免缓存
-    const timestamp = new Date().getTime();
-    const url = `/api/draws?region=${region}&year=${year}&_=${timestamp}`;
+    // 服务端按开奖标记返回 ETag，no-cache 让浏览器每次带 If-None-Match 校验，未变化时只回 304
+    const url = `/api/draws?region=${region}&year=${year}`;
     console.log(`API请求URL: ${url}`);
     
-    fetch(url)
+    fetch(url, { cache: 'no-cache' })
         .then(response => {
             console.log(`API响应状态: ${response.status}`);
             if (!response.ok) {
                 throw new Error(`HTTP错误! 状态: ${response.status}`);
             }
+            nextDrawsCursor = response.headers.get('X-Next-Cursor');
             return response.json();
         })
         .then(data => {
@@ -499,21 +500,37 @@ function loadMoreData() {
 
     // 增加页码
     currentPage++;
+
+    // 首次请求多取的记录先在本地翻完，再按游标向服务端续取
+    const start = (currentPage - 1) * pageSize;
+    if (allDraws.length > start) {
+        displayDraws(allDraws.slice(start, start + pageSize), true);
+        if (loadMoreBtn) {
+            loadMoreBtn.innerHTML = '<i class="fas fa-sync-alt"></i> 查看更多';
+            loadMoreBtn.disabled = false;
+        }
+        return;
+    }
+    if (!nextDrawsCursor) {
+        if (loadMoreBtn) {
+            loadMoreBtn.style.display = 'none';
+        }
+        return;
+    }
     
     // 获取当前选择的地区和年份
     const region = document.querySelector('.region-btn.active')?.dataset.region || 'macau';
     const year = document.getElementById('yearSelect')?.value || 'all';
     
-    // 添加当前时间戳，避免缓存
-    const timestamp = new Date().getTime();
-    const url = `/api/draws?region=${region}&year=${year}&page=${currentPage}&pageSize=${pageSize}&_=${timestamp}`;
+    const url = `/api/draws?region=${region}&year=${year}&pageSize=${pageSize}&cursor=${encodeURIComponent(nextDrawsCursor)}`;
     console.log(`加载更多数据: ${url}`);
     
-    fetch(url)
+    fetch(url, { cache: 'no-cache' })
         .then(response => {
             if (!response.ok) {
                 throw new Error(`HTTP错误! 状态: ${response.status}`);
             }
+            nextDrawsCursor = response.headers.get('X-Next-Cursor');
             return response.json();
         })
         .then(data => {
@@ -0,0 +1,155 @@
+"""Lightweight stage timing for the prediction pipeline.
+
+``span(name)`` times a block and ``traced(name)`` times a whole function. Spans nest
+through a ContextVar, so a stage is recorded under its full path such as
+``local.ml/ml.artifacts/ml.optimize_runtime/ml.train_model``. Every finished span
+feeds a per-process rolling window (``stage_stats``) used for the admin percentiles;
+the outermost caller can also read the timings of its own call from the span it got.
+"""
+
+import functools
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+PATH_SEPARATOR = '/'
+DEFAULT_WINDOW = 256
+DEFAULT_MAX_STAGES = 200
+
+_active_span = ContextVar('prediction_active_span', default=None)
+
+
+class Span:
+    """One timed block; collects its own and its descendants' durations by path."""
+
+    __slots__ = ('name', 'path', 'started_at', 'elapsed', '_stages')
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.path = f"{parent.path}{PATH_SEPARATOR}{name}" if parent is not None else name
+        self.started_at = time.perf_counter()
+        self.elapsed = None
+        # path -> [total_seconds, calls]; the span itself first, then stages in the order they finished.
+        self._stages = OrderedDict()
+
+    def _add(self, path, seconds, calls=1):
+        entry = self._stages.get(path)
+        if entry is None:
+            self._stages[path] = [seconds, calls]
+        else:
+            entry[0] += seconds
+            entry[1] += calls
+
+    def timings(self):
+        """Stage rows for this span with paths relative to its parent."""
+        rows = []
+        prefix_length = len(self.path) - len(self.name)
+        for path, (seconds, calls) in self._stages.items():
+            rows.append({
+                "stage": path[prefix_length:],
+                "ms": round(seconds * 1000.0, 2),
+                "calls": calls,
+            })
+        return rows
+
+
+class StageStats:
+    """Rolling window of recent durations per stage path, bounded in stages and samples."""
+
+    def __init__(self, window=DEFAULT_WINDOW, max_stages=DEFAULT_MAX_STAGES):
+        self.window = max(1, int(window))
+        self.max_stages = max(1, int(max_stages))
+        self._lock = threading.Lock()
+        self._stages = OrderedDict()
+
+    def observe(self, path, seconds):
+        now = time.time()
+        with self._lock:
+            entry = self._stages.pop(path, None)
+            if entry is None:
+                entry = {"samples": deque(maxlen=self.window), "calls": 0, "total": 0.0, "max": 0.0}
+            entry["samples"].append(seconds)
+            entry["calls"] += 1
+            entry["total"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            entry["last"] = seconds
+            entry["last_at"] = now
+            self._stages[path] = entry
+            while len(self._stages) > self.max_stages:
+                self._stages.popitem(last=False)
+
+    def rows(self):
+        """Per-stage summary with p50/p95 over the rolling window; children follow their parent."""
+        with self._lock:
+            snapshot = [
+                (path, sorted(entry["samples"]), dict(entry, samples=None))
+                for path, entry in self._stages.items()
+            ]
+        rows = []
+        for path, samples, entry in sorted(snapshot, key=lambda item: item[0].split(PATH_SEPARATOR)):
+            rows.append({
+                "stage": path,
+                "depth": path.count(PATH_SEPARATOR),
+                "calls": entry["calls"],
+                "window": len(samples),
+                "avg_ms": round(entry["total"] / entry["calls"] * 1000.0, 2),
+                "p50_ms": round(_percentile(samples, 0.50) * 1000.0, 2),
+                "p95_ms": round(_percentile(samples, 0.95) * 1000.0, 2),
+                "max_ms": round(entry["max"] * 1000.0, 2),
+                "last_ms": round(entry["last"] * 1000.0, 2),
+                "last_at": entry["last_at"],
+                "total_seconds": round(entry["total"], 6),
+            })
+        return rows
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+
+
+def _percentile(sorted_samples, quantile):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, max(0, int(round(quantile * (len(sorted_samples) - 1)))))
+    return float(sorted_samples[index])
+
+
+stage_stats = StageStats()
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as stage ``name`` nested under the current span, if any."""
+    parent = _active_span.get()
+    current = Span(name, parent)
+    token = _active_span.set(current)
+    try:
+        yield current
+    finally:
+        _active_span.reset(token)
+        current.elapsed = time.perf_counter() - current.started_at
+        current._add(current.path, current.elapsed)
+        current._stages.move_to_end(current.path, last=False)
+        stage_stats.observe(current.path, current.elapsed)
+        if parent is not None:
+            for path, (seconds, calls) in current._stages.items():
+                parent._add(path, seconds, calls)
+
+
+def traced(name=None):
+    """Decorator form of ``span``; the stage name defaults to the function name."""
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span():
+    return _active_span.get()
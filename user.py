@@ -15,7 +15,9 @@ import urllib3
 import threading
 import time
 from collections import OrderedDict
+from cache_registry import cache_registry
 from notification_service import cleanup_expired_station_notifications, get_user_notification_config, save_user_notification_config
+from pagination import paginate_keyset
 from auth import _github_login_enabled
 
 user_bp = Blueprint('user', __name__, url_prefix='/user')
@@ -28,6 +30,39 @@ _backtest_refresh_state = {}
 _ml_stats_cache_lock = threading.Lock()
 _ml_stats_cache = {}
 
+
+def _clear_backtest_refresh_state(region=None):
+    # 正在跑的刷新保留状态，否则会再起一个重复的刷新线程。
+    with _backtest_refresh_lock:
+        for key in [
+            key
+            for key, state in _backtest_refresh_state.items()
+            if not state.get('running') and (not region or key == region)
+        ]:
+            _backtest_refresh_state.pop(key, None)
+
+
+def _clear_ml_stats_cache(region=None):
+    with _ml_stats_cache_lock:
+        _ml_stats_cache.clear()
+
+
+_ml_stats_cache_stats = cache_registry.register(
+    'user_ml_stats',
+    '用户机器学习战绩',
+    items=lambda: _ml_stats_cache.items(),
+    clear=_clear_ml_stats_cache,
+)
+# 命中表示距上次刷新不足间隔而跳过，未命中表示起了一次后台回测刷新。
+_backtest_refresh_stats = cache_registry.register(
+    'backtest_refresh',
+    '回测快照刷新节流',
+    items=lambda: _backtest_refresh_state.items(),
+    clear=_clear_backtest_refresh_state,
+    group_of=lambda key, state: key,
+    regional=True,
+)
+
 MACAU_COLLECTION_NUMBER_URL = 'https://162.218.28.228:1150/bbs/113.htm'
 MACAU_COLLECTION_ZODIAC_URL = 'https://162.218.28.228:1150/bbs/180.htm'
 MACAU_COLLECTION_URLS = {
@@ -1000,10 +1035,13 @@ def _kickoff_backtest_snapshot_refresh(region):
     with _backtest_refresh_lock:
         state = _backtest_refresh_state.get(region_key) or {}
         if state.get("running"):
+            _backtest_refresh_stats.hit()
             return
         last_started = float(state.get("started_at") or 0.0)
         if now - last_started < _BACKTEST_REFRESH_INTERVAL_SECONDS:
+            _backtest_refresh_stats.hit()
             return
+        _backtest_refresh_stats.miss()
         _backtest_refresh_state[region_key] = {
             "running": True,
             "started_at": now,
@@ -1736,7 +1774,7 @@ def _decorate_ml_prediction(prediction):
     )
     return prediction
 
-def _get_ml_predictions_page(user_id, page=1, region='', period='', result='', start_date='', end_date=''):
+def _get_ml_predictions_page(user_id, page=1, region='', period='', result='', start_date='', end_date='', cursor=''):
     return _get_strategy_predictions_page(
         user_id,
         'ml',
@@ -1746,10 +1784,11 @@ def _get_ml_predictions_page(user_id, page=1, region='', period='', result='', s
         result=result,
         start_date=start_date,
         end_date=end_date,
+        cursor=cursor,
     )
 
 
-def _get_strategy_predictions_page(user_id, strategy, page=1, region='', period='', result='', start_date='', end_date=''):
+def _get_strategy_predictions_page(user_id, strategy, page=1, region='', period='', result='', start_date='', end_date='', cursor=''):
     query = _build_strategy_prediction_query(
         user_id,
         strategy,
@@ -1760,29 +1799,16 @@ def _get_strategy_predictions_page(user_id, strategy, page=1, region='', period=
         end_date=end_date,
     )
 
-    records_per_page = 12
-    total_records = query.count()
-    total_pages = max(1, (total_records + records_per_page - 1) // records_per_page)
-    current_page = min(max(page, 1), total_pages)
-    start_index = (current_page - 1) * records_per_page
-
-    items = query.order_by(
-        PredictionRecord.created_at.desc(),
-        PredictionRecord.id.desc()
-    ).offset(start_index).limit(records_per_page).all()
-
-    items = [_decorate_ml_prediction(item) for item in items]
-    return SimpleNamespace(
-        items=items,
-        page=current_page,
-        per_page=records_per_page,
-        total=total_records,
-        pages=total_pages,
-        has_prev=current_page > 1,
-        has_next=current_page < total_pages,
-        prev_num=current_page - 1 if current_page > 1 else None,
-        next_num=current_page + 1 if current_page < total_pages else None,
+    predictions = paginate_keyset(
+        query,
+        (PredictionRecord.created_at, PredictionRecord.id),
+        page,
+        12,
+        query.count(),
+        cursor=cursor,
     )
+    predictions.items = [_decorate_ml_prediction(item) for item in predictions.items]
+    return predictions
 
 def _get_ml_stats(user_id):
     cache_key = int(user_id)
@@ -1790,7 +1816,9 @@ def _get_ml_stats(user_id):
     with _ml_stats_cache_lock:
         cached = _ml_stats_cache.get(cache_key)
         if cached and now - cached.get('created_at', 0) < _ML_STATS_CACHE_TTL_SECONDS:
+            _ml_stats_cache_stats.hit()
             return cached['data']
+    _ml_stats_cache_stats.miss()
 
     def _row_exact_hit(row):
         return str(row.special_number or '').strip() == str(row.actual_special_number or '').strip()
@@ -2530,6 +2558,7 @@ def ml_records():
             result=result,
             start_date=start_date,
             end_date=end_date,
+            cursor=request.args.get('cursor', '').strip(),
         )
         zodiac_map = _get_ml_zodiac_map()
 
@@ -2820,6 +2849,7 @@ def ml_records_list():
             result=result,
             start_date=start_date,
             end_date=end_date,
+            cursor=request.args.get('cursor', '').strip(),
         )
     except ValueError as exc:
         return jsonify({'success': False, 'message': str(exc)}), 400
@@ -2849,6 +2879,7 @@ def ml_records_list():
         'page': predictions.page,
         'pages': predictions.pages,
         'total': predictions.total,
+        'next_cursor': predictions.next_cursor,
     })
 
 
@@ -2875,6 +2906,7 @@ def markov_records():
             result=result,
             start_date=start_date,
             end_date=end_date,
+            cursor=request.args.get('cursor', '').strip(),
         )
         zodiac_map = _get_ml_zodiac_map()
 
@@ -2948,6 +2980,7 @@ def markov_records_list():
             result=result,
             start_date=start_date,
             end_date=end_date,
+            cursor=request.args.get('cursor', '').strip(),
         )
     except ValueError as exc:
         return jsonify({'success': False, 'message': str(exc)}), 400
@@ -2981,6 +3014,7 @@ def markov_records_list():
         'page': predictions.page,
         'pages': predictions.pages,
         'total': predictions.total,
+        'next_cursor': predictions.next_cursor,
     })
 
 @user_bp.route('/save-prediction', methods=['POST'])